@@ -0,0 +1,124 @@
+"""
+Step time of every gan_SR.py architecture with and without XLA.
+
+Each (architecture, XLA mode) pair trains for a few hundred iterations in its
+own process and run directory, --repeats times, with the modes interleaved so
+drift hits all of them alike. The per-iteration 'time' that gan_SR.py plots
+(generator step plus critic steps, without image dumps or evaluation) is read
+back from the run's lib.plot log, and its median after a warm-up, which
+covers XLA compilation, is tabulated: the median over repeats, their min and
+max, and the speedup over the non-XLA runs. Modes whose first steps after
+the warm-up are much slower than their median are flagged, since compilation
+then likely went on past the warm-up.
+
+    python benchmark_xla.py --data_dir=data/celebA_64x64 --iters=200 \
+        --repeats=3 --architectures=0,1,2 --out=xla_benchmark.tsv
+"""
+
+import os, sys
+sys.path.append(os.getcwd())
+
+import argparse
+import csv
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+import tflib.plot
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+N_ARCHITECTURES = 7
+XLA_MODES = ['', 'auto', 'scopes']
+# Mean of the first steps after the warm-up, relative to the run's median,
+# above which compilation is taken to have outlasted the warm-up
+COMPILE_CHECK_STEPS = 5
+COMPILE_SUSPECT_RATIO = 2.
+# Lines of a failed run's output to show
+FAILURE_TAIL = 20
+
+def run(architecture, xla, args):
+    """returns: per-iteration step times in seconds, in iteration order"""
+    run_dir = tempfile.mkdtemp(prefix='xla_{}_{}_'.format(architecture, xla or 'off'))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = REPO_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    command = [
+        sys.executable, os.path.join(REPO_DIR, 'gan_SR.py'),
+        '--architecture={}'.format(architecture),
+        '--xla={}'.format(xla),
+        '--max_iter={}'.format(args.iters),
+        '--max_runtime=100000',
+        '--data_dir={}'.format(os.path.abspath(args.data_dir)),
+        '--data_format={}'.format(args.data_format),
+        '--eval_size=0',
+        '--checkpoint_every=0',
+    ]
+    stdout_path = os.path.join(run_dir, 'stdout.txt')
+    with open(stdout_path, 'w') as log:
+        returncode = subprocess.call(command, cwd=run_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    if returncode != 0:
+        # Keep the run directory for inspection
+        with open(stdout_path) as log:
+            tail = log.readlines()[-FAILURE_TAIL:]
+        raise Exception('gan_SR.py --architecture={} --xla={} exited with {} (run dir {}):\n{}'.format(
+            architecture, xla, returncode, run_dir, ''.join(tail)))
+    iters, times = tflib.plot.read_log('time', os.path.join(run_dir, tflib.plot.LOG_DIR))
+    if not args.keep_runs:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return times[np.argsort(iters, kind='mergesort')]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--data_dir', default='data/celebA_64x64')
+    parser.add_argument('--iters', type=int, default=200, help="training iterations per run")
+    parser.add_argument('--warmup', type=int, default=50, help="iterations excluded from the timings")
+    parser.add_argument('--repeats', type=int, default=3, help="runs per architecture and XLA mode")
+    parser.add_argument('--architectures', default=','.join(str(i) for i in range(N_ARCHITECTURES)))
+    parser.add_argument('--data_format', default='NCHW')
+    parser.add_argument('--out', default='xla_benchmark.tsv')
+    parser.add_argument('--keep_runs', action='store_true', help="keep the run directories")
+    args = parser.parse_args()
+    if args.iters <= args.warmup:
+        raise Exception('--iters must be larger than --warmup')
+
+    architectures = [int(a) for a in args.architectures.split(',')]
+    rows = []
+    for architecture in architectures:
+        # mode -> per-repeat medians, and first steps after warm-up / median
+        medians = dict((xla, []) for xla in XLA_MODES)
+        first_ratios = dict((xla, []) for xla in XLA_MODES)
+        for repeat in range(args.repeats):
+            for xla in XLA_MODES:
+                start = time.time()
+                times = run(architecture, xla, args)[args.warmup:]
+                median = np.median(times)
+                medians[xla].append(median)
+                first_ratios[xla].append(np.mean(times[:COMPILE_CHECK_STEPS]) / median)
+                print("architecture {}\txla {}\trepeat {}\tmedian step {:.4f}s\t({:.0f}s)".format(
+                    architecture, xla or 'off', repeat, median, time.time() - start))
+                sys.stdout.flush()
+
+        baseline = np.median(medians[''])
+        for xla in XLA_MODES:
+            median = np.median(medians[xla])
+            first_ratio = max(first_ratios[xla])
+            compiling = first_ratio > COMPILE_SUSPECT_RATIO
+            rows.append([architecture, xla or 'off', len(medians[xla]), median, min(medians[xla]), max(medians[xla]),
+                         baseline / median, baseline / max(medians[xla]), baseline / min(medians[xla]),
+                         first_ratio, int(compiling)])
+            print("architecture {}\txla {}\tmedian step {:.4f}s [{:.4f}, {:.4f}]\tspeedup {:.2f}x [{:.2f}, {:.2f}]{}".format(
+                architecture, xla or 'off', median, min(medians[xla]), max(medians[xla]),
+                baseline / median, baseline / max(medians[xla]), baseline / min(medians[xla]),
+                "\tWARNING: first steps after warm-up {:.1f}x the median, raise --warmup".format(first_ratio) if compiling else ""))
+
+    with open(args.out, 'w') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(['architecture', 'xla', 'repeats', 'median_step_s', 'min_step_s', 'max_step_s',
+                         'speedup', 'min_speedup', 'max_speedup', 'first_step_ratio', 'compile_suspect'])
+        writer.writerows(rows)
+    print("Wrote {}".format(args.out))
+
+if __name__ == '__main__':
+    main()
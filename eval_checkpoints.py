@@ -0,0 +1,227 @@
+"""
+Offline sample-quality evaluation of saved generator checkpoints.
+
+Training scripts save their generator with tflib.checkpoint (gan_SR.py and
+gan_cifar_resnet.py do): one meta graph per run directory plus a checkpoint
+per save. This script samples from every checkpoint in such a directory,
+computes FID, KID, precision/recall and optionally Inception score, and writes
+one row per checkpoint to a tab-separated results table.
+
+Checkpoints are spread over a pool of worker processes. Each worker loads the
+Inception graph once and reuses it for all of its checkpoints, and real-data
+statistics are computed once up front into the on-disk caches of tflib.fid and
+tflib.feature_index.
+
+    python eval_checkpoints.py checkpoints/arch0_20170601-120000 --dataset=celebA \
+        --data_dir=data/celebA_64x64 --workers=2 --gpus=0,1
+"""
+
+import os, sys
+sys.path.append(os.getcwd())
+
+import argparse
+import csv
+import glob
+import itertools
+import multiprocessing
+import re
+import time
+
+import numpy as np
+
+# TensorFlow and tflib are only imported inside worker processes, after
+# CUDA_VISIBLE_DEVICES has been set for them.
+
+IMAGE_SHAPES = {
+    'cifar10': (3, 32, 32),
+    'celebA': (3, 64, 64),
+}
+METRICS = ['fid', 'kid', 'precision_recall', 'inception']
+
+_config = {}
+
+def list_checkpoints(checkpoint_dir):
+    """returns: [(iteration, checkpoint path)] sorted by iteration"""
+    checkpoints = []
+    for index_file in glob.glob(os.path.join(checkpoint_dir, '*.index')):
+        path = index_file[:-len('.index')]
+        match = re.search(r'-(\d+)$', path)
+        iteration = int(match.group(1)) if match else -1
+        checkpoints.append((iteration, path))
+    return sorted(checkpoints)
+
+def _prepare_reference(config):
+    """Fills the real-data caches once, before any worker needs them."""
+    import tflib as lib
+    import tflib.fid
+    import tflib.feature_index
+    import tflib.precision_recall
+
+    dataset, data_dir = config['dataset'], config['data_dir']
+    if 'fid' in config['metrics']:
+        lib.fid.get_reference_statistics(dataset, data_dir)
+    if ('kid' in config['metrics']) or ('precision_recall' in config['metrics']):
+        lib.feature_index.get_real_features(dataset, data_dir)
+    if 'precision_recall' in config['metrics']:
+        lib.feature_index.get_real_radii(dataset, data_dir, lib.precision_recall.K)
+
+def _init_worker(config, devices):
+    if devices is not None:
+        os.environ['CUDA_VISIBLE_DEVICES'] = devices.get()
+    _config.update(config)
+    # Importing builds the Inception graph; every checkpoint this worker
+    # evaluates reuses it.
+    import tflib.inception_score
+
+def _sample(checkpoint_path):
+    """returns: uint8-range images of shape (n_samples, height, width, 3)"""
+    import tensorflow as tf
+    import tflib as lib
+    import tflib.checkpoint
+    import tflib.fid
+
+    dataset, n_samples = _config['dataset'], _config['n_samples']
+    image_shape = IMAGE_SHAPES[dataset]
+
+    graph = tf.Graph()
+    with graph.as_default():
+        meta_path = os.path.join(os.path.dirname(checkpoint_path), lib.checkpoint.META_FILENAME)
+        saver = tf.train.import_meta_graph(meta_path, clear_devices=True)
+        samples = tf.get_collection(lib.checkpoint.SAMPLES_COLLECTION)[0]
+        inputs = tf.get_collection(lib.checkpoint.INPUTS_COLLECTION)
+    config = tf.ConfigProto(allow_soft_placement=True)
+    config.gpu_options.allow_growth = True
+    session = tf.Session(graph=graph, config=config)
+    saver.restore(session, checkpoint_path)
+
+    if inputs:
+        # Conditional generator: feed it real images of the reference set.
+        inputs = inputs[0]
+        batch_size = inputs.get_shape().as_list()[0]
+        feeds = (
+            {inputs: images.transpose(0,3,1,2)}
+            for images in lib.fid.real_image_batches(dataset, _config['data_dir'], batch_size)
+            if len(images) == batch_size
+        )
+    else:
+        feeds = itertools.repeat({})
+
+    all_samples = []
+    n = 0
+    for feed_dict in feeds:
+        if n >= n_samples:
+            break
+        _samples = session.run(samples, feed_dict=feed_dict)
+        _samples = ((_samples+1.)*(255.99/2)).astype('int32')
+        _samples = np.clip(_samples, 0, 255).astype('uint8')
+        all_samples.append(_samples.reshape((-1,) + image_shape).transpose(0,2,3,1))
+        n += len(_samples)
+    session.close()
+    return np.concatenate(all_samples, axis=0)[:n_samples]
+
+def _evaluate(task):
+    iteration, checkpoint_path = task
+    import tflib as lib
+    import tflib.inception_score
+    import tflib.fid
+    import tflib.feature_index
+    import tflib.kid
+    import tflib.precision_recall
+
+    dataset, data_dir, metrics = _config['dataset'], _config['data_dir'], _config['metrics']
+    start_time = time.time()
+    samples = _sample(checkpoint_path)
+
+    def batches():
+        for i in range(0, len(samples), lib.fid.BATCH_SIZE):
+            yield samples[i:i+lib.fid.BATCH_SIZE]
+
+    result = {'checkpoint': os.path.basename(checkpoint_path), 'iteration': iteration}
+    if ('kid' in metrics) or ('precision_recall' in metrics):
+        fake_features = lib.feature_index.collect_features(batches())
+        real_features = lib.feature_index.get_real_features(dataset, data_dir)
+    if 'fid' in metrics:
+        if ('kid' in metrics) or ('precision_recall' in metrics):
+            mu, sigma = np.mean(fake_features, axis=0), np.cov(fake_features, rowvar=False)
+        else:
+            mu, sigma = lib.fid.calculate_statistics(batches())
+        mu_real, sigma_real = lib.fid.get_reference_statistics(dataset, data_dir)
+        result['fid'] = lib.fid.calculate_frechet_distance(mu, sigma, mu_real, sigma_real)
+    if 'kid' in metrics:
+        result['kid'], result['kid_std'] = lib.kid.calculate_kid(fake_features, real_features)
+    if 'precision_recall' in metrics:
+        real_radii = lib.feature_index.get_real_radii(dataset, data_dir, lib.precision_recall.K)
+        result['precision'], result['recall'] = lib.precision_recall.calculate_precision_recall(
+            fake_features, real_features, real_radii)
+    if 'inception' in metrics:
+        result['inception'], result['inception_std'] = lib.inception_score.get_inception_score(list(samples))
+    result['seconds'] = time.time() - start_time
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate a directory of generator checkpoints.')
+    parser.add_argument('checkpoint_dir', help="directory written by tflib.checkpoint.save")
+    parser.add_argument('--dataset', choices=sorted(IMAGE_SHAPES.keys()), required=True,
+                        help="reference dataset")
+    parser.add_argument('--data_dir', required=True, help="reference dataset directory")
+    parser.add_argument('--n_samples', type=int, default=10000, help="samples per checkpoint")
+    parser.add_argument('--metrics', default='fid,kid,precision_recall',
+                        help="comma-separated subset of {}".format(','.join(METRICS)))
+    parser.add_argument('--workers', type=int, default=1, help="number of worker processes")
+    parser.add_argument('--gpus', default=None,
+                        help="comma-separated GPU ids, assigned round-robin to workers")
+    parser.add_argument('--output', default=None,
+                        help="results table (default: <checkpoint_dir>/eval.tsv)")
+    args = parser.parse_args()
+
+    metrics = args.metrics.split(',')
+    for metric in metrics:
+        if metric not in METRICS:
+            raise Exception('Unknown metric {}'.format(metric))
+    checkpoints = list_checkpoints(args.checkpoint_dir)
+    if len(checkpoints) == 0:
+        raise Exception('No checkpoints found in {}'.format(args.checkpoint_dir))
+    print("Evaluating {} checkpoints from {}".format(len(checkpoints), args.checkpoint_dir))
+
+    config = {
+        'dataset': args.dataset,
+        'data_dir': args.data_dir,
+        'n_samples': args.n_samples,
+        'metrics': metrics,
+    }
+    # Spawn rather than fork: TensorFlow state does not survive a fork.
+    context = multiprocessing.get_context('spawn')
+
+    pool = context.Pool(1)
+    pool.apply(_prepare_reference, (config,))
+    pool.close()
+    pool.join()
+
+    devices = None
+    if args.gpus:
+        gpus = args.gpus.split(',')
+        devices = context.Queue()
+        for i in range(args.workers):
+            devices.put(gpus[i % len(gpus)])
+
+    results = []
+    pool = context.Pool(args.workers, initializer=_init_worker, initargs=(config, devices))
+    for result in pool.imap_unordered(_evaluate, checkpoints):
+        print("\t".join("{}: {}".format(k, v) for k, v in sorted(result.items())))
+        results.append(result)
+    pool.close()
+    pool.join()
+
+    results = sorted(results, key=lambda r: r['iteration'])
+    columns = ['checkpoint', 'iteration']
+    columns += [c for c in sorted(results[0].keys()) if c not in columns]
+    output = args.output or os.path.join(args.checkpoint_dir, 'eval.tsv')
+    with open(output, 'w') as f:
+        writer = csv.DictWriter(f, columns, delimiter='\t')
+        writer.writeheader()
+        for result in results:
+            writer.writerow(result)
+    print("Wrote {}".format(output))
+
+if __name__ == '__main__':
+    main()
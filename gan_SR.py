@@ -3,6 +3,7 @@ sys.path.append(os.getcwd())
 
 import time
 import functools
+import collections
 
 import numpy as np
 import tensorflow as tf
@@ -18,6 +19,16 @@ import tflib.celebA_64x64
 import tflib.small_imagenet
 import tflib.ops.layernorm
 import tflib.plot
+import tflib.checkpoint
+import tflib.image_quality
+import tflib.timing
+import tflib.profiling
+import tflib.telemetry
+import tflib.memory
+import tflib.export
+import tflib.mixed_precision
+import tflib.xla
+import tflib.gan
 
 FLAGS = tf.app.flags.FLAGS
 
@@ -32,6 +43,14 @@ tf.app.flags.DEFINE_integer('max_iter', 500, "maximum mini-batch iterations")
 tf.app.flags.DEFINE_float('LAMBDA', 10., "gradient penalty lambda parameter")
 tf.app.flags.DEFINE_float('gen_l1_weight', 0.9, "weight of L1 difference in generator loss")
 tf.app.flags.DEFINE_integer('architecture', 0, "index of architecture")
+tf.app.flags.DEFINE_integer('eval_size', 1024, "number of held-out images for PSNR/SSIM evaluation (0 disables)")
+tf.app.flags.DEFINE_integer('checkpoint_every', 1000, "iterations between generator checkpoints (0 disables)")
+tf.app.flags.DEFINE_string('checkpoint_dir', 'checkpoints', "generator checkpoints go to a new subdirectory per run; never cleaned")
+tf.app.flags.DEFINE_integer('metrics_port', 0, "port of the Prometheus metrics endpoint (0 disables)")
+tf.app.flags.DEFINE_string('data_format', 'NCHW', "layout of conv activations [NCHW (GPU) | NHWC (CPU)]")
+tf.app.flags.DEFINE_string('mixed_precision', '', "compute dtype of the conv and linear layers [float16 | bfloat16], with loss scaling ('' for float32)")
+tf.app.flags.DEFINE_string('xla', '', "XLA compilation of the models [auto (auto-clustering) | scopes (JIT scopes around Generator/Discriminator)] ('' disables)")
+tf.app.flags.DEFINE_string('export_path', '', "binary GraphDef of the trained generator, batchnorm folded, written after training ('' disables)")
 
 # Download 64x64 ImageNet at http://image-net.org/small/download.php and
 # fill in the path to the extracted files here!
@@ -39,6 +58,9 @@ DATA_DIR = FLAGS.data_dir
 SUMMARY_DIR = FLAGS.summary_dir
 GEN_L1_WEIGHT = FLAGS.gen_l1_weight # Weighting factor for L1 difference in generator loss
 TRAIN_DIR = FLAGS.train_dir # Directory to output image
+# Generator checkpoints for eval_checkpoints.py; unlike TRAIN_DIR never deleted,
+# with a directory per run so reruns don't overwrite earlier checkpoints
+CHECKPOINT_DIR = os.path.join(FLAGS.checkpoint_dir, 'arch{}_{}'.format(FLAGS.architecture, time.strftime('%Y%m%d-%H%M%S')))
 MODE = FLAGS.mode # dcgan, wgan, wgan-gp, lsgan
 ITERS = FLAGS.max_iter # How many iterations to train for
 LAMBDA = FLAGS.LAMBDA # Gradient penalty lambda hyperparameter
@@ -54,8 +76,15 @@ BATCH_SIZE = 16 # Batch size. Must be a multiple of N_GPUS
 INPUT_DIM = 16*16*3 # Number of pixels in each input
 OUTPUT_DIM = 64*64*3 # Number of pixels in each iamge
 DELETE_TRAIN_DIR=True
+DATA_FORMAT = FLAGS.data_format # Layout of conv activations inside the models
+MIXED_PRECISION = FLAGS.mixed_precision # Compute dtype of the conv and linear layers ('' for float32)
+XLA = FLAGS.xla # XLA compilation of the models ('' for none)
 
 lib.print_model_settings(locals().copy())
+lib.xla.set_mode(XLA)
+lib.set_data_format(DATA_FORMAT)
+if MIXED_PRECISION:
+    lib.mixed_precision.set_compute_dtype(MIXED_PRECISION)
 
 # create summary dir
 if not tf.gfile.Exists(FLAGS.summary_dir):
@@ -63,10 +92,14 @@ if not tf.gfile.Exists(FLAGS.summary_dir):
 
 # clean directory
 if DELETE_TRAIN_DIR:
+    if os.path.abspath(CHECKPOINT_DIR).startswith(os.path.abspath(TRAIN_DIR) + os.sep):
+        raise Exception('--checkpoint_dir must be outside --train_dir, which is deleted at every start')
     if tf.gfile.Exists(FLAGS.train_dir):
         tf.gfile.DeleteRecursively(FLAGS.train_dir)
         tf.gfile.MakeDirs(FLAGS.train_dir)
     tf.gfile.MakeDirs(FLAGS.train_dir)
+if FLAGS.checkpoint_every > 0:
+    tf.gfile.MakeDirs(CHECKPOINT_DIR)
 
 # architecture dictionary
 def get_architectures():
@@ -131,12 +164,20 @@ def Batchnorm(name, axes, inputs):
 def pixcnn_gated_nonlinearity(a, b):
     return tf.sigmoid(a) * tf.tanh(b)
 
+def gated_nonlinearity(x):
+    # Odd channels gated by the even ones
+    if lib.get_data_format() == 'NHWC':
+        return pixcnn_gated_nonlinearity(x[:,:,:,::2], x[:,:,:,1::2])
+    return pixcnn_gated_nonlinearity(x[:,::2], x[:,1::2])
+
 def SubpixelConv2D(*args, **kwargs):
     kwargs['output_dim'] = 4*kwargs['output_dim']
     output = lib.ops.conv2d.Conv2D(*args, **kwargs)
-    output = tf.transpose(output, [0,2,3,1])
+    if lib.get_data_format() == 'NCHW':
+        output = tf.transpose(output, [0,2,3,1])
     output = tf.depth_to_space(output, 2)
-    output = tf.transpose(output, [0,3,1,2])
+    if lib.get_data_format() == 'NCHW':
+        output = tf.transpose(output, [0,3,1,2])
     return output
 
 def ResidualBlock(name, input_dim, output_dim, filter_size, inputs, resample=None, he_init=True):
@@ -207,7 +248,7 @@ def DCGANGenerator(
         noise = tf.random_normal([n_samples, input_dim])
         output = lib.ops.linear.Linear(
             'Generator.Input', 256, (dim//k)*(dim//k)*8*dim, noise)
-        output = tf.reshape(output, [-1, 8*dim, dim//k, dim//k])
+        output = lib.to_data_format(tf.reshape(output, [-1, 8*dim, dim//k, dim//k]))
         if bn:
             output = Batchnorm('Generator.BN1', [0,2,3], output)
             output = nonlinearity(output)
@@ -215,7 +256,7 @@ def DCGANGenerator(
         # downsampled data as input (noise)
         # input (noise) dimension [batchsize, 3*(dim/K)*(dim/K)]
         # decode twice to tensor of [batchsize, 8*dim, 4, 4]
-        output = tf.reshape(noise, [-1, 3, dim//k, dim//k])
+        output = lib.to_data_format(tf.reshape(noise, [-1, 3, dim//k, dim//k]))
         output = tflib.ops.conv2d.Conv2D(
             'Generator.Encoder1.1', 3, 4*dim, 5, output, stride=2)
         if bn:
@@ -250,7 +291,7 @@ def DCGANGenerator(
     lib.ops.deconv2d.unset_weights_stdev()
     lib.ops.linear.unset_weights_stdev()
 
-    return tf.reshape(output, [-1, OUTPUT_DIM])
+    return tf.reshape(lib.from_data_format(output), [-1, OUTPUT_DIM])
 
 def WGANPaper_CrippledDCGANGenerator(
         n_samples, noise=None, dim=DIM, input_dim=INPUT_DIM):
@@ -259,7 +300,7 @@ def WGANPaper_CrippledDCGANGenerator(
 
     output = lib.ops.linear.Linear('Generator.Input', input_dim, 4*4*dim, noise)
     output = tf.nn.relu(output)
-    output = tf.reshape(output, [-1, dim, 4, 4])
+    output = lib.to_data_format(tf.reshape(output, [-1, dim, 4, 4]))
 
     output = lib.ops.deconv2d.Deconv2D('Generator.2', dim, dim, 5, output)
     output = tf.nn.relu(output)
@@ -273,14 +314,14 @@ def WGANPaper_CrippledDCGANGenerator(
     output = lib.ops.deconv2d.Deconv2D('Generator.5', dim, 3, 5, output)
     output = tf.tanh(output)
 
-    return tf.reshape(output, [-1, OUTPUT_DIM])
+    return tf.reshape(lib.from_data_format(output), [-1, OUTPUT_DIM])
 
 def ResnetGenerator(n_samples, noise=None, dim=DIM, input_dim=INPUT_DIM):
     if noise is None:
         noise = tf.random_normal([n_samples, input_dim])
 
     output = lib.ops.linear.Linear('Generator.Input', input_dim, 4*4*8*dim, noise)
-    output = tf.reshape(output, [-1, 8*dim, 4, 4])
+    output = lib.to_data_format(tf.reshape(output, [-1, 8*dim, 4, 4]))
 
     for i in range(6):
         output = ResidualBlock('Generator.4x4_{}'.format(i), 8*dim, 8*dim, 3, output, resample=None)
@@ -300,7 +341,7 @@ def ResnetGenerator(n_samples, noise=None, dim=DIM, input_dim=INPUT_DIM):
     output = lib.ops.conv2d.Conv2D('Generator.Out', dim//2, 3, 1, output, he_init=False)
     output = tf.tanh(output / 5.)
 
-    return tf.reshape(output, [-1, OUTPUT_DIM])
+    return tf.reshape(lib.from_data_format(output), [-1, OUTPUT_DIM])
 
 
 def MultiplicativeDCGANGenerator(n_samples, noise=None, dim=DIM, bn=True, input_dim=INPUT_DIM):
@@ -308,62 +349,62 @@ def MultiplicativeDCGANGenerator(n_samples, noise=None, dim=DIM, bn=True, input_
         noise = tf.random_normal([n_samples, input_dim])
 
     output = lib.ops.linear.Linear('Generator.Input', input_dim, 4*4*8*dim*2, noise)
-    output = tf.reshape(output, [-1, 8*dim*2, 4, 4])
+    output = lib.to_data_format(tf.reshape(output, [-1, 8*dim*2, 4, 4]))
     if bn:
         output = Batchnorm('Generator.BN1', [0,2,3], output)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
     output = lib.ops.deconv2d.Deconv2D('Generator.2', 8*dim, 4*dim*2, 5, output)
     if bn:
         output = Batchnorm('Generator.BN2', [0,2,3], output)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
     output = lib.ops.deconv2d.Deconv2D('Generator.3', 4*dim, 2*dim*2, 5, output)
     if bn:
         output = Batchnorm('Generator.BN3', [0,2,3], output)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
     output = lib.ops.deconv2d.Deconv2D('Generator.4', 2*dim, dim*2, 5, output)
     if bn:
         output = Batchnorm('Generator.BN4', [0,2,3], output)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
     output = lib.ops.deconv2d.Deconv2D('Generator.5', dim, 3, 5, output)
     output = tf.tanh(output)
 
-    return tf.reshape(output, [-1, OUTPUT_DIM])
+    return tf.reshape(lib.from_data_format(output), [-1, OUTPUT_DIM])
 
 # ! Discriminators
 
 def MultiplicativeDCGANDiscriminator(inputs, dim=DIM, bn=True):
-    output = tf.reshape(inputs, [-1, 3, 64, 64])
+    output = lib.to_data_format(tf.reshape(inputs, [-1, 3, 64, 64]))
 
     output = lib.ops.conv2d.Conv2D('Discriminator.1', 3, dim*2, 5, output, stride=2)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
     output = lib.ops.conv2d.Conv2D('Discriminator.2', dim, 2*dim*2, 5, output, stride=2)
     if bn:
         output = Batchnorm('Discriminator.BN2', [0,2,3], output)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
     output = lib.ops.conv2d.Conv2D('Discriminator.3', 2*dim, 4*dim*2, 5, output, stride=2)
     if bn:
         output = Batchnorm('Discriminator.BN3', [0,2,3], output)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
     output = lib.ops.conv2d.Conv2D('Discriminator.4', 4*dim, 8*dim*2, 5, output, stride=2)
     if bn:
         output = Batchnorm('Discriminator.BN4', [0,2,3], output)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
-    output = tf.reshape(output, [-1, 4*4*8*dim])
+    output = tf.reshape(lib.from_data_format(output), [-1, 4*4*8*dim])
     output = lib.ops.linear.Linear('Discriminator.Output', 4*4*8*dim, 1, output)
 
     return tf.reshape(output, [-1])
 
 
 def ResnetDiscriminator(inputs, dim=DIM):
-    output = tf.reshape(inputs, [-1, 3, 64, 64])
+    output = lib.to_data_format(tf.reshape(inputs, [-1, 3, 64, 64]))
     output = lib.ops.conv2d.Conv2D('Discriminator.In', 3, dim//2, 1, output, he_init=False)
 
     for i in range(5):
@@ -381,7 +422,7 @@ def ResnetDiscriminator(inputs, dim=DIM):
     for i in range(6):
         output = ResidualBlock('Discriminator.4x4_{}'.format(i), dim*8, dim*8, 3, output, resample=None)
 
-    output = tf.reshape(output, [-1, 4*4*8*dim])
+    output = tf.reshape(lib.from_data_format(output), [-1, 4*4*8*dim])
     output = lib.ops.linear.Linear('Discriminator.Output', 4*4*8*dim, 1, output)
 
     return tf.reshape(output / 5., [-1])
@@ -396,7 +437,7 @@ def FCDiscriminator(inputs, FC_DIM=512, n_layers=3):
     return tf.reshape(output, [-1])
 
 def DCGANDiscriminator(inputs, dim=DIM, bn=True, nonlinearity=LeakyReLU):
-    output = tf.reshape(inputs, [-1, 3, 64, 64])
+    output = lib.to_data_format(tf.reshape(inputs, [-1, 3, 64, 64]))
 
     lib.ops.conv2d.set_weights_stdev(0.02)
     lib.ops.deconv2d.set_weights_stdev(0.02)
@@ -420,7 +461,7 @@ def DCGANDiscriminator(inputs, dim=DIM, bn=True, nonlinearity=LeakyReLU):
         output = Batchnorm('Discriminator.BN4', [0,2,3], output)
     output = nonlinearity(output)
 
-    output = tf.reshape(output, [-1, 4*4*8*dim])
+    output = tf.reshape(lib.from_data_format(output), [-1, 4*4*8*dim])
     output = lib.ops.linear.Linear('Discriminator.Output', 4*4*8*dim, 1, output)
 
     lib.ops.conv2d.unset_weights_stdev()
@@ -451,8 +492,27 @@ def downsample(data, method='conv'):
     return data
 
 Generator, Discriminator = GeneratorAndDiscriminator()
-
-with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
+# Back to float32 at the models' outputs only, if layers compute in reduced precision
+Generator = lib.mixed_precision.float32_outputs(Generator)
+Discriminator = lib.mixed_precision.float32_outputs(Discriminator)
+Generator, Discriminator = lib.xla.jit(Generator), lib.xla.jit(Discriminator)
+
+# (layer, batchnorm after it) pairs that lib.export folds together in the
+# DCGAN and multiplicative generators
+GENERATOR_FOLDS = [
+    ('Generator.Input', 'Generator.BN1'),
+    ('Generator.Encoder1.1', 'Generator.BN1.1'),
+    ('Generator.Encode1.2', 'Generator.BN1.2'),
+    ('Generator.2', 'Generator.BN2'),
+    ('Generator.3', 'Generator.BN3'),
+    ('Generator.4', 'Generator.BN4'),
+]
+
+def build_inference_generator():
+    inputs = tf.placeholder(tf.float32, shape=[None, INPUT_DIM], name='inputs')
+    return tf.identity(Generator(None, noise=inputs), name='samples')
+
+with tf.Session(config=lib.xla.session_config(tf.ConfigProto(allow_soft_placement=True))) as session:
 
     all_real_data_conv = tf.placeholder(tf.int32, shape=[BATCH_SIZE, 3, 64, 64])
     if tf.__version__.startswith('1.'):
@@ -462,6 +522,9 @@ with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
 
     gen_l1_costs, gen_gan_costs = [], []
     gen_costs, disc_costs = [],[]
+    # Loss scales for mixed precision (pass-throughs otherwise)
+    gen_loss_scale = lib.mixed_precision.LossScale('Generator')
+    disc_loss_scale = lib.mixed_precision.LossScale('Discriminator')
 
     for device_index, (device, real_data_conv) in enumerate(zip(DEVICES, split_real_data_conv)):
         with tf.device(device):
@@ -471,25 +534,31 @@ with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
             real_data_downsampled = downsample(real_data)
             fake_data = Generator(BATCH_SIZE//len(DEVICES), noise=real_data_downsampled)
             
-            disc_real = Discriminator(real_data)
-            disc_fake = Discriminator(fake_data)
+            if MODE == 'wgan-gp':
+                alpha = tf.random_uniform(
+                    shape=[BATCH_SIZE//len(DEVICES),1], 
+                    minval=0.,
+                    maxval=1.
+                )
+                differences = fake_data - real_data
+                interpolates = real_data + (alpha*differences)
+                # One critic pass over real, fake and interpolates together
+                disc_real, disc_fake, disc_interpolates = lib.gan.discriminate(
+                    Discriminator, real_data, fake_data, interpolates)
+            else:
+                disc_real = Discriminator(real_data)
+                disc_fake = Discriminator(fake_data)
 
             if MODE == 'wgan':
                 gen_cost = tf.reduce_mean(disc_fake)
                 disc_cost = tf.reduce_mean(disc_real) - tf.reduce_mean(disc_fake)
 
             elif MODE == 'wgan-gp':
-                gen_cost = tf.reduce_mean(disc_fake)
+                # A critic pass of its own, so the generator step skips the real and interpolated batches
+                gen_cost = tf.reduce_mean(Discriminator(fake_data))
                 disc_cost = tf.reduce_mean(disc_real) - tf.reduce_mean(disc_fake)
 
-                alpha = tf.random_uniform(
-                    shape=[BATCH_SIZE//len(DEVICES),1], 
-                    minval=0.,
-                    maxval=1.
-                )
-                differences = fake_data - real_data
-                interpolates = real_data + (alpha*differences)
-                gradients = tf.gradients(Discriminator(interpolates), [interpolates])[0]
+                gradients = disc_loss_scale.gradients(disc_interpolates, [interpolates])[0]
                 slopes = tf.sqrt(tf.reduce_sum(tf.square(gradients), reduction_indices=[1]))
                 gradient_penalty = tf.reduce_mean((slopes-1.)**2)
                 disc_cost += LAMBDA*gradient_penalty
@@ -538,9 +607,9 @@ with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
     tf.summary.scalar('disc loss', disc_cost, collections=['scalars'])
 
     if MODE == 'wgan':
-        gen_train_op = tf.train.RMSPropOptimizer(learning_rate=1e-4).minimize(
+        gen_train_op = gen_loss_scale.minimize(tf.train.RMSPropOptimizer(learning_rate=1e-4),
             gen_cost, var_list=lib.params_with_name('Generator'), colocate_gradients_with_ops=True)
-        disc_train_op = tf.train.RMSPropOptimizer(learning_rate=1e-4).minimize(disc_cost,
+        disc_train_op = disc_loss_scale.minimize(tf.train.RMSPropOptimizer(learning_rate=1e-4), disc_cost,
                                              var_list=lib.params_with_name('Discriminator.'), colocate_gradients_with_ops=True)
 
         clip_ops = []
@@ -550,27 +619,52 @@ with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
         clip_disc_weights = tf.group(*clip_ops)
 
     elif MODE == 'wgan-gp':
-        gen_train_op = tf.train.AdamOptimizer(
-            learning_rate=1e-4, beta1=0.5, beta2=0.9).minimize(
+        gen_train_op = gen_loss_scale.minimize(tf.train.AdamOptimizer(
+            learning_rate=1e-4, beta1=0.5, beta2=0.9),
                 gen_cost,var_list=lib.params_with_name('Generator'), colocate_gradients_with_ops=True)
-        disc_train_op = tf.train.AdamOptimizer(learning_rate=1e-4, beta1=0.5, beta2=0.9).minimize(disc_cost,
+        disc_train_op = disc_loss_scale.minimize(tf.train.AdamOptimizer(learning_rate=1e-4, beta1=0.5, beta2=0.9), disc_cost,
                                            var_list=lib.params_with_name('Discriminator.'), colocate_gradients_with_ops=True)
 
     elif MODE == 'dcgan':
-        gen_train_op = tf.train.AdamOptimizer(learning_rate=2e-4, beta1=0.5).minimize(gen_cost,
+        gen_train_op = gen_loss_scale.minimize(tf.train.AdamOptimizer(learning_rate=2e-4, beta1=0.5), gen_cost,
                                           var_list=lib.params_with_name('Generator'), colocate_gradients_with_ops=True)
-        disc_train_op = tf.train.AdamOptimizer(learning_rate=2e-4, beta1=0.5).minimize(disc_cost,
+        disc_train_op = disc_loss_scale.minimize(tf.train.AdamOptimizer(learning_rate=2e-4, beta1=0.5), disc_cost,
                                            var_list=lib.params_with_name('Discriminator.'), colocate_gradients_with_ops=True)
 
     elif MODE == 'lsgan':
-        gen_train_op = tf.train.RMSPropOptimizer(learning_rate=1e-4).minimize(gen_cost,
+        gen_train_op = gen_loss_scale.minimize(tf.train.RMSPropOptimizer(learning_rate=1e-4), gen_cost,
                                              var_list=lib.params_with_name('Generator'), colocate_gradients_with_ops=True)
-        disc_train_op = tf.train.RMSPropOptimizer(learning_rate=1e-4).minimize(disc_cost,
+        disc_train_op = disc_loss_scale.minimize(tf.train.RMSPropOptimizer(learning_rate=1e-4), disc_cost,
                                               var_list=lib.params_with_name('Discriminator.'), colocate_gradients_with_ops=True)
 
     else:
         raise Exception()
 
+    # Keep the moving statistics of the generator's batchnorms up to date, for
+    # checkpoints and exported graphs
+    gen_train_op = tf.group(gen_train_op, *tf.get_collection(tf.GraphKeys.UPDATE_OPS, 'Generator'))
+
+    # Generator checkpoints, for eval_checkpoints.py
+    saver = lib.checkpoint.make_saver(fake_data, inputs=real_data_conv)
+
+    # Held-out evaluation: per-image PSNR and SSIM against the ground truth,
+    # for the generator and for nearest / bicubic upsampling baselines
+    def to_images(data, size):
+        # [-1, 1] BCHW rows -> clipped [0, 1] BHWC
+        data = tf.transpose(tf.reshape(data, [-1, 3, size, size]), [0, 2, 3, 1])
+        return tf.clip_by_value((data + 1.) / 2., 0., 1.)
+    eval_real = to_images(real_data, DIM)
+    eval_feature = to_images(real_data_downsampled, DIM//K)
+    eval_outputs = collections.OrderedDict([
+        ('', to_images(fake_data, DIM)),
+        (' nearest', tf.image.resize_nearest_neighbor(eval_feature, [DIM, DIM])),
+        (' bicubic', tf.clip_by_value(tf.image.resize_bicubic(eval_feature, [DIM, DIM]), 0., 1.)),
+    ])
+    eval_metrics = {}
+    for suffix, output in eval_outputs.items():
+        eval_metrics['eval psnr'+suffix] = lib.image_quality.psnr(output, eval_real)
+        eval_metrics['eval ssim'+suffix] = lib.image_quality.ssim(output, eval_real)
+
 #     # For generating samples
 #     fixed_noise = tf.constant(np.random.normal(size=(BATCH_SIZE, INPUT_DIM)).astype('float32'))
 #     all_fixed_noise_samples = []
@@ -597,34 +691,25 @@ with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
 #         lib.save_images.save_images(samples.reshape((BATCH_SIZE, 3, 64, 64)), 'samples_{}.png'.format(iteration))
 
     
-    def generate_test_image(iteration, real_data, fake_data,  max_samples=10):
-        feature = tf.reshape(real_data_downsampled, [-1, 3, DIM//K, DIM//K])
-        # BCHW -> BHWC
-        feature = (tf.transpose(feature, [0, 2, 3, 1]) + 1)/2.
-        nearest = tf.image.resize_nearest_neighbor(feature, [DIM, DIM])
-        nearest = tf.maximum(tf.minimum(nearest, 1.), 0.)
-        bicubic = tf.image.resize_bicubic(feature, [DIM, DIM])
-        bicubic = tf.maximum(tf.minimum(bicubic, 1.), 0.)
-        fake_data = (tf.reshape(fake_data, [-1, 3, DIM, DIM]) + 1.)/2.
-        fake_data = tf.transpose(fake_data, [0, 2, 3, 1])
-        real_data = tf.reshape(real_data, [-1, 3, DIM, DIM])
-        real_data = tf.transpose(real_data, [0, 2, 3, 1])
-        real_data = (real_data + 1.) / 2.
-        clipped = tf.maximum(tf.minimum(fake_data, 1.), 0.)
-        image = tf.concat([nearest, bicubic, clipped, real_data], 2)
-
-        feed_dict = {real_data_conv: test_data}
-        image_col = tf.summary.image('generator output', image, max_samples)
-        image_summary = session.run(image_col, feed_dict=feed_dict)
+    # Test image visualization. All ops are built here, once, so that the
+    # graph can be finalized before training.
+    N_TEST_SAMPLES = 10
+    test_image = tf.concat([eval_outputs[' nearest'], eval_outputs[' bicubic'],
+                            eval_outputs[''], eval_real], 2)
+    test_image_summary = tf.summary.image('generator output', test_image, N_TEST_SAMPLES,
+                                          collections=['images'])
+    # Stack the first N_TEST_SAMPLES comparisons vertically, and the
+    # corresponding outputs horizontally
+    test_image_grid = tf.reshape(test_image[:N_TEST_SAMPLES], [N_TEST_SAMPLES*DIM, 4*DIM, 3])
+    test_image_row = tf.transpose(eval_outputs[''][:N_TEST_SAMPLES], [1, 0, 2, 3])
+    test_image_row = tf.reshape(test_image_row, [DIM, N_TEST_SAMPLES*DIM, 3])
+
+    def generate_test_image(iteration):
+        image_summary, image, clipped = session.run(
+            [test_image_summary, test_image_grid, test_image_row],
+            feed_dict={real_data_conv: test_data})
         summary_writer.add_summary(image_summary, iteration)
 
-        image = image[0:max_samples,:,:,:]
-        image = tf.concat([image[i,:,:,:] for i in range(max_samples)], 0)
-        clipped = clipped[0:max_samples, :, :, :]
-        clipped = tf.concat([clipped[i, :, :, :] for i in range(max_samples)], 1)
-
-        image, clipped = session.run([image, clipped], feed_dict=feed_dict)
-        
         filename_1 = 'batch%06d_image.png' % iteration
         filename_2 = 'batch%06d_row.png' % iteration
         filename_1 = os.path.join(TRAIN_DIR, filename_1)
@@ -633,12 +718,29 @@ with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
         scipy.misc.toimage(clipped, cmin=0., cmax=1.).save(filename_2)
         print("Saved %s %s" % (filename_1, filename_2))
 
-        
-
-
-
-    # Dataset iterator and test set (for visualization) 
-    train_gen, test_data = lib.celebA_64x64.load(BATCH_SIZE, data_dir=DATA_DIR)
+    def evaluate_heldout(iteration):
+        n_eval = BATCH_SIZE//len(DEVICES)
+        totals = collections.defaultdict(float)
+        n_images = 0
+        for i in range(0, len(heldout_data) - n_eval + 1, n_eval):
+            values = session.run(eval_metrics, feed_dict={real_data_conv: heldout_data[i:i+n_eval]})
+            for name, value in values.items():
+                totals[name] += np.sum(value)
+            n_images += n_eval
+
+        summary = tf.Summary()
+        for name in sorted(totals.keys()):
+            lib.plot.plot(name, totals[name] / n_images)
+            summary.value.add(tag=name, simple_value=totals[name] / n_images)
+        summary_writer.add_summary(summary, iteration)
+
+    # Dataset iterator, test set (for visualization) and held-out set (for
+    # evaluation). The held-out images come from CelebA's test partition and
+    # are excluded from training.
+    heldout_indices = lib.celebA_64x64.test_partition[:FLAGS.eval_size]
+    train_gen, test_data = lib.celebA_64x64.load(BATCH_SIZE, data_dir=DATA_DIR,
+                                                 heldout_indices=heldout_indices)
+    heldout_data = lib.celebA_64x64.make_testset(DATA_DIR, heldout_indices)
     #train_gen, dev_gen = lib.small_imagenet.load(BATCH_SIZE, data_dir=DATA_DIR)
 
     def inf_train_gen():
@@ -657,7 +759,14 @@ with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
     summary_writer = tf.summary.FileWriter(SUMMARY_DIR, session.graph)
 
     session.run(tf.global_variables_initializer())
+    # Every op the train loop needs exists by now; finalizing turns any
+    # accidental per-iteration op construction into an error instead of a
+    # slowly growing graph.
+    session.graph.finalize()
     gen = inf_train_gen()
+    if FLAGS.metrics_port > 0:
+        lib.telemetry.serve(FLAGS.metrics_port,
+                            samples_per_iter=BATCH_SIZE * (1 if MODE in ['dcgan', 'lsgan'] else CRITIC_ITERS))
     all_start_time = time.time()
     for iteration in range(ITERS):
         start_time = time.time()
@@ -668,7 +777,9 @@ with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
 
         # Train generator
         if iteration > 0:
-            _ = session.run(gen_train_op, feed_dict={all_real_data_conv: _data})
+            with lib.timing.phase('gen step'):
+                _ = lib.profiling.run(session, gen_train_op, feed_dict={all_real_data_conv: _data},
+                                      name='gen step', iteration=iteration)
 
         # Train critic
         if (MODE == 'dcgan') or (MODE == 'lsgan'):
@@ -676,10 +787,15 @@ with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
         else:
             disc_iters = CRITIC_ITERS
         for i in range(disc_iters):
-            _data = next(gen)
-            _disc_cost, _ = session.run([disc_cost, disc_train_op], feed_dict={all_real_data_conv: _data})
-            if MODE == 'wgan':
-                _ = session.run([clip_disc_weights])
+            with lib.timing.phase('critic'):
+                with lib.timing.phase('data'):
+                    _data = next(gen)
+                with lib.timing.phase('step'):
+                    _disc_cost, _ = lib.profiling.run(session, [disc_cost, disc_train_op], feed_dict={all_real_data_conv: _data},
+                                                      name='critic step', iteration=iteration)
+                if MODE == 'wgan':
+                    with lib.timing.phase('clip'):
+                        _ = session.run([clip_disc_weights])
 
         lib.plot.plot('train disc cost', _disc_cost)
         lib.plot.plot('time', time.time() - start_time)
@@ -687,8 +803,9 @@ with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
         #    iteration, _disc_cost, time.time() - start_time))
 
         if iteration % 10 == 0:
-            merged_summary = session.run(merged_scalars, feed_dict={all_real_data_conv: _data})
-            summary_writer.add_summary(merged_summary, iteration)
+            with lib.timing.phase('summaries'):
+                merged_summary = session.run(merged_scalars, feed_dict={all_real_data_conv: _data})
+                summary_writer.add_summary(merged_summary, iteration)
 
         if iteration % 200 == 9:
             t = time.time()
@@ -697,13 +814,25 @@ with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
             #    _dev_disc_cost = session.run(disc_cost, feed_dict={all_real_data_conv: _data}) 
             #    dev_disc_costs.append(_dev_disc_cost)
             #lib.plot.plot('dev disc cost', np.mean(dev_disc_costs))
-            generate_test_image(iteration, real_data, fake_data)
+            with lib.timing.phase('images'):
+                generate_test_image(iteration)
+            if FLAGS.eval_size > 0:
+                with lib.timing.phase('eval'):
+                    evaluate_heldout(iteration)
+
+        if FLAGS.checkpoint_every > 0 and iteration % FLAGS.checkpoint_every == FLAGS.checkpoint_every-1:
+            with lib.timing.phase('checkpoint'):
+                lib.checkpoint.save(session, saver, CHECKPOINT_DIR, iteration)
 
         if (iteration < 5) or (iteration % 200 == 199):
             lib.plot.flush()
 
         lib.plot.tick()
 
+    if FLAGS.export_path:
+        lib.export.export_inference_graph(session, build_inference_generator, FLAGS.export_path,
+                                          folds=GENERATOR_FOLDS)
+
 
 if __name__ == '__main__':
     tf.app.run()
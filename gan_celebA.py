@@ -18,6 +18,9 @@ import tflib.celebA_64x64
 import tflib.small_imagenet
 import tflib.ops.layernorm
 import tflib.plot
+import tflib.export
+import tflib.xla
+import tflib.gan
 
 # Download 64x64 ImageNet at http://image-net.org/small/download.php and
 # fill in the path to the extracted files here!
@@ -34,8 +37,16 @@ BATCH_SIZE = 16 # Batch size. Must be a multiple of N_GPUS
 ITERS = 5000 # How many iterations to train for
 LAMBDA = 10 # Gradient penalty lambda hyperparameter
 OUTPUT_DIM = 64*64*3 # Number of pixels in each iamge
+DATA_FORMAT = 'NCHW' # Layout of conv activations inside the models: 'NCHW' on GPU, 'NHWC' on CPU
+EXPORT_PATH = None # Binary GraphDef of the trained generator, batchnorm folded, written after training
+XLA = None # XLA compilation: None, 'auto' (auto-clustering) or 'scopes' (JIT around Generator/Discriminator)
 
 lib.print_model_settings(locals().copy())
+lib.xla.set_mode(XLA)
+lib.set_data_format(DATA_FORMAT)
+
+# Write sample grids off the training thread
+lib.save_images.enable_background_writes()
 def GeneratorAndDiscriminator():
     """
     Choose which generator and discriminator architecture to use by
@@ -90,12 +101,20 @@ def Batchnorm(name, axes, inputs):
 def pixcnn_gated_nonlinearity(a, b):
     return tf.sigmoid(a) * tf.tanh(b)
 
+def gated_nonlinearity(x):
+    # Odd channels gated by the even ones
+    if lib.get_data_format() == 'NHWC':
+        return pixcnn_gated_nonlinearity(x[:,:,:,::2], x[:,:,:,1::2])
+    return pixcnn_gated_nonlinearity(x[:,::2], x[:,1::2])
+
 def SubpixelConv2D(*args, **kwargs):
     kwargs['output_dim'] = 4*kwargs['output_dim']
     output = lib.ops.conv2d.Conv2D(*args, **kwargs)
-    output = tf.transpose(output, [0,2,3,1])
+    if lib.get_data_format() == 'NCHW':
+        output = tf.transpose(output, [0,2,3,1])
     output = tf.depth_to_space(output, 2)
-    output = tf.transpose(output, [0,3,1,2])
+    if lib.get_data_format() == 'NCHW':
+        output = tf.transpose(output, [0,3,1,2])
     return output
 
 def ResidualBlock(name, input_dim, output_dim, filter_size, inputs, resample=None, he_init=True):
@@ -163,7 +182,7 @@ def DCGANGenerator(n_samples, noise=None, dim=DIM, bn=True, nonlinearity=tf.nn.r
         noise = tf.random_normal([n_samples, 128])
 
     output = lib.ops.linear.Linear('Generator.Input', 128, 4*4*8*dim, noise)
-    output = tf.reshape(output, [-1, 8*dim, 4, 4])
+    output = lib.to_data_format(tf.reshape(output, [-1, 8*dim, 4, 4]))
     if bn:
         output = Batchnorm('Generator.BN1', [0,2,3], output)
     output = nonlinearity(output)
@@ -190,7 +209,7 @@ def DCGANGenerator(n_samples, noise=None, dim=DIM, bn=True, nonlinearity=tf.nn.r
     lib.ops.deconv2d.unset_weights_stdev()
     lib.ops.linear.unset_weights_stdev()
 
-    return tf.reshape(output, [-1, OUTPUT_DIM])
+    return tf.reshape(lib.from_data_format(output), [-1, OUTPUT_DIM])
 
 def WGANPaper_CrippledDCGANGenerator(n_samples, noise=None, dim=DIM):
     if noise is None:
@@ -198,7 +217,7 @@ def WGANPaper_CrippledDCGANGenerator(n_samples, noise=None, dim=DIM):
 
     output = lib.ops.linear.Linear('Generator.Input', 128, 4*4*dim, noise)
     output = tf.nn.relu(output)
-    output = tf.reshape(output, [-1, dim, 4, 4])
+    output = lib.to_data_format(tf.reshape(output, [-1, dim, 4, 4]))
 
     output = lib.ops.deconv2d.Deconv2D('Generator.2', dim, dim, 5, output)
     output = tf.nn.relu(output)
@@ -212,14 +231,14 @@ def WGANPaper_CrippledDCGANGenerator(n_samples, noise=None, dim=DIM):
     output = lib.ops.deconv2d.Deconv2D('Generator.5', dim, 3, 5, output)
     output = tf.tanh(output)
 
-    return tf.reshape(output, [-1, OUTPUT_DIM])
+    return tf.reshape(lib.from_data_format(output), [-1, OUTPUT_DIM])
 
 def ResnetGenerator(n_samples, noise=None, dim=DIM):
     if noise is None:
         noise = tf.random_normal([n_samples, 128])
 
     output = lib.ops.linear.Linear('Generator.Input', 128, 4*4*8*dim, noise)
-    output = tf.reshape(output, [-1, 8*dim, 4, 4])
+    output = lib.to_data_format(tf.reshape(output, [-1, 8*dim, 4, 4]))
 
     for i in range(6):
         output = ResidualBlock('Generator.4x4_{}'.format(i), 8*dim, 8*dim, 3, output, resample=None)
@@ -239,7 +258,7 @@ def ResnetGenerator(n_samples, noise=None, dim=DIM):
     output = lib.ops.conv2d.Conv2D('Generator.Out', dim/2, 3, 1, output, he_init=False)
     output = tf.tanh(output / 5.)
 
-    return tf.reshape(output, [-1, OUTPUT_DIM])
+    return tf.reshape(lib.from_data_format(output), [-1, OUTPUT_DIM])
 
 
 def MultiplicativeDCGANGenerator(n_samples, noise=None, dim=DIM, bn=True):
@@ -247,62 +266,62 @@ def MultiplicativeDCGANGenerator(n_samples, noise=None, dim=DIM, bn=True):
         noise = tf.random_normal([n_samples, 128])
 
     output = lib.ops.linear.Linear('Generator.Input', 128, 4*4*8*dim*2, noise)
-    output = tf.reshape(output, [-1, 8*dim*2, 4, 4])
+    output = lib.to_data_format(tf.reshape(output, [-1, 8*dim*2, 4, 4]))
     if bn:
         output = Batchnorm('Generator.BN1', [0,2,3], output)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
     output = lib.ops.deconv2d.Deconv2D('Generator.2', 8*dim, 4*dim*2, 5, output)
     if bn:
         output = Batchnorm('Generator.BN2', [0,2,3], output)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
     output = lib.ops.deconv2d.Deconv2D('Generator.3', 4*dim, 2*dim*2, 5, output)
     if bn:
         output = Batchnorm('Generator.BN3', [0,2,3], output)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
     output = lib.ops.deconv2d.Deconv2D('Generator.4', 2*dim, dim*2, 5, output)
     if bn:
         output = Batchnorm('Generator.BN4', [0,2,3], output)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
     output = lib.ops.deconv2d.Deconv2D('Generator.5', dim, 3, 5, output)
     output = tf.tanh(output)
 
-    return tf.reshape(output, [-1, OUTPUT_DIM])
+    return tf.reshape(lib.from_data_format(output), [-1, OUTPUT_DIM])
 
 # ! Discriminators
 
 def MultiplicativeDCGANDiscriminator(inputs, dim=DIM, bn=True):
-    output = tf.reshape(inputs, [-1, 3, 64, 64])
+    output = lib.to_data_format(tf.reshape(inputs, [-1, 3, 64, 64]))
 
     output = lib.ops.conv2d.Conv2D('Discriminator.1', 3, dim*2, 5, output, stride=2)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
     output = lib.ops.conv2d.Conv2D('Discriminator.2', dim, 2*dim*2, 5, output, stride=2)
     if bn:
         output = Batchnorm('Discriminator.BN2', [0,2,3], output)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
     output = lib.ops.conv2d.Conv2D('Discriminator.3', 2*dim, 4*dim*2, 5, output, stride=2)
     if bn:
         output = Batchnorm('Discriminator.BN3', [0,2,3], output)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
     output = lib.ops.conv2d.Conv2D('Discriminator.4', 4*dim, 8*dim*2, 5, output, stride=2)
     if bn:
         output = Batchnorm('Discriminator.BN4', [0,2,3], output)
-    output = pixcnn_gated_nonlinearity(output[:,::2], output[:,1::2])
+    output = gated_nonlinearity(output)
 
-    output = tf.reshape(output, [-1, 4*4*8*dim])
+    output = tf.reshape(lib.from_data_format(output), [-1, 4*4*8*dim])
     output = lib.ops.linear.Linear('Discriminator.Output', 4*4*8*dim, 1, output)
 
     return tf.reshape(output, [-1])
 
 
 def ResnetDiscriminator(inputs, dim=DIM):
-    output = tf.reshape(inputs, [-1, 3, 64, 64])
+    output = lib.to_data_format(tf.reshape(inputs, [-1, 3, 64, 64]))
     output = lib.ops.conv2d.Conv2D('Discriminator.In', 3, dim/2, 1, output, he_init=False)
 
     for i in range(5):
@@ -320,7 +339,7 @@ def ResnetDiscriminator(inputs, dim=DIM):
     for i in range(6):
         output = ResidualBlock('Discriminator.4x4_{}'.format(i), dim*8, dim*8, 3, output, resample=None)
 
-    output = tf.reshape(output, [-1, 4*4*8*dim])
+    output = tf.reshape(lib.from_data_format(output), [-1, 4*4*8*dim])
     output = lib.ops.linear.Linear('Discriminator.Output', 4*4*8*dim, 1, output)
 
     return tf.reshape(output / 5., [-1])
@@ -335,7 +354,7 @@ def FCDiscriminator(inputs, FC_DIM=512, n_layers=3):
     return tf.reshape(output, [-1])
 
 def DCGANDiscriminator(inputs, dim=DIM, bn=True, nonlinearity=LeakyReLU):
-    output = tf.reshape(inputs, [-1, 3, 64, 64])
+    output = lib.to_data_format(tf.reshape(inputs, [-1, 3, 64, 64]))
 
     lib.ops.conv2d.set_weights_stdev(0.02)
     lib.ops.deconv2d.set_weights_stdev(0.02)
@@ -359,7 +378,7 @@ def DCGANDiscriminator(inputs, dim=DIM, bn=True, nonlinearity=LeakyReLU):
         output = Batchnorm('Discriminator.BN4', [0,2,3], output)
     output = nonlinearity(output)
 
-    output = tf.reshape(output, [-1, 4*4*8*dim])
+    output = tf.reshape(lib.from_data_format(output), [-1, 4*4*8*dim])
     output = lib.ops.linear.Linear('Discriminator.Output', 4*4*8*dim, 1, output)
 
     lib.ops.conv2d.unset_weights_stdev()
@@ -369,8 +388,22 @@ def DCGANDiscriminator(inputs, dim=DIM, bn=True, nonlinearity=LeakyReLU):
     return tf.reshape(output, [-1])
 
 Generator, Discriminator = GeneratorAndDiscriminator()
+Generator, Discriminator = lib.xla.jit(Generator), lib.xla.jit(Discriminator)
+
+# (layer, batchnorm after it) pairs that lib.export folds together in the
+# DCGAN and multiplicative generators
+GENERATOR_FOLDS = [
+    ('Generator.Input', 'Generator.BN1'),
+    ('Generator.2', 'Generator.BN2'),
+    ('Generator.3', 'Generator.BN3'),
+    ('Generator.4', 'Generator.BN4'),
+]
 
-with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
+def build_inference_generator():
+    noise = tf.placeholder(tf.float32, shape=[None, 128], name='noise')
+    return tf.identity(Generator(None, noise=noise), name='samples')
+
+with tf.Session(config=lib.xla.session_config(tf.ConfigProto(allow_soft_placement=True))) as session:
 
     all_real_data_conv = tf.placeholder(tf.int32, shape=[BATCH_SIZE, 3, 64, 64])
     if tf.__version__.startswith('1.'):
@@ -385,25 +418,31 @@ with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
             real_data = tf.reshape(2*((tf.cast(real_data_conv, tf.float32)/255.)-.5), [BATCH_SIZE//len(DEVICES), OUTPUT_DIM])
             fake_data = Generator(BATCH_SIZE//len(DEVICES))
 
-            disc_real = Discriminator(real_data)
-            disc_fake = Discriminator(fake_data)
+            if MODE == 'wgan-gp':
+                alpha = tf.random_uniform(
+                    shape=[BATCH_SIZE//len(DEVICES),1], 
+                    minval=0.,
+                    maxval=1.
+                )
+                differences = fake_data - real_data
+                interpolates = real_data + (alpha*differences)
+                # One critic pass over real, fake and interpolates together
+                disc_real, disc_fake, disc_interpolates = lib.gan.discriminate(
+                    Discriminator, real_data, fake_data, interpolates)
+            else:
+                disc_real = Discriminator(real_data)
+                disc_fake = Discriminator(fake_data)
 
             if MODE == 'wgan':
                 gen_cost = tf.reduce_mean(disc_fake)
                 disc_cost = tf.reduce_mean(disc_real) - tf.reduce_mean(disc_fake)
 
             elif MODE == 'wgan-gp':
-                gen_cost = tf.reduce_mean(disc_fake)
+                # The generator step feeds no real data, so it gets its own critic pass
+                gen_cost = tf.reduce_mean(Discriminator(fake_data))
                 disc_cost = tf.reduce_mean(disc_real) - tf.reduce_mean(disc_fake)
 
-                alpha = tf.random_uniform(
-                    shape=[BATCH_SIZE//len(DEVICES),1], 
-                    minval=0.,
-                    maxval=1.
-                )
-                differences = fake_data - real_data
-                interpolates = real_data + (alpha*differences)
-                gradients = tf.gradients(Discriminator(interpolates), [interpolates])[0]
+                gradients = tf.gradients(disc_interpolates, [interpolates])[0]
                 slopes = tf.sqrt(tf.reduce_sum(tf.square(gradients), reduction_indices=[1]))
                 gradient_penalty = tf.reduce_mean((slopes-1.)**2)
                 disc_cost += LAMBDA*gradient_penalty
@@ -470,6 +509,10 @@ with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
     else:
         raise Exception()
 
+    # Keep the moving statistics of the generator's batchnorms up to date, for
+    # exported graphs
+    gen_train_op = tf.group(gen_train_op, *tf.get_collection(tf.GraphKeys.UPDATE_OPS, 'Generator'))
+
     # For generating samples
     fixed_noise = tf.constant(np.random.normal(size=(BATCH_SIZE, 128)).astype('float32'))
     all_fixed_noise_samples = []
@@ -558,3 +601,7 @@ with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as session:
             lib.plot.flush()
 
         lib.plot.tick()
+
+    if EXPORT_PATH is not None:
+        lib.export.export_inference_graph(session, build_inference_generator, EXPORT_PATH,
+                                          folds=GENERATOR_FOLDS)
@@ -15,6 +15,8 @@ import tflib.save_images
 import tflib.cifar10
 import tflib.inception_score
 import tflib.plot
+import tflib.xla
+import tflib.gan
 
 # Download CIFAR-10 (Python version) at
 # https://www.cs.toronto.edu/~kriz/cifar.html and fill in the path to the
@@ -30,8 +32,10 @@ CRITIC_ITERS = 5 # How many critic iterations per generator iteration
 BATCH_SIZE = 64 # Batch size
 ITERS = 200000 # How many generator iterations to train for
 OUTPUT_DIM = 3072 # Number of pixels in CIFAR10 (3*32*32)
+XLA = None # XLA compilation: None, 'auto' (auto-clustering) or 'scopes' (JIT around Generator/Discriminator)
 
 lib.print_model_settings(locals().copy())
+lib.xla.set_mode(XLA)
 
 def LeakyReLU(x, alpha=0.2):
     return tf.maximum(alpha*x, x)
@@ -88,12 +92,26 @@ def Discriminator(inputs):
 
     return tf.reshape(output, [-1])
 
+Generator, Discriminator = lib.xla.jit(Generator), lib.xla.jit(Discriminator)
+
 real_data_int = tf.placeholder(tf.int32, shape=[BATCH_SIZE, OUTPUT_DIM])
 real_data = 2*((tf.cast(real_data_int, tf.float32)/255.)-.5)
 fake_data = Generator(BATCH_SIZE)
 
-disc_real = Discriminator(real_data)
-disc_fake = Discriminator(fake_data)
+if MODE == 'wgan-gp':
+    alpha = tf.random_uniform(
+        shape=[BATCH_SIZE,1], 
+        minval=0.,
+        maxval=1.
+    )
+    differences = fake_data - real_data
+    interpolates = real_data + (alpha*differences)
+    # One critic pass over real, fake and interpolates together
+    disc_real, disc_fake, disc_interpolates = lib.gan.discriminate(
+        Discriminator, real_data, fake_data, interpolates)
+else:
+    disc_real = Discriminator(real_data)
+    disc_fake = Discriminator(fake_data)
 
 gen_params = lib.params_with_name('Generator')
 disc_params = lib.params_with_name('Discriminator')
@@ -118,18 +136,12 @@ if MODE == 'wgan':
 
 elif MODE == 'wgan-gp':
     # Standard WGAN loss
-    gen_cost = -tf.reduce_mean(disc_fake)
+    # The generator step feeds no real data, so it gets its own critic pass
+    gen_cost = -tf.reduce_mean(Discriminator(fake_data))
     disc_cost = tf.reduce_mean(disc_fake) - tf.reduce_mean(disc_real)
 
     # Gradient penalty
-    alpha = tf.random_uniform(
-        shape=[BATCH_SIZE,1], 
-        minval=0.,
-        maxval=1.
-    )
-    differences = fake_data - real_data
-    interpolates = real_data + (alpha*differences)
-    gradients = tf.gradients(Discriminator(interpolates), [interpolates])[0]
+    gradients = tf.gradients(disc_interpolates, [interpolates])[0]
     slopes = tf.sqrt(tf.reduce_sum(tf.square(gradients), reduction_indices=[1]))
     gradient_penalty = tf.reduce_mean((slopes-1.)**2)
     disc_cost += LAMBDA*gradient_penalty
@@ -175,7 +187,7 @@ def inf_train_gen():
             yield images
 
 # Train loop
-with tf.Session() as session:
+with tf.Session(config=lib.xla.session_config()) as session:
     session.run(tf.initialize_all_variables())
     gen = inf_train_gen()
 
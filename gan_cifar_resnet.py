@@ -8,10 +8,18 @@ import tflib.ops.linear
 import tflib.ops.cond_batchnorm
 import tflib.ops.conv2d
 import tflib.ops.batchnorm
+import tflib.ops.initializers
 import tflib.save_images
 import tflib.cifar10
 import tflib.inception_score
+import tflib.fid
+import tflib.checkpoint
 import tflib.plot
+import tflib.timing
+import tflib.profiling
+import tflib.telemetry
+import tflib.memory
+import tflib.xla
 
 import numpy as np
 import tensorflow as tf
@@ -45,6 +53,9 @@ LR = 2e-4 # Initial learning rate
 DECAY = True # Whether to decay LR over learning
 N_CRITIC = 5 # Critic steps per generator steps
 INCEPTION_FREQUENCY = 1000 # How frequently to calculate Inception score
+CHECKPOINT_FREQUENCY = 10000 # How frequently to save generator checkpoints (0 disables)
+CHECKPOINT_DIR = 'checkpoints' # Where to save them, for eval_checkpoints.py
+METRICS_PORT = 0 # Port of the Prometheus metrics endpoint (0 disables)
 
 CONDITIONAL = True # Whether to train a conditional or unconditional model
 ACGAN = True # If CONDITIONAL, whether to use ACGAN or "vanilla" conditioning
@@ -54,11 +65,24 @@ ACGAN_SCALE_G = 0.1 # How to scale generator's ACGAN loss relative to WGAN loss
 if CONDITIONAL and (not ACGAN) and (not NORMALIZATION_D):
     print("WARNING! Conditional model without normalization in D might be effectively unconditional!")
 
-DEVICES = ['/gpu:{}'.format(i) for i in xrange(N_GPUS)]
+DEVICES = ['/gpu:{}'.format(i) for i in range(N_GPUS)]
 if len(DEVICES) == 1: # Hack because the code assumes 2 GPUs
     DEVICES = [DEVICES[0], DEVICES[0]]
+XLA = None # XLA compilation: None, 'auto' (auto-clustering) or 'scopes' (JIT around Generator/Discriminator)
+IN_GRAPH_INIT = False # Sample initial weights on-device (faster for deep models; a different RNG stream than NumPy init)
 
 lib.print_model_settings(locals().copy())
+lib.xla.set_mode(XLA)
+
+# Long runs: plot min/max/mean summaries instead of every point, and only
+# keep recent points in memory (the rest is in log/)
+lib.plot.enable_downsampling()
+lib.plot.set_window(10000)
+if IN_GRAPH_INIT:
+    lib.ops.initializers.enable_in_graph_init()
+
+# Write sample grids off the training thread
+lib.save_images.enable_background_writes()
 
 def nonlinearity(x):
     return tf.nn.relu(x)
@@ -178,7 +202,9 @@ def Discriminator(inputs, labels):
     else:
         return output_wgan, None
 
-with tf.Session() as session:
+Generator, Discriminator = lib.xla.jit(Generator), lib.xla.jit(Discriminator)
+
+with tf.Session(config=lib.xla.session_config()) as session:
 
     _iteration = tf.placeholder(tf.int32, shape=None)
     all_real_data_int = tf.placeholder(tf.int32, shape=[BATCH_SIZE, OUTPUT_DIM])
@@ -189,14 +215,14 @@ with tf.Session() as session:
     fake_data_splits = []
     for i, device in enumerate(DEVICES):
         with tf.device(device):
-            fake_data_splits.append(Generator(BATCH_SIZE/len(DEVICES), labels_splits[i]))
+            fake_data_splits.append(Generator(BATCH_SIZE//len(DEVICES), labels_splits[i]))
 
     all_real_data = tf.reshape(2*((tf.cast(all_real_data_int, tf.float32)/256.)-.5), [BATCH_SIZE, OUTPUT_DIM])
     all_real_data += tf.random_uniform(shape=[BATCH_SIZE,OUTPUT_DIM],minval=0.,maxval=1./128) # dequantize
     all_real_data_splits = tf.split(all_real_data, len(DEVICES), axis=0)
 
-    DEVICES_B = DEVICES[:len(DEVICES)/2]
-    DEVICES_A = DEVICES[len(DEVICES)/2:]
+    DEVICES_B = DEVICES[:len(DEVICES)//2]
+    DEVICES_A = DEVICES[len(DEVICES)//2:]
 
     disc_costs = []
     disc_acgan_costs = []
@@ -217,18 +243,18 @@ with tf.Session() as session:
                 labels_splits[len(DEVICES_A)+i]
             ], axis=0)
             disc_all, disc_all_acgan = Discriminator(real_and_fake_data, real_and_fake_labels)
-            disc_real = disc_all[:BATCH_SIZE/len(DEVICES_A)]
-            disc_fake = disc_all[BATCH_SIZE/len(DEVICES_A):]
+            disc_real = disc_all[:BATCH_SIZE//len(DEVICES_A)]
+            disc_fake = disc_all[BATCH_SIZE//len(DEVICES_A):]
             disc_costs.append(tf.reduce_mean(disc_fake) - tf.reduce_mean(disc_real))
             if CONDITIONAL and ACGAN:
                 disc_acgan_costs.append(tf.reduce_mean(
-                    tf.nn.sparse_softmax_cross_entropy_with_logits(logits=disc_all_acgan[:BATCH_SIZE/len(DEVICES_A)], labels=real_and_fake_labels[:BATCH_SIZE/len(DEVICES_A)])
+                    tf.nn.sparse_softmax_cross_entropy_with_logits(logits=disc_all_acgan[:BATCH_SIZE//len(DEVICES_A)], labels=real_and_fake_labels[:BATCH_SIZE//len(DEVICES_A)])
                 ))
                 disc_acgan_accs.append(tf.reduce_mean(
                     tf.cast(
                         tf.equal(
-                            tf.to_int32(tf.argmax(disc_all_acgan[:BATCH_SIZE/len(DEVICES_A)], dimension=1)),
-                            real_and_fake_labels[:BATCH_SIZE/len(DEVICES_A)]
+                            tf.to_int32(tf.argmax(disc_all_acgan[:BATCH_SIZE//len(DEVICES_A)], dimension=1)),
+                            real_and_fake_labels[:BATCH_SIZE//len(DEVICES_A)]
                         ),
                         tf.float32
                     )
@@ -236,8 +262,8 @@ with tf.Session() as session:
                 disc_acgan_fake_accs.append(tf.reduce_mean(
                     tf.cast(
                         tf.equal(
-                            tf.to_int32(tf.argmax(disc_all_acgan[BATCH_SIZE/len(DEVICES_A):], dimension=1)),
-                            real_and_fake_labels[BATCH_SIZE/len(DEVICES_A):]
+                            tf.to_int32(tf.argmax(disc_all_acgan[BATCH_SIZE//len(DEVICES_A):], dimension=1)),
+                            real_and_fake_labels[BATCH_SIZE//len(DEVICES_A):]
                         ),
                         tf.float32
                     )
@@ -253,7 +279,7 @@ with tf.Session() as session:
                 labels_splits[len(DEVICES_A)+i],
             ], axis=0)
             alpha = tf.random_uniform(
-                shape=[BATCH_SIZE/len(DEVICES_A),1], 
+                shape=[BATCH_SIZE//len(DEVICES_A),1], 
                 minval=0.,
                 maxval=1.
             )
@@ -287,7 +313,7 @@ with tf.Session() as session:
     gen_acgan_costs = []
     for device in DEVICES:
         with tf.device(device):
-            n_samples = GEN_BS_MULTIPLE * BATCH_SIZE / len(DEVICES)
+            n_samples = GEN_BS_MULTIPLE * BATCH_SIZE // len(DEVICES)
             fake_labels = tf.cast(tf.random_uniform([n_samples])*10, tf.int32)
             if CONDITIONAL and ACGAN:
                 disc_fake, disc_fake_acgan = Discriminator(Generator(n_samples,fake_labels), fake_labels)
@@ -324,13 +350,27 @@ with tf.Session() as session:
     samples_100 = Generator(100, fake_labels_100)
     def get_inception_score(n):
         all_samples = []
-        for i in xrange(n/100):
+        for i in range(n//100):
             all_samples.append(session.run(samples_100))
         all_samples = np.concatenate(all_samples, axis=0)
         all_samples = ((all_samples+1.)*(255.99/2)).astype('int32')
         all_samples = all_samples.reshape((-1, 3, 32, 32)).transpose(0,2,3,1)
         return lib.inception_score.get_inception_score(list(all_samples))
 
+    # Function for calculating FID against the cached CIFAR-10 test statistics
+    def get_fid(n):
+        def sample_batches():
+            for i in range(n//100):
+                samples = session.run(samples_100)
+                samples = ((samples+1.)*(255.99/2)).astype('int32')
+                yield samples.reshape((-1, 3, 32, 32)).transpose(0,2,3,1)
+        return lib.fid.get_fid(sample_batches(), 'cifar10', DATA_DIR)
+
+    # Generator checkpoints, for eval_checkpoints.py
+    saver = lib.checkpoint.make_saver(samples_100)
+    if CHECKPOINT_FREQUENCY > 0 and not os.path.exists(CHECKPOINT_DIR):
+        os.makedirs(CHECKPOINT_DIR)
+
     train_gen, dev_gen = lib.cifar10.load(BATCH_SIZE, DATA_DIR)
     def inf_train_gen():
         while True:
@@ -361,19 +401,25 @@ with tf.Session() as session:
     session.run(tf.initialize_all_variables())
 
     gen = inf_train_gen()
+    if METRICS_PORT > 0:
+        lib.telemetry.serve(METRICS_PORT, samples_per_iter=BATCH_SIZE*N_CRITIC)
 
-    for iteration in xrange(ITERS):
+    for iteration in range(ITERS):
         start_time = time.time()
 
         if iteration > 0:
-            _ = session.run([gen_train_op], feed_dict={_iteration:iteration})
-
-        for i in xrange(N_CRITIC):
-            _data,_labels = gen.next()
-            if CONDITIONAL and ACGAN:
-                _disc_cost, _disc_wgan, _disc_acgan, _disc_acgan_acc, _disc_acgan_fake_acc, _ = session.run([disc_cost, disc_wgan, disc_acgan, disc_acgan_acc, disc_acgan_fake_acc, disc_train_op], feed_dict={all_real_data_int: _data, all_real_labels:_labels, _iteration:iteration})
-            else:
-                _disc_cost, _ = session.run([disc_cost, disc_train_op], feed_dict={all_real_data_int: _data, all_real_labels:_labels, _iteration:iteration})
+            with lib.timing.phase('gen step'):
+                _ = lib.profiling.run(session, [gen_train_op], feed_dict={_iteration:iteration}, name='gen step', iteration=iteration)
+
+        for i in range(N_CRITIC):
+            with lib.timing.phase('critic'):
+                with lib.timing.phase('data'):
+                    _data,_labels = next(gen)
+                with lib.timing.phase('step'):
+                    if CONDITIONAL and ACGAN:
+                        _disc_cost, _disc_wgan, _disc_acgan, _disc_acgan_acc, _disc_acgan_fake_acc, _ = lib.profiling.run(session, [disc_cost, disc_wgan, disc_acgan, disc_acgan_acc, disc_acgan_fake_acc, disc_train_op], feed_dict={all_real_data_int: _data, all_real_labels:_labels, _iteration:iteration}, name='critic step', iteration=iteration)
+                    else:
+                        _disc_cost, _ = lib.profiling.run(session, [disc_cost, disc_train_op], feed_dict={all_real_data_int: _data, all_real_labels:_labels, _iteration:iteration}, name='critic step', iteration=iteration)
 
         lib.plot.plot('cost', _disc_cost)
         if CONDITIONAL and ACGAN:
@@ -384,19 +430,28 @@ with tf.Session() as session:
         lib.plot.plot('time', time.time() - start_time)
 
         if iteration % INCEPTION_FREQUENCY == INCEPTION_FREQUENCY-1:
-            inception_score = get_inception_score(50000)
+            with lib.timing.phase('inception'):
+                inception_score = get_inception_score(50000)
             lib.plot.plot('inception_50k', inception_score[0])
             lib.plot.plot('inception_50k_std', inception_score[1])
+            with lib.timing.phase('fid'):
+                lib.plot.plot('fid_50k', get_fid(50000))
+
+        if CHECKPOINT_FREQUENCY > 0 and iteration % CHECKPOINT_FREQUENCY == CHECKPOINT_FREQUENCY-1:
+            with lib.timing.phase('checkpoint'):
+                lib.checkpoint.save(session, saver, CHECKPOINT_DIR, iteration)
 
         # Calculate dev loss and generate samples every 100 iters
         if iteration % 100 == 99:
-            dev_disc_costs = []
-            for images,_labels in dev_gen():
-                _dev_disc_cost = session.run([disc_cost], feed_dict={all_real_data_int: images,all_real_labels:_labels})
-                dev_disc_costs.append(_dev_disc_cost)
-            lib.plot.plot('dev_cost', np.mean(dev_disc_costs))
-
-            generate_image(iteration, _data)
+            with lib.timing.phase('dev'):
+                dev_disc_costs = []
+                for images,_labels in dev_gen():
+                    _dev_disc_cost = session.run([disc_cost], feed_dict={all_real_data_int: images,all_real_labels:_labels})
+                    dev_disc_costs.append(_dev_disc_cost)
+                lib.plot.plot('dev_cost', np.mean(dev_disc_costs))
+
+            with lib.timing.phase('images'):
+                generate_image(iteration, _data)
 
         if (iteration < 500) or (iteration % 1000 == 999):
             lib.plot.flush()
@@ -10,7 +10,14 @@ import language_helpers
 import tflib as lib
 import tflib.ops.linear
 import tflib.ops.conv1d
+import tflib.ops.initializers
 import tflib.plot
+import tflib.timing
+import tflib.profiling
+import tflib.telemetry
+import tflib.memory
+import tflib.xla
+import tflib.gan
 
 # Download Google Billion Word at http://www.statmt.org/lm-benchmark/ and
 # fill in the path to the extracted files here!
@@ -30,8 +37,19 @@ LAMBDA = 10 # Gradient penalty lambda hyperparameter.
 MAX_N_EXAMPLES = 10000000 # Max number of data examples to load. If data loading
                           # is too slow or takes too much RAM, you can decrease
                           # this (at the expense of having less training data).
+METRICS_PORT = 0 # Port of the Prometheus metrics endpoint (0 disables)
+XLA = None # XLA compilation: None, 'auto' (auto-clustering) or 'scopes' (JIT around Generator/Discriminator)
+IN_GRAPH_INIT = False # Sample initial weights on-device (faster for deep models; a different RNG stream than NumPy init)
 
 lib.print_model_settings(locals().copy())
+lib.xla.set_mode(XLA)
+
+# Long runs: plot min/max/mean summaries instead of every point, and only
+# keep recent points in memory (the rest is in log/)
+lib.plot.enable_downsampling()
+lib.plot.set_window(10000)
+if IN_GRAPH_INIT:
+    lib.ops.initializers.enable_in_graph_init()
 
 lines, charmap, inv_charmap = language_helpers.load_dataset(
     max_length=SEQ_LEN,
@@ -84,18 +102,13 @@ def Discriminator(inputs):
     output = lib.ops.linear.Linear('Discriminator.Output', SEQ_LEN*DIM, 1, output)
     return output
 
+Generator, Discriminator = lib.xla.jit(Generator), lib.xla.jit(Discriminator)
+
 real_inputs_discrete = tf.placeholder(tf.int32, shape=[BATCH_SIZE, SEQ_LEN])
 real_inputs = tf.one_hot(real_inputs_discrete, len(charmap))
 fake_inputs = Generator(BATCH_SIZE)
 fake_inputs_discrete = tf.argmax(fake_inputs, fake_inputs.get_shape().ndims-1)
 
-disc_real = Discriminator(real_inputs) 
-disc_fake = Discriminator(fake_inputs)
-
-disc_cost = tf.reduce_mean(disc_fake) - tf.reduce_mean(disc_real)
-gen_cost = -tf.reduce_mean(disc_fake)
-
-# WGAN lipschitz-penalty
 alpha = tf.random_uniform(
     shape=[BATCH_SIZE,1,1], 
     minval=0.,
@@ -103,7 +116,16 @@ alpha = tf.random_uniform(
 )
 differences = fake_inputs - real_inputs
 interpolates = real_inputs + (alpha*differences)
-gradients = tf.gradients(Discriminator(interpolates), [interpolates])[0]
+# One critic pass over real, fake and interpolates together
+disc_real, disc_fake, disc_interpolates = lib.gan.discriminate(
+    Discriminator, real_inputs, fake_inputs, interpolates)
+
+disc_cost = tf.reduce_mean(disc_fake) - tf.reduce_mean(disc_real)
+# The generator step feeds no real data, so it gets its own critic pass
+gen_cost = -tf.reduce_mean(Discriminator(fake_inputs))
+
+# WGAN lipschitz-penalty
+gradients = tf.gradients(disc_interpolates, [interpolates])[0]
 slopes = tf.sqrt(tf.reduce_sum(tf.square(gradients), reduction_indices=[1,2]))
 gradient_penalty = tf.reduce_mean((slopes-1.)**2)
 disc_cost += LAMBDA*gradient_penalty
@@ -133,7 +155,7 @@ for i in range(4):
     print("validation set JSD for n={}: {}".format(i+1, true_char_ngram_lms[i].js_with(validation_char_ngram_lms[i])))
 true_char_ngram_lms = [language_helpers.NgramLanguageModel(i+1, lines, tokenize=False) for i in range(4)]
 
-with tf.Session() as session:
+with tf.Session(config=lib.xla.session_config()) as session:
 
     session.run(tf.initialize_all_variables())
 
@@ -149,33 +171,44 @@ with tf.Session() as session:
         return decoded_samples
 
     gen = inf_train_gen()
+    if METRICS_PORT > 0:
+        lib.telemetry.serve(METRICS_PORT, samples_per_iter=BATCH_SIZE*CRITIC_ITERS)
 
     for iteration in range(ITERS):
         start_time = time.time()
 
         # Train generator
         if iteration > 0:
-            _ = session.run(gen_train_op)
+            with lib.timing.phase('gen step'):
+                _ = lib.profiling.run(session, gen_train_op, name='gen step', iteration=iteration)
 
         # Train critic
         for i in range(CRITIC_ITERS):
-            _data = next(gen)
-            _disc_cost, _ = session.run(
-                [disc_cost, disc_train_op],
-                feed_dict={real_inputs_discrete:_data}
-            )
+            with lib.timing.phase('critic'):
+                with lib.timing.phase('data'):
+                    _data = next(gen)
+                with lib.timing.phase('step'):
+                    _disc_cost, _ = lib.profiling.run(
+                        session,
+                        [disc_cost, disc_train_op],
+                        feed_dict={real_inputs_discrete:_data},
+                        name='critic step',
+                        iteration=iteration
+                    )
 
         lib.plot.plot('time', time.time() - start_time)
         lib.plot.plot('train disc cost', _disc_cost)
 
         if iteration % 100 == 99:
-            samples = []
-            for i in range(10):
-                samples.extend(generate_samples())
-
-            for i in range(4):
-                lm = language_helpers.NgramLanguageModel(i+1, samples, tokenize=False)
-                lib.plot.plot('js{}'.format(i+1), lm.js_with(true_char_ngram_lms[i]))
+            with lib.timing.phase('samples'):
+                samples = []
+                for i in range(10):
+                    samples.extend(generate_samples())
+
+            with lib.timing.phase('js'):
+                for i in range(4):
+                    lm = language_helpers.NgramLanguageModel(i+1, samples, tokenize=False)
+                    lib.plot.plot('js{}'.format(i+1), lm.js_with(true_char_ngram_lms[i]))
 
             with open('samples_{}.txt'.format(iteration), 'w') as f:
                 for s in samples:
@@ -18,6 +18,8 @@ import tflib.ops.deconv2d
 import tflib.save_images
 import tflib.mnist
 import tflib.plot
+import tflib.xla
+import tflib.gan
 
 MODE = 'wgan-gp' # dcgan, wgan, or wgan-gp
 DIM = 64 # Model dimensionality
@@ -26,8 +28,10 @@ CRITIC_ITERS = 5 # For WGAN and WGAN-GP, number of critic iters per gen iter
 LAMBDA = 10 # Gradient penalty lambda hyperparameter
 ITERS = 200000 # How many generator iterations to train for 
 OUTPUT_DIM = 784 # Number of pixels in MNIST (28*28)
+XLA = None # XLA compilation: None, 'auto' (auto-clustering) or 'scopes' (JIT around Generator/Discriminator)
 
 lib.print_model_settings(locals().copy())
+lib.xla.set_mode(XLA)
 
 def LeakyReLU(x, alpha=0.2):
     return tf.maximum(alpha*x, x)
@@ -100,11 +104,25 @@ def Discriminator(inputs):
 
     return tf.reshape(output, [-1])
 
+Generator, Discriminator = lib.xla.jit(Generator), lib.xla.jit(Discriminator)
+
 real_data = tf.placeholder(tf.float32, shape=[BATCH_SIZE, OUTPUT_DIM])
 fake_data = Generator(BATCH_SIZE)
 
-disc_real = Discriminator(real_data)
-disc_fake = Discriminator(fake_data)
+if MODE == 'wgan-gp':
+    alpha = tf.random_uniform(
+        shape=[BATCH_SIZE,1], 
+        minval=0.,
+        maxval=1.
+    )
+    differences = fake_data - real_data
+    interpolates = real_data + (alpha*differences)
+    # One critic pass over real, fake and interpolates together
+    disc_real, disc_fake, disc_interpolates = lib.gan.discriminate(
+        Discriminator, real_data, fake_data, interpolates)
+else:
+    disc_real = Discriminator(real_data)
+    disc_fake = Discriminator(fake_data)
 
 gen_params = lib.params_with_name('Generator')
 disc_params = lib.params_with_name('Discriminator')
@@ -132,17 +150,11 @@ if MODE == 'wgan':
     clip_disc_weights = tf.group(*clip_ops)
 
 elif MODE == 'wgan-gp':
-    gen_cost = -tf.reduce_mean(disc_fake)
+    # The generator step feeds no real data, so it gets its own critic pass
+    gen_cost = -tf.reduce_mean(Discriminator(fake_data))
     disc_cost = tf.reduce_mean(disc_fake) - tf.reduce_mean(disc_real)
 
-    alpha = tf.random_uniform(
-        shape=[BATCH_SIZE,1], 
-        minval=0.,
-        maxval=1.
-    )
-    differences = fake_data - real_data
-    interpolates = real_data + (alpha*differences)
-    gradients = tf.gradients(Discriminator(interpolates), [interpolates])[0]
+    gradients = tf.gradients(disc_interpolates, [interpolates])[0]
     slopes = tf.sqrt(tf.reduce_sum(tf.square(gradients), reduction_indices=[1]))
     gradient_penalty = tf.reduce_mean((slopes-1.)**2)
     disc_cost += LAMBDA*gradient_penalty
@@ -205,7 +217,7 @@ def inf_train_gen():
             yield images
 
 # Train loop
-with tf.Session() as session:
+with tf.Session(config=lib.xla.session_config()) as session:
 
     session.run(tf.global_variables_initializer())
 
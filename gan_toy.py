@@ -14,6 +14,8 @@ import sklearn.datasets
 import tflib as lib
 import tflib.ops.linear
 import tflib.plot
+import tflib.xla
+import tflib.gan
 
 MODE = 'wgan-gp' # wgan or wgan-gp
 DATASET = '8gaussians' # 8gaussians, 25gaussians, swissroll
@@ -24,8 +26,15 @@ LAMBDA = .1 # Smaller lambda seems to help for toy tasks specifically
 CRITIC_ITERS = 5 # How many critic iterations per generator iteration
 BATCH_SIZE = 256 # Batch size
 ITERS = 100000 # how many generator iterations to train for
+XLA = None # XLA compilation: None, 'auto' (auto-clustering) or 'scopes' (JIT around Generator/Discriminator)
 
 lib.print_model_settings(locals().copy())
+lib.xla.set_mode(XLA)
+
+# Long runs: plot min/max/mean summaries instead of every point, and only
+# keep recent points in memory (the rest is in log/)
+lib.plot.enable_downsampling()
+lib.plot.set_window(10000)
 
 def ReLULayer(name, n_in, n_out, inputs):
     output = lib.ops.linear.Linear(
@@ -56,17 +65,16 @@ def Discriminator(inputs):
     output = lib.ops.linear.Linear('Discriminator.4', DIM, 1, output)
     return tf.reshape(output, [-1])
 
+Generator, Discriminator = lib.xla.jit(Generator), lib.xla.jit(Discriminator)
+
 real_data = tf.placeholder(tf.float32, shape=[None, 2])
 fake_data = Generator(BATCH_SIZE, real_data)
 
+# Also run on arbitrary grids of points, for generate_image()'s contours
 disc_real = Discriminator(real_data)
+# The generator step feeds no real data, so it gets its own critic pass
 disc_fake = Discriminator(fake_data)
 
-# WGAN loss
-disc_cost = tf.reduce_mean(disc_fake) - tf.reduce_mean(disc_real)
-gen_cost = -tf.reduce_mean(disc_fake)
-
-# WGAN gradient penalty
 if MODE == 'wgan-gp':
     alpha = tf.random_uniform(
         shape=[BATCH_SIZE,1], 
@@ -74,7 +82,18 @@ if MODE == 'wgan-gp':
         maxval=1.
     )
     interpolates = alpha*real_data + ((1-alpha)*fake_data)
-    disc_interpolates = Discriminator(interpolates)
+    # One critic pass over real, fake and interpolates together
+    disc_real_batch, disc_fake_batch, disc_interpolates = lib.gan.discriminate(
+        Discriminator, real_data, fake_data, interpolates)
+else:
+    disc_real_batch, disc_fake_batch = disc_real, disc_fake
+
+# WGAN loss
+disc_cost = tf.reduce_mean(disc_fake_batch) - tf.reduce_mean(disc_real_batch)
+gen_cost = -tf.reduce_mean(disc_fake)
+
+# WGAN gradient penalty
+if MODE == 'wgan-gp':
     gradients = tf.gradients(disc_interpolates, [interpolates])[0]
     slopes = tf.sqrt(tf.reduce_sum(tf.square(gradients), reduction_indices=[1]))
     gradient_penalty = tf.reduce_mean((slopes-1)**2)
@@ -225,7 +244,7 @@ def inf_train_gen():
             yield dataset
 
 # Train loop!
-with tf.Session() as session:
+with tf.Session(config=lib.xla.session_config()) as session:
     session.run(tf.initialize_all_variables())
     gen = inf_train_gen()
     for iteration in range(ITERS):
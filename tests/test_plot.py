@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow') # tflib/__init__.py imports it
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# One simulated training run: `iters` iterations of plotting 'cost', with a
+# flush every 100
+RUN = textwrap.dedent("""
+    import sys
+    import tflib.plot
+    for iteration in range(int(sys.argv[1])):
+        tflib.plot.plot('cost', float(iteration))
+        if iteration % 100 == 99:
+            tflib.plot.flush()
+        tflib.plot.tick()
+    tflib.plot.flush()
+    tflib.plot.wait()
+""")
+
+def simulate_run(run_dir, iters):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = REPO_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    subprocess.check_call([sys.executable, '-c', RUN, str(iters)], cwd=str(run_dir), env=env)
+
+def test_second_run_replaces_log(tmpdir):
+    import tflib.plot
+    simulate_run(tmpdir, 500)
+    simulate_run(tmpdir, 5)
+    iters, values = tflib.plot.read_log('cost', str(tmpdir.join(tflib.plot.LOG_DIR)))
+    np.testing.assert_array_equal(iters, np.arange(5))
+    np.testing.assert_array_equal(values, np.arange(5.))
+
+def test_one_run_appends_across_flushes(tmpdir):
+    import tflib.plot
+    simulate_run(tmpdir, 250)
+    iters, values = tflib.plot.read_log('cost', str(tmpdir.join(tflib.plot.LOG_DIR)))
+    np.testing.assert_array_equal(iters, np.arange(250))
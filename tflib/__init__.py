@@ -1,12 +1,44 @@
 import numpy as np
 import tensorflow as tf
 
+import bisect
+import collections
 import locale
 
 locale.setlocale(locale.LC_ALL, '')
 
-_params = {}
+class _Registry(dict):
+    """A dict that drops the lookup caches below whenever it changes."""
+    def __setitem__(self, key, value):
+        _invalidate()
+        dict.__setitem__(self, key, value)
+    def __delitem__(self, key):
+        _invalidate()
+        dict.__delitem__(self, key)
+    def clear(self):
+        _invalidate()
+        dict.clear(self)
+    def update(self, *args, **kwargs):
+        _invalidate()
+        dict.update(self, *args, **kwargs)
+    def pop(self, *args):
+        _invalidate()
+        return dict.pop(self, *args)
+    def setdefault(self, key, default=None):
+        _invalidate()
+        return dict.setdefault(self, key, default)
+
+_params = _Registry()
 _param_aliases = {}
+
+# Caches over _params: its names in sorted order (for prefix lookups by
+# bisection), and the results of params_with_name() by name
+_sorted_names = []
+_name_cache = {}
+def _invalidate():
+    del _sorted_names[:]
+    _name_cache.clear()
+
 def param(name, *args, **kwargs):
     """
     A wrapper for `tf.Variable` which enables parameter sharing in models.
@@ -26,15 +58,70 @@ def param(name, *args, **kwargs):
         param.param = True
         _params[name] = param
     result = _params[name]
-    i = 0
-    while result in _param_aliases:
-        # print 'following alias {}: {} to {}'.format(i, result, _param_aliases[result])
-        i += 1
-        result = _param_aliases[result]
-    return result
+    # alias_params() keeps every alias pointing at the end of its chain
+    return _param_aliases.get(result, result)
+
+def _names():
+    if not _sorted_names and _params:
+        _sorted_names.extend(sorted(_params.keys()))
+    return _sorted_names
+
+def _names_with_prefix(prefix):
+    names = _names()
+    start = bisect.bisect_left(names, prefix)
+    end = start
+    while end < len(names) and names[end].startswith(prefix):
+        end += 1
+    return names[start:end]
 
 def params_with_name(name):
-    return [p for n,p in list(_params.items()) if name in n]
+    """returns: params whose names contain `name`, in sorted name order"""
+    if name not in _name_cache:
+        _name_cache[name] = [_params[n] for n in _names() if name in n]
+    return list(_name_cache[name])
+
+def params_with_prefix(prefix):
+    """
+    returns: params whose names start with `prefix`, in sorted name order,
+    found by bisection rather than a scan of every name
+    """
+    return [_params[n] for n in _names_with_prefix(prefix)]
+
+def params_by_scope(depth=1):
+    """
+    returns: OrderedDict mapping scopes, i.e. the first `depth` dot-separated
+    components of param names ('Generator', 'Discriminator.Res1', ...), to
+    their params
+    """
+    scopes = collections.OrderedDict()
+    for n in _names():
+        scope = '.'.join(n.split('.')[:depth])
+        scopes.setdefault(scope, []).append(_params[n])
+    return scopes
+
+# Last component of param names -> role, for params_by_role()
+PARAM_ROLES = {
+    'W': 'weights',
+    'Filters': 'weights',
+    'b': 'biases',
+    'Biases': 'biases',
+    'g': 'weightnorm',
+    'scale': 'normalization',
+    'offset': 'normalization',
+    'moving_mean': 'statistics',
+    'moving_variance': 'statistics',
+}
+
+def params_by_role(prefix=''):
+    """
+    returns: OrderedDict mapping the roles in PARAM_ROLES, and 'other', to
+    the params starting with `prefix` that play them. E.g. weight decay on
+    params_by_role('Generator')['weights'].
+    """
+    roles = collections.OrderedDict((role, []) for role in sorted(set(PARAM_ROLES.values())) + ['other'])
+    for n in _names_with_prefix(prefix):
+        roles[PARAM_ROLES.get(n.split('.')[-1], 'other')].append(_params[n])
+    return roles
 
 def delete_all_params():
     _params.clear()
@@ -42,11 +129,51 @@ def delete_all_params():
 def alias_params(replace_dict):
     for old,new in list(replace_dict.items()):
         # print "aliasing {} to {}".format(old,new)
+        # Resolve chains here, once, instead of on every param() call
+        new = _param_aliases.get(new, new)
+        for key, target in list(_param_aliases.items()):
+            if target is old:
+                _param_aliases[key] = new
         _param_aliases[old] = new
 
 def delete_param_aliases():
     _param_aliases.clear()
 
+_data_format = 'NCHW'
+def set_data_format(data_format):
+    """
+    Layout of the image tensors passed between tflib.ops layers: 'NCHW'
+    (fastest with cuDNN) or 'NHWC' (what CPU kernels support well). Axis
+    arguments to the ops always keep their NCHW meaning; models convert at
+    their boundaries with to_data_format() and from_data_format().
+    """
+    global _data_format
+    if data_format not in ('NCHW', 'NHWC'):
+        raise Exception('Unknown data format {}'.format(data_format))
+    _data_format = data_format
+
+def get_data_format(data_format=None):
+    """returns: `data_format`, or the global setting if it's None"""
+    return _data_format if data_format is None else data_format
+
+def to_data_format(inputs, data_format=None):
+    """NCHW image tensor -> the data format. Other ranks pass through."""
+    if get_data_format(data_format) == 'NHWC' and inputs.get_shape().ndims == 4:
+        return tf.transpose(inputs, [0,2,3,1], name='NCHW_to_NHWC')
+    return inputs
+
+def from_data_format(inputs, data_format=None):
+    """Image tensor in the data format -> NCHW. Other ranks pass through."""
+    if get_data_format(data_format) == 'NHWC' and inputs.get_shape().ndims == 4:
+        return tf.transpose(inputs, [0,3,1,2], name='NHWC_to_NCHW')
+    return inputs
+
+def data_format_axes(axes, ndims, data_format=None):
+    """Maps NCHW axis numbers of an `ndims`-dim tensor to the data format."""
+    if get_data_format(data_format) == 'NHWC' and ndims == 4:
+        return [[0,3,1,2][axis] for axis in axes]
+    return list(axes)
+
 # def search(node, critereon):
 #     """
 #     Traverse the Theano graph starting at `node` and return a list of all nodes
@@ -7,18 +7,22 @@ image_indices = [73883, 110251, 132301, 57264, 152931, 93861,
                  124938, 79512, 106152, 127384, 134028, 67874,
                  10613, 36510, 198694, 100990]
 
-def make_generator(data_dir, n_files, batch_size):
+# Official CelebA test partition (list_eval_partition.txt), used as the
+# reference set for sample-quality metrics.
+test_partition = list(range(182638, 202600))
+
+def make_generator(data_dir, n_files, batch_size, heldout_indices=()):
     epoch_count = [1]
+    excluded = set("{}.jpg".format(str(i).zfill(6))
+                   for i in list(image_indices) + list(heldout_indices))
 
     def get_epoch():
         images = np.zeros((batch_size, 3, 64, 64), dtype='int32')
         files = [name for name in os.listdir(data_dir)
                  if os.path.isfile(os.path.join(data_dir, name))]
-        # remove testset
-        for i in image_indices:
-            test_file = "{}.jpg".format(str(i).zfill(6))
-            files.remove(test_file)
-        assert n_files == len(files) + len(image_indices)
+        # remove testset and held-out evaluation images
+        files = [name for name in files if name not in excluded]
+        assert n_files == len(files) + len(excluded)
         
         random_state = np.random.RandomState(epoch_count[0])
         random_state.shuffle(files)
@@ -41,12 +45,23 @@ def make_testset(data_dir, image_indices=image_indices):
     return images
 
 
-def load(batch_size, data_dir='/home/Tong/improved_wgan_training/data/celebA_64x64'):
+def make_batch_generator(data_dir, image_indices, batch_size):
+    def get_epoch():
+        for i in range(0, len(image_indices), batch_size):
+            yield (make_testset(data_dir, image_indices[i:i+batch_size]),)
+    return get_epoch
+
+
+def load(batch_size, data_dir='/home/Tong/improved_wgan_training/data/celebA_64x64', heldout_indices=()):
+    """
+    heldout_indices: images to keep out of training (in addition to the
+        visualization test set), e.g. a prefix of `test_partition`
+    """
     if not os.path.isdir(data_dir):
         raise Exception("{} is not a directory".format(data_dir))
     file_count = 202599
     print('load {} files'.format(file_count))
-    return make_generator(data_dir, file_count, batch_size), make_testset(data_dir)
+    return make_generator(data_dir, file_count, batch_size, heldout_indices), make_testset(data_dir)
 
 if __name__ == '__main__':
     train_gen, test_images  = load(64)
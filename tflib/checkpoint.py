@@ -0,0 +1,62 @@
+"""
+Generator checkpoints for offline evaluation (see eval_checkpoints.py).
+
+A run directory holds one meta graph, written on the first save, plus one
+checkpoint of the generator's params per save. The meta graph records the
+sample tensor (and, for generators conditioned on real images such as the SR
+model, the input it should be fed) in the collections below, so checkpoints
+can be evaluated without importing or rebuilding the training script. Only
+the part of the graph the sample tensor, its input and the saver depend on is
+exported, so ops the script builds for scoring (e.g. the Inception graph that
+tflib.inception_score imports on load) don't bloat the meta graph.
+"""
+
+import os
+
+import tensorflow as tf
+
+import tflib as lib
+
+SAMPLES_COLLECTION = 'eval_samples'
+INPUTS_COLLECTION = 'eval_inputs'
+META_FILENAME = 'generator.meta'
+
+def make_saver(samples, inputs=None, var_list=None):
+    """
+    samples: tensor of generated images, shape (batch size, 3*height*width),
+        with values in [-1, 1]
+    inputs: optional int32 tensor of real images, shape
+        (batch size, 3, height, width), that `samples` are computed from
+    var_list: params to save; defaults to every 'Generator' param
+    """
+    tf.add_to_collection(SAMPLES_COLLECTION, samples)
+    if inputs is not None:
+        tf.add_to_collection(INPUTS_COLLECTION, inputs)
+    if var_list is None:
+        var_list = lib.params_with_name('Generator')
+    return tf.train.Saver(var_list, max_to_keep=None)
+
+def _export_meta_graph(session, saver, meta_path):
+    collections = [SAMPLES_COLLECTION, INPUTS_COLLECTION]
+    saver_def = saver.as_saver_def()
+    outputs = [t.op.name for name in collections for t in session.graph.get_collection(name)]
+    outputs += [saver_def.save_tensor_name.split(':')[0], saver_def.restore_op_name.split(':')[0]]
+    graph_def = tf.graph_util.extract_sub_graph(session.graph.as_graph_def(add_shapes=True), outputs)
+    tf.train.export_meta_graph(
+        filename=meta_path,
+        graph_def=graph_def,
+        saver_def=saver_def,
+        collection_list=collections,
+        graph=session.graph
+    )
+
+def save(session, saver, checkpoint_dir, iteration):
+    meta_path = os.path.join(checkpoint_dir, META_FILENAME)
+    if not os.path.exists(meta_path):
+        _export_meta_graph(session, saver, meta_path)
+    return saver.save(
+        session,
+        os.path.join(checkpoint_dir, 'generator'),
+        global_step=iteration,
+        write_meta_graph=False
+    )
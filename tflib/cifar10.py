@@ -21,7 +21,7 @@ def cifar_generator(filenames, batch_size, data_dir):
     def get_epoch():
         np.random.shuffle(images)
 
-        for i in range(len(images) / batch_size):
+        for i in range(len(images) // batch_size):
             yield np.copy(images[i*batch_size:(i+1)*batch_size])
 
     return get_epoch
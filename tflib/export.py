@@ -0,0 +1,143 @@
+"""
+Inference-only graphs of trained models, with every lib.param baked in as a
+constant and batch norm folded into the layer before it.
+
+    lib.export.export_inference_graph(
+        session,
+        lambda: tf.identity(Generator(None, noise=tf.placeholder(tf.float32, [None, 128], name='noise')), name='samples'),
+        'generator.pb',
+        folds=[('Generator.Input', 'Generator.BN1'), ('Generator.2', 'Generator.BN2')]
+    )
+
+For each (layer, batchnorm) pair in `folds` whose layer has biases, the
+batchnorm's moving statistics, scale and offset go into the layer's weights
+and biases, and the batchnorm disappears from the exported graph. Batchnorms
+that can't be folded are exported with lib.ops.batchnorm's frozen statistics,
+i.e. as one multiply-add.
+"""
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+import tflib as lib
+import tflib.ops.batchnorm
+
+# Same epsilon as lib.ops.batchnorm
+EPSILON = 1e-5
+
+def _weight_name(layer, values):
+    for suffix in ['.W', '.Filters']:
+        if layer+suffix in values:
+            return layer+suffix
+    return None
+
+def _bias_name(layer, values):
+    for suffix in ['.b', '.Biases']:
+        if layer+suffix in values:
+            return layer+suffix
+    return None
+
+def fold_batchnorm(values, folds, output_axes={}):
+    """
+    values: {param name: value} of every lib.param
+    folds: (layer name, batchnorm name) pairs, where the batchnorm normalizes
+        the layer's output (possibly reshaped to channels-first images, as
+        after the Linear layer at the input of the DCGAN generators)
+    output_axes: {weight name: axis of the weights indexed by output unit},
+        for weights whose output axis isn't the last one
+    returns: (new values, names of the batchnorms that were folded)
+    """
+    values = dict(values)
+    folded = []
+    for layer, bn in folds:
+        weight_name = _weight_name(layer, values)
+        bias_name = _bias_name(layer, values)
+        if weight_name is None or (bn+'.moving_mean') not in values:
+            continue # Not part of this model (e.g. built with bn=False)
+        if bias_name is None:
+            print("WARNING ({}): {} has no biases to fold into, leaving it unfolded".format(bn, layer))
+            continue
+
+        weights = values[weight_name]
+        output_axis = output_axes.get(weight_name, weights.ndim-1) % weights.ndim
+        norm_axes = tuple(axis for axis in range(weights.ndim) if axis != output_axis)
+        if (layer+'.g') in values:
+            # Weightnorm'd layers compute weights * g / norms(weights)
+            norms = np.sqrt(np.sum(np.square(weights), axis=norm_axes, keepdims=True))
+            weights = weights * values[layer+'.g'].reshape(norms.shape) / norms
+
+        mean = values[bn+'.moving_mean'].reshape(-1)
+        var = values[bn+'.moving_variance'].reshape(-1)
+        scale = values[bn+'.scale'].reshape(-1)
+        offset = values[bn+'.offset'].reshape(-1)
+        multiplier = scale / np.sqrt(var + EPSILON)
+        shift = offset - (mean * multiplier)
+
+        # Output units are grouped by channel (channel = unit // units per
+        # channel), as they are when a Linear layer's output is reshaped to
+        # (batch size, channels, height, width)
+        n_outputs = weights.shape[output_axis]
+        if n_outputs % len(multiplier) != 0:
+            raise Exception('{} has {} outputs, which {} can\'t be {} channels of'.format(layer, n_outputs, bn, len(multiplier)))
+        multiplier = np.repeat(multiplier, n_outputs // len(shift))
+        shift = np.repeat(shift, n_outputs // len(shift))
+
+        broadcast_shape = [1] * weights.ndim
+        broadcast_shape[output_axis] = n_outputs
+        weights = weights * multiplier.reshape(broadcast_shape)
+        values[weight_name] = weights.astype('float32')
+        values[bias_name] = ((values[bias_name] * multiplier) + shift).astype('float32')
+        if (layer+'.g') in values:
+            values[layer+'.g'] = np.sqrt(np.sum(np.square(weights), axis=norm_axes)).astype('float32')
+        for suffix in ['.offset', '.scale', '.moving_mean', '.moving_variance']:
+            del values[bn+suffix]
+        folded.append(bn)
+    return values, folded
+
+def export_inference_graph(session, build, path, folds=()):
+    """
+    Builds the model again in a new graph, with the current value of every
+    lib.param as a constant, and writes it as a binary GraphDef to `path`.
+
+    build: function building the model in the default graph and returning
+        its output tensor, or a list of them; it creates its own placeholders
+    folds: (layer name, batchnorm name) pairs; see fold_batchnorm()
+    returns: the GraphDef
+    """
+    names = sorted(lib._params.keys())
+    variables = [lib._params[name] for name in names]
+    values = dict(zip(names, session.run(variables)))
+    output_axes = {}
+    for name, variable in zip(names, variables):
+        if hasattr(variable, 'output_axis'):
+            output_axes[name] = variable.output_axis
+    values, folded = fold_batchnorm(values, folds, output_axes)
+
+    params = dict(lib._params)
+    with tf.Graph().as_default() as graph:
+        try:
+            lib._params.clear()
+            for name, value in values.items():
+                lib._params[name] = tf.constant(value, name=name)
+            lib.ops.batchnorm.set_folded(folded)
+            lib.ops.batchnorm.enable_frozen_stats()
+            outputs = build()
+        finally:
+            lib.ops.batchnorm.disable_frozen_stats()
+            lib.ops.batchnorm.unset_folded()
+            lib._params.clear()
+            lib._params.update(params)
+
+        if tf.global_variables():
+            raise Exception('Model built variables outside lib.param: {}'.format([v.name for v in tf.global_variables()]))
+        if not isinstance(outputs, (list, tuple)):
+            outputs = [outputs]
+        graph_def = tf.graph_util.extract_sub_graph(graph.as_graph_def(), [output.op.name for output in outputs])
+
+    directory, filename = os.path.split(os.path.abspath(path))
+    tf.train.write_graph(graph_def, directory, filename, as_text=False)
+    print("Exported {} ({} nodes, {} batchnorms folded) with outputs {}".format(
+        path, len(graph_def.node), len(folded), ', '.join(output.name for output in outputs)))
+    return graph_def
@@ -0,0 +1,105 @@
+"""
+Persisted Inception pool_3 features of a reference dataset, plus blocked
+(chunked) distance computations over them.
+
+Full pairwise distance matrices between tens of thousands of 2048-dim features
+do not fit in memory, so everything here works on [BLOCK_SIZE, BLOCK_SIZE]
+tiles of squared distances, computed with one matrix product each and reduced
+(top-k, any) before moving to the next tile.
+"""
+
+import os
+
+import numpy as np
+
+import tflib as lib
+import tflib.inception_score
+import tflib.fid
+
+INDEX_DIR = lib.fid.STATS_DIR
+BLOCK_SIZE = 1024
+
+def collect_features(batches):
+    """Stacks the pool_3 features of an iterable of image batches."""
+    features = list(lib.inception_score.get_inception_features(batches))
+    return np.concatenate(features, axis=0).astype(np.float32)
+
+def _index_path(dataset, kind):
+    return os.path.join(INDEX_DIR, '{}_{}.npy'.format(dataset, kind))
+
+def _load_or_compute(path, compute):
+    if os.path.exists(path):
+        return np.load(path, mmap_mode='r')
+    values = compute()
+    if not os.path.exists(INDEX_DIR):
+        os.makedirs(INDEX_DIR)
+    np.save(path, values)
+    return values
+
+def get_real_features(dataset, data_dir):
+    """Features of the reference images of `dataset`, cached on disk."""
+    def compute():
+        print('Computing reference features for {}...'.format(dataset))
+        return collect_features(lib.fid.real_image_batches(dataset, data_dir))
+    return _load_or_compute(_index_path(dataset, 'features'), compute)
+
+def get_real_radii(dataset, data_dir, k):
+    """k-NN radii of the reference features of `dataset`, cached on disk."""
+    def compute():
+        return knn_radii(get_real_features(dataset, data_dir), k)
+    return _load_or_compute(_index_path(dataset, 'radii_k{}'.format(k)), compute)
+
+def _squared_norms(x):
+    return np.einsum('ij,ij->i', x, x)
+
+def _blocks(n, block_size):
+    for i in range(0, n, block_size):
+        yield i, min(i + block_size, n)
+
+def _squared_distances(x, x_norms, y, y_norms):
+    d = x.dot(y.T)
+    d *= -2.
+    d += x_norms[:, None]
+    d += y_norms[None, :]
+    return np.maximum(d, 0., out=d)
+
+def knn_radii(features, k, block_size=BLOCK_SIZE):
+    """
+    Distance from each feature to its k-th nearest neighbour within the same
+    set (the point itself is at distance 0 and is not counted).
+    """
+    features = np.asarray(features, dtype=np.float32)
+    norms = _squared_norms(features)
+    radii = np.empty(len(features), dtype=np.float32)
+    for i0, i1 in _blocks(len(features), block_size):
+        nearest = np.empty((i1 - i0, 0), dtype=np.float32)
+        for j0, j1 in _blocks(len(features), block_size):
+            d = _squared_distances(features[i0:i1], norms[i0:i1],
+                                   features[j0:j1], norms[j0:j1])
+            nearest = np.concatenate([nearest, d], axis=1)
+            if nearest.shape[1] > k + 1:
+                nearest = np.partition(nearest, k, axis=1)[:, :k+1]
+        radii[i0:i1] = np.sqrt(np.partition(nearest, k, axis=1)[:, k])
+    return radii
+
+def within_radii(x, y, y_radii, block_size=BLOCK_SIZE):
+    """
+    For each row of `x`, whether it lies inside the hypersphere of radius
+    y_radii[j] around at least one y[j].
+    """
+    x = np.asarray(x, dtype=np.float32)
+    y = np.asarray(y, dtype=np.float32)
+    x_norms = _squared_norms(x)
+    y_norms = _squared_norms(y)
+    squared_radii = np.square(np.asarray(y_radii, dtype=np.float32))
+    result = np.zeros(len(x), dtype=bool)
+    for i0, i1 in _blocks(len(x), block_size):
+        for j0, j1 in _blocks(len(y), block_size):
+            todo = ~result[i0:i1]
+            if not todo.any():
+                break
+            d = _squared_distances(x[i0:i1][todo], x_norms[i0:i1][todo],
+                                   y[j0:j1], y_norms[j0:j1])
+            hits = (d <= squared_radii[None, j0:j1]).any(axis=1)
+            result[i0:i1][todo] = hits
+    return result
@@ -0,0 +1,117 @@
+"""
+Frechet Inception Distance (Heusel et al., 2017) on Inception pool_3 features.
+
+Feature statistics are accumulated batch by batch, so the generated side never
+needs all of its samples (or features) in memory at once. Statistics of the
+real data are computed once per dataset and cached in STATS_DIR.
+"""
+
+import os
+
+import numpy as np
+import scipy.linalg
+
+import tflib as lib
+import tflib.inception_score
+import tflib.cifar10
+import tflib.celebA_64x64
+
+STATS_DIR = '/tmp/fid_stats'
+FEATURE_DIM = 2048
+BATCH_SIZE = 100
+
+class RunningStats(object):
+    """
+    Streaming mean and covariance of feature vectors.
+
+    Uses the batched form of Welford's update (Chan et al.), which merges the
+    statistics of each new batch into the running ones without revisiting old
+    data and without the cancellation problems of summing raw second moments.
+    """
+
+    def __init__(self, dim=FEATURE_DIM):
+        self.n = 0
+        self.mean = np.zeros(dim, dtype=np.float64)
+        self._m2 = np.zeros((dim, dim), dtype=np.float64)
+
+    def update(self, batch):
+        batch = np.asarray(batch, dtype=np.float64).reshape(-1, len(self.mean))
+        m = len(batch)
+        if m == 0:
+            return
+        batch_mean = batch.mean(axis=0)
+        centered = batch - batch_mean
+        delta = batch_mean - self.mean
+        n = self.n + m
+        self.mean += delta * (float(m) / n)
+        self._m2 += centered.T.dot(centered)
+        self._m2 += np.outer(delta, delta) * (float(self.n) * m / n)
+        self.n = n
+
+    def covariance(self):
+        return self._m2 / max(self.n - 1, 1)
+
+def calculate_statistics(batches):
+    """
+    batches: iterable of uint8-range image batches, [batch, height, width, 3]
+
+    returns: (mean, covariance) of the pool_3 features
+    """
+    stats = RunningStats()
+    for features in lib.inception_score.get_inception_features(batches):
+        stats.update(features)
+    return stats.mean, stats.covariance()
+
+def calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
+    diff = mu1 - mu2
+    covmean, _ = scipy.linalg.sqrtm(sigma1.dot(sigma2), disp=False)
+    if not np.isfinite(covmean).all():
+        # Product might be almost singular
+        offset = np.eye(sigma1.shape[0]) * eps
+        covmean = scipy.linalg.sqrtm((sigma1 + offset).dot(sigma2 + offset))
+    if np.iscomplexobj(covmean):
+        covmean = covmean.real
+    return diff.dot(diff) + np.trace(sigma1) + np.trace(sigma2) - 2*np.trace(covmean)
+
+def real_image_batches(dataset, data_dir, batch_size=BATCH_SIZE):
+    """
+    Yields the reference images of `dataset` ('cifar10' test set or 'celebA'
+    test partition) as [batch, height, width, 3] arrays.
+    """
+    if dataset == 'cifar10':
+        get_epoch = lib.cifar10.cifar_generator(['test_batch'], batch_size, data_dir)
+        for images in get_epoch():
+            yield images.reshape((-1, 3, 32, 32)).transpose(0,2,3,1)
+    elif dataset == 'celebA':
+        get_epoch = lib.celebA_64x64.make_batch_generator(
+            data_dir, lib.celebA_64x64.test_partition, batch_size)
+        for (images,) in get_epoch():
+            yield images.transpose(0,2,3,1)
+    else:
+        raise Exception('Unknown dataset {}'.format(dataset))
+
+def _stats_path(dataset):
+    return os.path.join(STATS_DIR, '{}.npz'.format(dataset))
+
+def get_reference_statistics(dataset, data_dir):
+    """Loads the real-data statistics for `dataset`, computing them on first use."""
+    path = _stats_path(dataset)
+    if os.path.exists(path):
+        stats = np.load(path)
+        return stats['mu'], stats['sigma']
+    print('Computing FID reference statistics for {}...'.format(dataset))
+    mu, sigma = calculate_statistics(real_image_batches(dataset, data_dir))
+    if not os.path.exists(STATS_DIR):
+        os.makedirs(STATS_DIR)
+    np.savez(path, mu=mu, sigma=sigma)
+    return mu, sigma
+
+def get_fid(batches, dataset, data_dir):
+    """
+    batches: iterable of generated image batches, [batch, height, width, 3]
+        with values ranging from 0 to 255
+    dataset: 'cifar10' or 'celebA'
+    """
+    mu_real, sigma_real = get_reference_statistics(dataset, data_dir)
+    mu_fake, sigma_fake = calculate_statistics(batches)
+    return calculate_frechet_distance(mu_fake, sigma_fake, mu_real, sigma_real)
@@ -0,0 +1,36 @@
+"""
+Losses shared by the GAN training scripts.
+
+    disc_real, disc_fake, disc_interpolates = lib.gan.discriminate(
+        Discriminator, real_data, fake_data, interpolates)
+    gradients = tf.gradients(disc_interpolates, [interpolates])[0]
+
+runs the critic once, on the inputs concatenated along the batch axis, instead
+of once per input: one set of larger kernels and one read of each weight.
+Only use this with critics whose output for an example doesn't depend on the
+rest of the batch (no batchnorm; layernorm is fine), which is what WGAN-GP
+critics are restricted to anyway. The gradient penalty still sees only the
+interpolates' own outputs, since the gradients flow back through the concat.
+Give the generator's cost a separate Discriminator(fake_data): the fused
+outputs depend on the real data, and backpropagating the generator step
+through them would run the critic's backward pass on all three batches.
+"""
+
+import tensorflow as tf
+
+def discriminate(Discriminator, *inputs, **kwargs):
+    """
+    Discriminator(batch, **kwargs) on all `inputs` (same shape but for the
+    batch dimension) at once.
+
+    returns: one tensor of outputs per input, in order
+    """
+    if len(inputs) == 1:
+        return [Discriminator(inputs[0], **kwargs)]
+    static_sizes = [x.get_shape()[0].value for x in inputs]
+    if None in static_sizes:
+        sizes = tf.stack([tf.shape(x)[0] for x in inputs])
+    else:
+        sizes = static_sizes
+    outputs = Discriminator(tf.concat(inputs, 0), **kwargs)
+    return tf.split(outputs, sizes, axis=0, num=len(inputs))
@@ -0,0 +1,43 @@
+"""
+Full-reference image quality metrics, as graph ops.
+
+Both functions take batches of images of shape (batch size, height, width,
+channels) with values in [0, max_val] and return one value per image, so
+callers can average over arbitrarily many batches.
+"""
+
+import numpy as np
+import tensorflow as tf
+
+def psnr(x, y, max_val=1.):
+    mse = tf.reduce_mean(tf.square(x - y), axis=[1,2,3])
+    return 10. * tf.log((max_val ** 2) / mse) / np.log(10.)
+
+def _gaussian_filter(size, sigma, channels):
+    coords = np.arange(size, dtype='float32') - (size - 1) / 2.
+    g = np.exp(-(coords ** 2) / (2 * sigma ** 2))
+    g = np.outer(g, g)
+    g /= g.sum()
+    return np.tile(g[:, :, None, None], [1, 1, channels, 1]).astype('float32')
+
+def ssim(x, y, max_val=1., filter_size=11, filter_sigma=1.5, k1=0.01, k2=0.03):
+    """
+    Structural similarity (Wang et al., 2004) with the standard 11x11 Gaussian
+    window, averaged over valid window positions and channels.
+    """
+    channels = x.get_shape().as_list()[-1]
+    window = tf.constant(_gaussian_filter(filter_size, filter_sigma, channels))
+    def blur(z):
+        return tf.nn.depthwise_conv2d(z, window, strides=[1,1,1,1], padding='VALID')
+
+    c1 = (k1 * max_val) ** 2
+    c2 = (k2 * max_val) ** 2
+    mu_x = blur(x)
+    mu_y = blur(y)
+    sigma_xx = blur(x * x) - mu_x * mu_x
+    sigma_yy = blur(y * y) - mu_y * mu_y
+    sigma_xy = blur(x * y) - mu_x * mu_y
+
+    luminance = (2 * mu_x * mu_y + c1) / (mu_x * mu_x + mu_y * mu_y + c1)
+    contrast_structure = (2 * sigma_xy + c2) / (sigma_xx + sigma_yy + c2)
+    return tf.reduce_mean(luminance * contrast_structure, axis=[1,2,3])
@@ -19,6 +19,7 @@ import sys
 MODEL_DIR = '/tmp/imagenet'
 DATA_URL = 'http://download.tensorflow.org/models/image/imagenet/inception-2015-12-05.tgz'
 softmax = None
+features = None
 
 # Call this function with list of images. Each of elements should be a 
 # numpy array with values ranging from 0 to 255.
@@ -52,9 +53,20 @@ def get_inception_score(images, splits=10):
       scores.append(np.exp(kl))
     return np.mean(scores), np.std(scores)
 
+# Call this function with an iterable of image batches. Each batch should be a
+# numpy array of shape [batch, height, width, 3] with values ranging from 0 to
+# 255. Yields the 2048-dim pool_3 features of each batch in turn, so callers
+# can reduce them without holding every image (or feature) in memory.
+def get_inception_features(batches):
+  with tf.Session() as sess:
+    for batch in batches:
+      assert(len(batch.shape) == 4)
+      inp = batch.astype(np.float32)
+      yield sess.run(features, {'ExpandDims:0': inp})
+
 # This function is called automatically.
 def _init_inception():
-  global softmax
+  global softmax, features
   if not os.path.exists(MODEL_DIR):
     os.makedirs(MODEL_DIR)
   filename = DATA_URL.split('/')[-1]
@@ -92,6 +104,7 @@ def _init_inception():
     w = sess.graph.get_operation_by_name("softmax/logits/MatMul").inputs[1]
     logits = tf.matmul(tf.squeeze(pool3), w)
     softmax = tf.nn.softmax(logits)
+    features = tf.reshape(pool3, [-1, 2048])
 
 if softmax is None:
   _init_inception()
@@ -0,0 +1,44 @@
+"""
+Kernel Inception Distance (Binkowski et al., 2018): the unbiased MMD^2 between
+real and generated pool_3 features under the cubic polynomial kernel
+k(x, y) = (x.y / d + 1)^3, averaged over random subsets.
+"""
+
+import numpy as np
+
+import tflib as lib
+import tflib.feature_index
+
+def _kernel(x, y):
+    return (x.dot(y.T) / x.shape[1] + 1.) ** 3
+
+def _mmd2(x, y):
+    m = len(x)
+    k_xx = _kernel(x, x)
+    k_yy = _kernel(y, y)
+    k_xy = _kernel(x, y)
+    # Unbiased estimate: drop the diagonals of the within-set kernels
+    sum_xx = k_xx.sum() - np.trace(k_xx)
+    sum_yy = k_yy.sum() - np.trace(k_yy)
+    return (sum_xx + sum_yy) / (m * (m-1)) - 2. * k_xy.sum() / (m * m)
+
+def calculate_kid(fake_features, real_features, n_subsets=100, subset_size=1000, seed=0):
+    """returns: (mean, std) of the subset MMD^2 estimates"""
+    subset_size = min(subset_size, len(fake_features), len(real_features))
+    random_state = np.random.RandomState(seed)
+    estimates = []
+    for i in range(n_subsets):
+        fake = fake_features[random_state.choice(len(fake_features), subset_size, replace=False)]
+        real = real_features[np.sort(random_state.choice(len(real_features), subset_size, replace=False))]
+        estimates.append(_mmd2(np.asarray(fake, dtype=np.float64), np.asarray(real, dtype=np.float64)))
+    return np.mean(estimates), np.std(estimates)
+
+def get_kid(batches, dataset, data_dir):
+    """
+    batches: iterable of generated image batches, [batch, height, width, 3]
+        with values ranging from 0 to 255
+    dataset: 'cifar10' or 'celebA'
+    """
+    real_features = lib.feature_index.get_real_features(dataset, data_dir)
+    fake_features = lib.feature_index.collect_features(batches)
+    return calculate_kid(fake_features, real_features)
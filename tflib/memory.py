@@ -0,0 +1,109 @@
+"""
+Host and TensorFlow allocator memory, logged through lib.plot.
+
+At every lib.plot.flush() this plots the process's current and peak RSS, in
+MB. With --track_memory, the first call of each lib.profiling.run() step after
+a flush also runs with SOFTWARE_TRACE, and the most bytes in use by every
+allocator (one per device) at any point of its step stats are plotted as
+'memory <step> <allocator> peak MB'. The first such step of each name is also
+broken down per tensor into <trace_dir>/memory_<step>.txt.
+"""
+
+import collections
+import os
+import resource
+
+import tensorflow as tf
+
+import tflib as lib
+import tflib.plot
+import tflib.profiling
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_boolean('track_memory', False, "log TF allocator peaks of traced steps at every flush")
+
+REPORT_TENSORS = 50
+MB = 1024. ** 2
+
+_flushes = [0]
+# name -> the value of _flushes when the step was last sampled
+_sampled = {}
+_reported = set()
+# (name, allocator) -> peak bytes since the last flush
+_allocator_peaks = collections.OrderedDict()
+
+def resident_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        # No /proc: fall back to the peak RSS
+        return peak_resident_bytes()
+
+def peak_resident_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def allocator_peaks(step_stats):
+    """
+    returns: {allocator name: peak bytes in use} over the step, the largest
+        of the allocator-wide snapshots taken after every op. (peak_bytes is
+        only the op's own high-water mark, far below the device's peak.)
+    """
+    peaks = {}
+    for dev_stats in step_stats.dev_stats:
+        for node_stats in dev_stats.node_stats:
+            for memory in node_stats.memory:
+                peaks[memory.allocator_name] = max(peaks.get(memory.allocator_name, 0), memory.allocator_bytes_in_use)
+    return peaks
+
+def tensor_report(step_stats, n=REPORT_TENSORS):
+    """returns: lines of text listing the largest tensors allocated in the step"""
+    tensors = []
+    by_allocator = collections.defaultdict(int)
+    for dev_stats in step_stats.dev_stats:
+        for node_stats in dev_stats.node_stats:
+            for output in node_stats.output:
+                description = output.tensor_description
+                allocation = description.allocation_description
+                shape = [d.size for d in description.shape.dim]
+                tensors.append((allocation.allocated_bytes, allocation.allocator_name,
+                                '{}:{}'.format(node_stats.node_name, output.slot),
+                                tf.as_dtype(description.dtype).name, shape))
+                by_allocator[allocation.allocator_name] += allocation.allocated_bytes
+    lines = ['Allocated by output tensors:']
+    for allocator, total in sorted(by_allocator.items()):
+        lines.append('  {:10.1f} MB  {}'.format(total / MB, allocator))
+    lines.append('Largest tensors:')
+    for allocated, allocator, tensor, dtype, shape in sorted(tensors, key=lambda t: -t[0])[:n]:
+        lines.append('  {:10.1f} MB  {:12}  {}  {}{}'.format(allocated / MB, allocator, tensor, dtype, shape))
+    return lines
+
+def _wants_stats(name):
+    return FLAGS.track_memory and _sampled.get(name) != _flushes[0]
+
+def _on_stats(name, run_metadata):
+    _sampled[name] = _flushes[0]
+    for allocator, peak in allocator_peaks(run_metadata.step_stats).items():
+        key = (name, allocator)
+        _allocator_peaks[key] = max(_allocator_peaks.get(key, 0), peak)
+    if name not in _reported:
+        _reported.add(name)
+        if not os.path.isdir(FLAGS.trace_dir):
+            os.makedirs(FLAGS.trace_dir)
+        path = os.path.join(FLAGS.trace_dir, 'memory_{}.txt'.format(name.replace(' ', '_')))
+        with open(path, 'w') as f:
+            f.write('\n'.join(tensor_report(run_metadata.step_stats)) + '\n')
+        print('Wrote memory report {}'.format(path))
+
+def _plot_memory():
+    lib.plot.plot('memory rss MB', resident_bytes() / MB)
+    lib.plot.plot('memory peak rss MB', peak_resident_bytes() / MB)
+    for (name, allocator), peak in _allocator_peaks.items():
+        lib.plot.plot('memory {} {} peak MB'.format(name, allocator), peak / MB)
+    _allocator_peaks.clear()
+    _flushes[0] += 1
+
+lib.plot.add_flush_hook(_plot_memory)
+lib.profiling.add_step_stats_hook(_wants_stats, _on_stats)
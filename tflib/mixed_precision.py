@@ -0,0 +1,122 @@
+"""
+Mixed-precision training.
+
+    lib.mixed_precision.set_compute_dtype('bfloat16') # or 'float16'
+
+makes Linear, Conv1D, Conv2D and Deconv2D built from then on cast their
+inputs and (float32 master) weights to that dtype and compute in it. Their
+results stay in it, so activations go through nonlinearities and the next
+layers in reduced precision; Batchnorm and Layernorm compute their statistics
+in float32 but normalize in the activations' dtype. Only the models' outputs
+go back to float32, for the costs and anything else mixing them with float32
+data:
+
+    Generator, Discriminator = lib.mixed_precision.float32_outputs(Generator), \
+        lib.mixed_precision.float32_outputs(Discriminator)
+
+Costs then need loss scaling to keep small gradients from flushing to zero in
+the reduced-precision backward pass:
+
+    disc_loss_scale = lib.mixed_precision.LossScale('Discriminator')
+    gradients = disc_loss_scale.gradients(Discriminator(interpolates), [interpolates])[0]
+    disc_train_op = disc_loss_scale.minimize(tf.train.AdamOptimizer(1e-4), disc_cost, var_list=...)
+
+Without a compute dtype, LossScale passes through to tf.gradients() and
+optimizer.minimize(), so scripts can use it unconditionally.
+"""
+
+import functools
+
+import tensorflow as tf
+
+INITIAL_LOSS_SCALE = 2.**15
+# Finite steps after which the loss scale doubles
+INCREMENT_EVERY = 2000
+
+_compute_dtype = None
+def set_compute_dtype(dtype):
+    global _compute_dtype
+    if dtype not in ('float16', 'bfloat16'):
+        raise Exception('Unsupported compute dtype {}'.format(dtype))
+    _compute_dtype = tf.as_dtype(dtype)
+
+def unset_compute_dtype():
+    global _compute_dtype
+    _compute_dtype = None
+
+def enabled():
+    return _compute_dtype is not None
+
+def to_compute_dtype(x):
+    """Casts `x` to the compute dtype, if there is one."""
+    if _compute_dtype is None or x.dtype.base_dtype == _compute_dtype:
+        return x
+    return tf.cast(x, _compute_dtype)
+
+def to_float32(x):
+    """Casts a result computed in the compute dtype back to float32."""
+    if _compute_dtype is None or x.dtype.base_dtype == tf.float32:
+        return x
+    return tf.cast(x, tf.float32)
+
+def cast_like(x, reference):
+    """Casts `x` (e.g. float32 statistics) to the dtype of `reference`."""
+    if x.dtype.base_dtype == reference.dtype.base_dtype:
+        return x
+    return tf.cast(x, reference.dtype.base_dtype)
+
+def float32_outputs(builder):
+    """Wraps a model builder so its outputs are cast back to float32."""
+    @functools.wraps(builder)
+    def wrapper(*args, **kwargs):
+        return to_float32(builder(*args, **kwargs))
+    return wrapper
+
+class LossScale(object):
+    """
+    A dynamic loss scale: gradients are computed of the cost times the scale
+    and divided by it afterwards. Steps whose gradients aren't finite are
+    skipped and halve the scale; INCREMENT_EVERY finite steps in a row
+    double it.
+    """
+    def __init__(self, name, initial_scale=INITIAL_LOSS_SCALE):
+        self.name = name
+        if not enabled():
+            self.scale = None
+            return
+        with tf.name_scope(None):
+            self.scale = tf.Variable(initial_scale, dtype=tf.float32, trainable=False, name=name+'.loss_scale')
+            self.finite_steps = tf.Variable(0, dtype=tf.int32, trainable=False, name=name+'.finite_steps')
+
+    def gradients(self, ys, xs, **kwargs):
+        """tf.gradients(ys, xs, **kwargs), computed with the loss scale"""
+        if self.scale is None:
+            return tf.gradients(ys, xs, **kwargs)
+        grads = tf.gradients(ys * self.scale, xs, **kwargs)
+        return [None if g is None else g / self.scale for g in grads]
+
+    def minimize(self, optimizer, loss, var_list, **kwargs):
+        """
+        optimizer.minimize(loss, var_list=var_list, **kwargs), skipping steps
+        whose scaled gradients overflow and adjusting the scale
+        """
+        if self.scale is None:
+            return optimizer.minimize(loss, var_list=var_list, **kwargs)
+        grads = self.gradients(loss, var_list, **kwargs)
+        grads_and_vars = [(g, v) for g, v in zip(grads, var_list) if g is not None]
+        finite = tf.reduce_all(tf.stack([tf.reduce_all(tf.is_finite(g)) for g, v in grads_and_vars]))
+
+        def _apply():
+            apply_op = optimizer.apply_gradients(grads_and_vars)
+            with tf.control_dependencies([apply_op]):
+                grow = tf.greater_equal(self.finite_steps + 1, INCREMENT_EVERY)
+                return tf.group(
+                    tf.assign(self.scale, tf.where(grow, self.scale * 2., self.scale)),
+                    tf.assign(self.finite_steps, tf.where(grow, 0, self.finite_steps + 1))
+                )
+        def _skip():
+            return tf.group(
+                tf.assign(self.scale, tf.maximum(self.scale / 2., 1.)),
+                tf.assign(self.finite_steps, 0)
+            )
+        return tf.cond(finite, _apply, _skip, name=self.name+'.loss_scaled_step')
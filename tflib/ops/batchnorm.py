@@ -1,55 +1,154 @@
 import tflib as lib
+import tflib.mixed_precision
 
 import numpy as np
 import tensorflow as tf
 
-def Batchnorm(name, axes, inputs, is_training=None, stats_iter=None, update_moving_stats=True, fused=True):
-    if ((axes == [0,2,3]) or (axes == [0,2])) and fused==True:
-        if axes==[0,2]:
-            inputs = tf.expand_dims(inputs, 3)
-        # Old (working but pretty slow) implementation:
-        ##########
+# Decay of the moving averages updated by the ops Batchnorm() adds to
+# tf.GraphKeys.UPDATE_OPS
+MOVING_AVERAGE_DECAY = 0.99
 
-        # inputs = tf.transpose(inputs, [0,2,3,1])
+_frozen_stats = False
+def enable_frozen_stats():
+    """
+    Batchnorm layers built from now on normalize with their moving statistics
+    only, folded with scale and offset into one multiply-add per element. For
+    inference graphs of trained models.
+    """
+    global _frozen_stats
+    _frozen_stats = True
 
-        # mean, var = tf.nn.moments(inputs, [0,1,2], keep_dims=False)
-        # offset = lib.param(name+'.offset', np.zeros(mean.get_shape()[-1], dtype='float32'))
-        # scale = lib.param(name+'.scale', np.ones(var.get_shape()[-1], dtype='float32'))
-        # result = tf.nn.batch_normalization(inputs, mean, var, offset, scale, 1e-4)
+def disable_frozen_stats():
+    global _frozen_stats
+    _frozen_stats = False
 
-        # return tf.transpose(result, [0,3,1,2])
+_folded = set()
+def set_folded(names):
+    """
+    Batchnorm layers with these names become the identity, their statistics
+    having been folded into the layer before them (see lib.export).
+    """
+    global _folded
+    _folded = set(names)
 
-        # New (super fast but untested) implementation:
-        offset = lib.param(name+'.offset', np.zeros(inputs.get_shape()[1], dtype='float32'))
-        scale = lib.param(name+'.scale', np.ones(inputs.get_shape()[1], dtype='float32'))
+def unset_folded():
+    global _folded
+    _folded = set()
 
-        moving_mean = lib.param(name+'.moving_mean', np.zeros(inputs.get_shape()[1], dtype='float32'), trainable=False)
-        moving_variance = lib.param(name+'.moving_variance', np.ones(inputs.get_shape()[1], dtype='float32'), trainable=False)
+def _fused_layout(inputs, axes, data_format):
+    """
+    Brings `inputs` into a 4-D layout in which fused_batch_norm normalizes
+    over exactly (physical) `axes`.
+
+    returns: (4-D tensor, its data format, function undoing the layout change)
+    """
+    ndims = inputs.get_shape().ndims
+    if ndims == 4 and axes == sorted(lib.data_format_axes([0,2,3], 4, data_format)):
+        return inputs, data_format, lambda x: x
+    if ndims == 3 and axes == [0,2]:
+        return tf.expand_dims(inputs, 3), 'NCHW', lambda x: x[:,:,:,0] # collapse last dim
+
+    # Move the normalized axes to the front and flatten the rest into channels
+    keep = [axis for axis in range(ndims) if axis not in axes]
+    perm = axes + keep
+    n_channels = int(np.prod([inputs.get_shape()[axis].value for axis in keep]))
+    outputs = inputs
+    if perm != list(range(ndims)):
+        outputs = tf.transpose(outputs, perm)
+    permuted_shape = tf.shape(outputs)
+    outputs = tf.reshape(outputs, [-1, 1, 1, n_channels])
+    def restore(x):
+        x = tf.reshape(x, permuted_shape)
+        if perm != list(range(ndims)):
+            x = tf.transpose(x, np.argsort(perm))
+        x.set_shape(inputs.get_shape())
+        return x
+    return outputs, 'NHWC', restore
+
+def Batchnorm(name, axes, inputs, is_training=None, stats_iter=None, update_moving_stats=True, fused=True, data_format=None):
+    """
+    axes: axes to normalize over, numbered as in NCHW even if 4-D inputs are
+        in the 'NHWC' data format (`data_format`, default lib.get_data_format())
+    is_training: None to always use batch statistics, in which case the ops
+        updating the moving statistics (kept for per-channel axes only, so
+        frozen-statistics mode is an error for other axes) are added to
+        tf.GraphKeys.UPDATE_OPS;
+        or a bool tensor choosing at run time between batch statistics and
+        moving ones blended with the current item's (which, with
+        update_moving_stats, are then updated with `stats_iter`)
+    """
+    if name in _folded:
+        return inputs
+
+    ndims = inputs.get_shape().ndims
+    data_format = lib.get_data_format(data_format) if ndims == 4 else 'NCHW'
+    physical_axes = sorted(lib.data_format_axes(axes, ndims, data_format))
+
+    if (0 in axes) and fused==True:
+        kept_dims = [inputs.get_shape()[axis].value for axis in range(ndims) if axis not in physical_axes]
+        n_channels = int(np.prod(kept_dims))
+
+        # Params of the layouts that were always fused are flat; the others
+        # keep the broadcastable shape they had with the unfused version.
+        always_fused = (axes == [0,2,3]) or (axes == [0,2])
+        if always_fused:
+            param_shape = [n_channels]
+        else:
+            param_shape = [1 if axis in physical_axes else inputs.get_shape()[axis].value for axis in range(ndims)]
+        offset = lib.param(name+'.offset', np.zeros(param_shape, dtype='float32'))
+        scale = lib.param(name+'.scale', np.ones(param_shape, dtype='float32'))
+
+        # The unfused version had no moving statistics, so other layouts only
+        # get them when they're used, and checkpoints of models built with
+        # is_training=None from before still restore.
+        has_moving_stats = always_fused or (is_training is not None)
+        if _frozen_stats and not has_moving_stats:
+            # Nothing would ever have trained them
+            raise Exception('{}: frozen statistics need moving statistics, which axes {} only keep with an is_training tensor'.format(name, axes))
+        if has_moving_stats:
+            moving_mean = lib.param(name+'.moving_mean', np.zeros(param_shape, dtype='float32'), trainable=False)
+            moving_variance = lib.param(name+'.moving_variance', np.ones(param_shape, dtype='float32'), trainable=False)
+
+        if _frozen_stats:
+            # scale*(x-mean)/sqrt(var+eps) + offset == x*multiplier + shift
+            multiplier = scale * tf.rsqrt(moving_variance + 1e-5)
+            shift = offset - (moving_mean * multiplier)
+            broadcast_shape = [1 if axis in physical_axes else inputs.get_shape()[axis].value for axis in range(ndims)]
+            like = lambda p: lib.mixed_precision.cast_like(tf.reshape(p, broadcast_shape), inputs)
+            return (inputs * like(multiplier)) + like(shift)
+
+        x, fused_format, restore = _fused_layout(inputs, physical_axes, data_format)
+        flat = lambda p: tf.reshape(p, [n_channels])
+        # Shape that broadcasts per-channel stats against `x`
+        stats_shape = [1,1,1,-1] if fused_format == 'NHWC' else [1,-1,1,1]
+        # Statistics are float32 even if `x` is in reduced precision (the
+        # fused op computes them in float32 itself)
+        like = lambda t: lib.mixed_precision.cast_like(t, x)
 
         def _fused_batch_norm_training():
-            return tf.nn.fused_batch_norm(inputs, scale, offset, epsilon=1e-5, data_format='NCHW')
+            return tf.nn.fused_batch_norm(x, flat(scale), flat(offset), epsilon=1e-5, data_format=fused_format)
         def _fused_batch_norm_inference():
             # Version which blends in the current item's statistics
-            batch_size = tf.cast(tf.shape(inputs)[0], 'float32')
-            mean, var = tf.nn.moments(inputs, [2,3], keep_dims=True)
-            mean = ((1./batch_size)*mean) + (((batch_size-1.)/batch_size)*moving_mean)[None,:,None,None]
-            var = ((1./batch_size)*var) + (((batch_size-1.)/batch_size)*moving_variance)[None,:,None,None]
-            return tf.nn.batch_normalization(inputs, mean, var, offset[None,:,None,None], scale[None,:,None,None], 1e-5), mean, var
-
-            # Standard version
-            # return tf.nn.fused_batch_norm(
-            #     inputs,
-            #     scale,
-            #     offset,
-            #     epsilon=1e-2, 
-            #     mean=moving_mean,
-            #     variance=moving_variance,
-            #     is_training=False,
-            #     data_format='NCHW'
-            # )
+            batch_size = tf.cast(tf.shape(x)[0], 'float32')
+            mean, var = tf.nn.moments(lib.mixed_precision.to_float32(x), [1,2] if fused_format == 'NHWC' else [2,3], keep_dims=True)
+            mean = ((1./batch_size)*mean) + tf.reshape(((batch_size-1.)/batch_size)*moving_mean, stats_shape)
+            var = ((1./batch_size)*var) + tf.reshape(((batch_size-1.)/batch_size)*moving_variance, stats_shape)
+            return tf.nn.batch_normalization(x, like(mean), like(var), like(tf.reshape(offset, stats_shape)), like(tf.reshape(scale, stats_shape)), 1e-5), mean, var
 
         if is_training is None:
             outputs, batch_mean, batch_var = _fused_batch_norm_training()
+            if update_moving_stats and has_moving_stats:
+                decay = MOVING_AVERAGE_DECAY
+                tf.add_to_collection(tf.GraphKeys.UPDATE_OPS, tf.assign(
+                    moving_mean,
+                    (decay*moving_mean) + ((1.-decay)*tf.reshape(batch_mean, param_shape)),
+                    name=name+'.update_moving_mean'
+                ))
+                tf.add_to_collection(tf.GraphKeys.UPDATE_OPS, tf.assign(
+                    moving_variance,
+                    (decay*moving_variance) + ((1.-decay)*tf.reshape(batch_var, param_shape)),
+                    name=name+'.update_moving_variance'
+                ))
         else:
             outputs, batch_mean, batch_var = tf.cond(is_training,
                                                        _fused_batch_norm_training,
@@ -60,28 +159,25 @@ def Batchnorm(name, axes, inputs, is_training=None, stats_iter=None, update_movi
                     """Internal function forces updates moving_vars if is_training."""
                     float_stats_iter = tf.cast(stats_iter, tf.float32)
 
-                    update_moving_mean = tf.assign(moving_mean, ((float_stats_iter/(float_stats_iter+1))*moving_mean) + ((1/(float_stats_iter+1))*batch_mean))
-                    update_moving_variance = tf.assign(moving_variance, ((float_stats_iter/(float_stats_iter+1))*moving_variance) + ((1/(float_stats_iter+1))*batch_var))
+                    update_moving_mean = tf.assign(moving_mean, ((float_stats_iter/(float_stats_iter+1))*moving_mean) + ((1/(float_stats_iter+1))*tf.reshape(batch_mean, param_shape)))
+                    update_moving_variance = tf.assign(moving_variance, ((float_stats_iter/(float_stats_iter+1))*moving_variance) + ((1/(float_stats_iter+1))*tf.reshape(batch_var, param_shape)))
 
                     with tf.control_dependencies([update_moving_mean, update_moving_variance]):
                         return tf.identity(outputs)
                 outputs = tf.cond(is_training, _force_updates, no_updates)
 
-        if axes == [0,2]:
-            return outputs[:,:,:,0] # collapse last dim
-        else:
-            return outputs
+        return restore(outputs)
     else:
-        # raise Exception('old BN')
-        # TODO we can probably use nn.fused_batch_norm here too for speedup
-        mean, var = tf.nn.moments(inputs, axes, keep_dims=True)
+        # Per-item statistics (0 not in axes), or fused=False
+        mean, var = tf.nn.moments(lib.mixed_precision.to_float32(inputs), physical_axes, keep_dims=True)
         shape = mean.get_shape().as_list()
         if 0 not in axes:
             print("WARNING ({}): didn't find 0 in axes, but not using separate BN params for each item in batch".format(name))
             shape[0] = 1
         offset = lib.param(name+'.offset', np.zeros(shape, dtype='float32'))
         scale = lib.param(name+'.scale', np.ones(shape, dtype='float32'))
-        result = tf.nn.batch_normalization(inputs, mean, var, offset, scale, 1e-5)
+        like = lambda t: lib.mixed_precision.cast_like(t, inputs)
+        result = tf.nn.batch_normalization(inputs, like(mean), like(var), like(offset), like(scale), 1e-5)
 
 
         return result
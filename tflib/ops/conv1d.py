@@ -1,4 +1,7 @@
 import tflib as lib
+import tflib.ops.weightnorm
+import tflib.mixed_precision
+import tflib.ops.initializers
 
 import numpy as np
 import tensorflow as tf
@@ -42,11 +45,7 @@ def Conv1D(name, input_dim, output_dim, filter_size, inputs, he_init=True, mask_
 
 
         def uniform(stdev, size):
-            return np.random.uniform(
-                low=-stdev * np.sqrt(3),
-                high=stdev * np.sqrt(3),
-                size=size
-            ).astype('float32')
+            return lib.ops.initializers.uniform(stdev, size)
 
         fan_in = input_dim * filter_size
         fan_out = output_dim * filter_size / stride
@@ -72,19 +71,20 @@ def Conv1D(name, input_dim, output_dim, filter_size, inputs, he_init=True, mask_
         if weightnorm==None:
             weightnorm = _default_weightnorm
         if weightnorm:
-            norm_values = np.sqrt(np.sum(np.square(filter_values), axis=(0,1)))
+            norm_values = lib.ops.initializers.initial_norms(filter_values, filters, (0,1))
             target_norms = lib.param(
                 name + '.g',
                 norm_values
             )
-            with tf.name_scope('weightnorm') as scope:
-                norms = tf.sqrt(tf.reduce_sum(tf.square(filters), reduction_indices=[0,1]))
-                filters = filters * (target_norms / norms)
+            filters = lib.ops.weightnorm.normalize(name+'.Filters', filters, target_norms, [0,1])
 
         if mask_type is not None:
             with tf.name_scope('filter_mask'):
                 filters = filters * mask
 
+        inputs = lib.mixed_precision.to_compute_dtype(inputs)
+        filters = lib.mixed_precision.to_compute_dtype(filters)
+
         result = tf.nn.conv1d(
             value=inputs, 
             filters=filters, 
@@ -102,7 +102,7 @@ def Conv1D(name, input_dim, output_dim, filter_size, inputs, he_init=True, mask_
             # result = result + _biases
 
             result = tf.expand_dims(result, 3)
-            result = tf.nn.bias_add(result, _biases, data_format='NCHW')
+            result = tf.nn.bias_add(result, lib.mixed_precision.to_compute_dtype(_biases), data_format='NCHW')
             result = tf.squeeze(result)
 
         return result
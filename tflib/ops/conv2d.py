@@ -1,4 +1,7 @@
 import tflib as lib
+import tflib.ops.weightnorm
+import tflib.mixed_precision
+import tflib.ops.initializers
 
 import numpy as np
 import tensorflow as tf
@@ -17,12 +20,16 @@ def unset_weights_stdev():
     global _weights_stdev
     _weights_stdev = None
 
-def Conv2D(name, input_dim, output_dim, filter_size, inputs, he_init=True, mask_type=None, stride=1, weightnorm=None, biases=True, gain=1.):
+def Conv2D(name, input_dim, output_dim, filter_size, inputs, he_init=True, mask_type=None, stride=1, weightnorm=None, biases=True, gain=1., data_format=None, initialization=None):
     """
-    inputs: tensor of shape (batch size, num channels, height, width)
+    inputs: tensor of shape (batch size, num channels, height, width), or
+        (batch size, height, width, num channels) if the data format
+        (`data_format`, default lib.get_data_format()) is 'NHWC'
     mask_type: one of None, 'a', 'b'
+    initialization: None (uniform) or 'orthogonal', at the same scale
 
-    returns: tensor of shape (batch size, num channels, height, width)
+    returns: tensor of shape (batch size, num channels, height, width), in the
+        same data format
     """
     with tf.name_scope(name) as scope:
 
@@ -53,11 +60,7 @@ def Conv2D(name, input_dim, output_dim, filter_size, inputs, he_init=True, mask_
 
 
         def uniform(stdev, size):
-            return np.random.uniform(
-                low=-stdev * np.sqrt(3),
-                high=stdev * np.sqrt(3),
-                size=size
-            ).astype('float32')
+            return lib.ops.initializers.uniform(stdev, size)
 
         fan_in = input_dim * filter_size**2
         fan_out = output_dim * filter_size**2 / (stride**2)
@@ -72,10 +75,15 @@ def Conv2D(name, input_dim, output_dim, filter_size, inputs, he_init=True, mask_
             filters_stdev = np.sqrt(2./(fan_in+fan_out))
 
         if _weights_stdev is not None:
-            filter_values = uniform(
-                _weights_stdev,
-                (filter_size, filter_size, input_dim, output_dim)
+            filters_stdev = _weights_stdev
+
+        if initialization == 'orthogonal':
+            filter_values = lib.ops.initializers.orthogonal(
+                (filter_size, filter_size, input_dim, output_dim),
+                stdev=filters_stdev
             )
+        elif initialization is not None:
+            raise Exception('Invalid initialization!')
         else:
             filter_values = uniform(
                 filters_stdev,
@@ -90,25 +98,32 @@ def Conv2D(name, input_dim, output_dim, filter_size, inputs, he_init=True, mask_
         if weightnorm==None:
             weightnorm = _default_weightnorm
         if weightnorm:
-            norm_values = np.sqrt(np.sum(np.square(filter_values), axis=(0,1,2)))
+            norm_values = lib.ops.initializers.initial_norms(filter_values, filters, (0,1,2))
             target_norms = lib.param(
                 name + '.g',
                 norm_values
             )
-            with tf.name_scope('weightnorm') as scope:
-                norms = tf.sqrt(tf.reduce_sum(tf.square(filters), reduction_indices=[0,1,2]))
-                filters = filters * (target_norms / norms)
+            filters = lib.ops.weightnorm.normalize(name+'.Filters', filters, target_norms, [0,1,2])
 
         if mask_type is not None:
             with tf.name_scope('filter_mask'):
                 filters = filters * mask
 
+        data_format = lib.get_data_format(data_format)
+        if data_format == 'NHWC':
+            strides = [1, stride, stride, 1]
+        else:
+            strides = [1, 1, stride, stride]
+
+        inputs = lib.mixed_precision.to_compute_dtype(inputs)
+        filters = lib.mixed_precision.to_compute_dtype(filters)
+
         result = tf.nn.conv2d(
             input=inputs, 
             filter=filters, 
-            strides=[1, 1, stride, stride],
+            strides=strides,
             padding='SAME',
-            data_format='NCHW'
+            data_format=data_format
         )
 
         if biases:
@@ -117,7 +132,7 @@ def Conv2D(name, input_dim, output_dim, filter_size, inputs, he_init=True, mask_
                 np.zeros(output_dim, dtype='float32')
             )
 
-            result = tf.nn.bias_add(result, _biases, data_format='NCHW')
+            result = tf.nn.bias_add(result, lib.mixed_precision.to_compute_dtype(_biases), data_format=data_format)
 
 
         return result
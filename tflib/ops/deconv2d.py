@@ -1,4 +1,7 @@
 import tflib as lib
+import tflib.ops.weightnorm
+import tflib.mixed_precision
+import tflib.ops.initializers
 
 import numpy as np
 import tensorflow as tf
@@ -28,10 +31,16 @@ def Deconv2D(
     biases=True,
     gain=1.,
     mask_type=None,
+    data_format=None,
+    initialization=None,
     ):
     """
-    inputs: tensor of shape (batch size, height, width, input_dim)
-    returns: tensor of shape (batch size, 2*height, 2*width, output_dim)
+    inputs: tensor of shape (batch size, input_dim, height, width), or
+        (batch size, height, width, input_dim) if the data format
+        (`data_format`, default lib.get_data_format()) is 'NHWC'
+    initialization: None (uniform) or 'orthogonal', at the same scale
+    returns: tensor of shape (batch size, output_dim, 2*height, 2*width), in
+        the same data format
     """
     with tf.name_scope(name) as scope:
 
@@ -39,11 +48,7 @@ def Deconv2D(
             raise Exception('Unsupported configuration')
 
         def uniform(stdev, size):
-            return np.random.uniform(
-                low=-stdev * np.sqrt(3),
-                high=stdev * np.sqrt(3),
-                size=size
-            ).astype('float32')
+            return lib.ops.initializers.uniform(stdev, size)
 
         stride = 2
         fan_in = input_dim * filter_size**2 / (stride**2)
@@ -56,10 +61,15 @@ def Deconv2D(
 
 
         if _weights_stdev is not None:
-            filter_values = uniform(
-                _weights_stdev,
-                (filter_size, filter_size, output_dim, input_dim)
+            filters_stdev = _weights_stdev
+
+        if initialization == 'orthogonal':
+            filter_values = lib.ops.initializers.orthogonal(
+                (filter_size, filter_size, output_dim, input_dim),
+                stdev=filters_stdev
             )
+        elif initialization is not None:
+            raise Exception('Invalid initialization!')
         else:
             filter_values = uniform(
                 filters_stdev,
@@ -72,21 +82,27 @@ def Deconv2D(
             name+'.Filters',
             filter_values
         )
+        # Filters are (size, size, output_dim, input_dim); see lib.export
+        filters.output_axis = 2
 
         if weightnorm==None:
             weightnorm = _default_weightnorm
         if weightnorm:
-            norm_values = np.sqrt(np.sum(np.square(filter_values), axis=(0,1,3)))
+            norm_values = lib.ops.initializers.initial_norms(filter_values, filters, (0,1,3))
             target_norms = lib.param(
                 name + '.g',
                 norm_values
             )
-            with tf.name_scope('weightnorm') as scope:
-                norms = tf.sqrt(tf.reduce_sum(tf.square(filters), reduction_indices=[0,1,3]))
-                filters = filters * tf.expand_dims(target_norms / norms, 1)
+            filters = lib.ops.weightnorm.normalize(name+'.Filters', filters, target_norms, [0,1,3])
+
 
+        inputs = lib.mixed_precision.to_compute_dtype(inputs)
+        filters = lib.mixed_precision.to_compute_dtype(filters)
 
-        inputs = tf.transpose(inputs, [0,2,3,1], name='NCHW_to_NHWC')
+        # conv2d_transpose is run in NHWC either way
+        data_format = lib.get_data_format(data_format)
+        if data_format == 'NCHW':
+            inputs = tf.transpose(inputs, [0,2,3,1], name='NCHW_to_NHWC')
 
         input_shape = tf.shape(inputs)
         try: # tf pre-1.0 (top) vs 1.0 (bottom)
@@ -107,9 +123,10 @@ def Deconv2D(
                 name+'.Biases',
                 np.zeros(output_dim, dtype='float32')
             )
-            result = tf.nn.bias_add(result, _biases)
+            result = tf.nn.bias_add(result, lib.mixed_precision.to_compute_dtype(_biases))
 
-        result = tf.transpose(result, [0,3,1,2], name='NHWC_to_NCHW')
+        if data_format == 'NCHW':
+            result = tf.transpose(result, [0,3,1,2], name='NHWC_to_NCHW')
 
 
         return result
@@ -0,0 +1,79 @@
+import numpy as np
+import tensorflow as tf
+
+_in_graph = False
+def enable_in_graph_init():
+    """
+    Makes the ops sample initial weights with TF ops, run on-device by
+    tf.global_variables_initializer(), instead of embedding NumPy arrays as
+    constants in the graph. Keeps the GraphDef small and graph construction
+    fast for wide or deep models.
+    """
+    global _in_graph
+    _in_graph = True
+
+def disable_in_graph_init():
+    global _in_graph
+    _in_graph = False
+
+def uniform(stdev, size):
+    """
+    returns: uniform weights of standard deviation `stdev`: a float32 array,
+    or a tensor sampling them if in-graph init is enabled
+    """
+    if _in_graph:
+        return tf.random_uniform(
+            size,
+            minval=-stdev * np.sqrt(3),
+            maxval=stdev * np.sqrt(3),
+            dtype=tf.float32
+        )
+    return np.random.uniform(
+        low=-stdev * np.sqrt(3),
+        high=stdev * np.sqrt(3),
+        size=size
+    ).astype('float32')
+
+def orthogonal(shape, stdev=None):
+    """
+    Random (semi-)orthogonal weights: reshaped to (prod(shape[:-1]), shape[-1]),
+    the columns are orthonormal, or the rows if there are fewer of them.
+
+    Takes the QR decomposition of a Gaussian matrix only as large as the
+    result, which is much cheaper than the SVD of a full square one.
+
+    stdev: if given, the weights are rescaled to have this standard deviation
+        (by default their scale is that of an orthonormal matrix)
+    returns: float32 array of `shape`, or a tensor sampling one if in-graph
+        init is enabled
+    """
+    if len(shape) < 2:
+        raise Exception("Only shapes of length 2 or more are supported.")
+    n_rows = int(np.prod(shape[:-1]))
+    n_cols = shape[-1]
+    scale = 1. if stdev is None else stdev * np.sqrt(max(n_rows, n_cols))
+    if _in_graph:
+        a = tf.random_normal([max(n_rows, n_cols), min(n_rows, n_cols)])
+        q, r = tf.qr(a)
+        q *= tf.sign(tf.diag_part(r))
+        if n_rows < n_cols:
+            q = tf.transpose(q)
+        return tf.reshape(scale * q, shape)
+    a = np.random.normal(0.0, 1.0, (max(n_rows, n_cols), min(n_rows, n_cols)))
+    q, r = np.linalg.qr(a)
+    # Make the distribution uniform over orthogonal matrices (Mezzadri 2007)
+    q *= np.sign(np.diag(r))
+    if n_rows < n_cols:
+        q = q.T
+    return (scale * q).reshape(shape).astype('float32')
+
+def initial_norms(values, param, axis):
+    """
+    Norms over `axis` of the initial weights `values` of `param`, as initial
+    target norms for weightnorm.
+    """
+    if isinstance(values, np.ndarray):
+        return np.sqrt(np.sum(np.square(values), axis=axis))
+    # Sampling `values` again would give different weights: read the ones
+    # `param` is initialized with instead
+    return lambda: tf.sqrt(tf.reduce_sum(tf.square(param.initialized_value()), axis))
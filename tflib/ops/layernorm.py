@@ -1,21 +1,34 @@
 import tflib as lib
+import tflib.mixed_precision
 
 import numpy as np
 import tensorflow as tf
 
-def Layernorm(name, norm_axes, inputs):
-    mean, var = tf.nn.moments(inputs, norm_axes, keep_dims=True)
+def Layernorm(name, norm_axes, inputs, data_format=None):
+    """
+    norm_axes: axes to normalize over, numbered as in NCHW even if 4-D inputs
+        are in the 'NHWC' data format (`data_format`, default
+        lib.get_data_format())
+    """
+    ndims = inputs.get_shape().ndims
+    data_format = lib.get_data_format(data_format) if ndims == 4 else 'NCHW'
+    axes = lib.data_format_axes(norm_axes, ndims, data_format)
+    # Statistics in float32 even if the activations are in reduced precision
+    mean, var = tf.nn.moments(lib.mixed_precision.to_float32(inputs), axes, keep_dims=True)
 
     # Assume the 'neurons' axis is the first of norm_axes. This is the case for fully-connected and BCHW conv layers.
-    n_neurons = inputs.get_shape().as_list()[norm_axes[0]]
+    n_neurons = inputs.get_shape().as_list()[axes[0]]
 
     offset = lib.param(name+'.offset', np.zeros(n_neurons, dtype='float32'))
     scale = lib.param(name+'.scale', np.ones(n_neurons, dtype='float32'))
 
-    # Add broadcasting dims to offset and scale (e.g. BCHW conv data)
-    offset = tf.reshape(offset, [-1] + [1 for i in range(len(norm_axes)-1)])
-    scale = tf.reshape(scale, [-1] + [1 for i in range(len(norm_axes)-1)])
+    # Add broadcasting dims to offset and scale (e.g. BCHW conv data); in
+    # BHWC the neurons axis is already the last one.
+    if data_format == 'NCHW':
+        offset = tf.reshape(offset, [-1] + [1 for i in range(len(norm_axes)-1)])
+        scale = tf.reshape(scale, [-1] + [1 for i in range(len(norm_axes)-1)])
 
-    result = tf.nn.batch_normalization(inputs, mean, var, offset, scale, 1e-5)
+    like = lambda x: lib.mixed_precision.cast_like(x, inputs)
+    result = tf.nn.batch_normalization(inputs, like(mean), like(var), like(offset), like(scale), 1e-5)
 
     return result
\ No newline at end of file
@@ -1,4 +1,7 @@
 import tflib as lib
+import tflib.ops.weightnorm
+import tflib.mixed_precision
+import tflib.ops.initializers
 
 import numpy as np
 import tensorflow as tf
@@ -39,14 +42,10 @@ def Linear(
         def uniform(stdev, size):
             if _weights_stdev is not None:
                 stdev = _weights_stdev
-            return np.random.uniform(
-                low=-stdev * np.sqrt(3),
-                high=stdev * np.sqrt(3),
-                size=size
-            ).astype('float32')
-
-        if initialization == 'lecun':# and input_dim != output_dim):
-            # disabling orth. init for now because it's too slow
+            return lib.ops.initializers.uniform(stdev, size)
+
+        if initialization == 'lecun' and input_dim != output_dim:
+            # square 'lecun' layers get the orthogonal init below
             weight_values = uniform(
                 np.sqrt(1./input_dim),
                 (input_dim, output_dim)
@@ -74,30 +73,16 @@ def Linear(
             )
 
         elif initialization == 'orthogonal' or \
-            (initialization == None and input_dim == output_dim):
+            (initialization == 'lecun' and input_dim == output_dim):
             
-            # From lasagne
-            def sample(shape):
-                if len(shape) < 2:
-                    raise RuntimeError("Only shapes of length 2 or more are "
-                                       "supported.")
-                flat_shape = (shape[0], np.prod(shape[1:]))
-                 # TODO: why normal and not uniform?
-                a = np.random.normal(0.0, 1.0, flat_shape)
-                u, _, v = np.linalg.svd(a, full_matrices=False)
-                # pick the one with the correct shape
-                q = u if u.shape == flat_shape else v
-                q = q.reshape(shape)
-                return q.astype('float32')
-            weight_values = sample((input_dim, output_dim))
+            weight_values = lib.ops.initializers.orthogonal((input_dim, output_dim))
         
         elif initialization[0] == 'uniform':
         
-            weight_values = np.random.uniform(
-                low=-initialization[1],
-                high=initialization[1],
-                size=(input_dim, output_dim)
-            ).astype('float32')
+            weight_values = lib.ops.initializers.uniform(
+                initialization[1] / np.sqrt(3),
+                (input_dim, output_dim)
+            )
 
         else:
 
@@ -113,7 +98,7 @@ def Linear(
         if weightnorm==None:
             weightnorm = _default_weightnorm
         if weightnorm:
-            norm_values = np.sqrt(np.sum(np.square(weight_values), axis=0))
+            norm_values = lib.ops.initializers.initial_norms(weight_values, weight, 0)
             # norm_values = np.linalg.norm(weight_values, axis=0)
 
             target_norms = lib.param(
@@ -121,14 +106,15 @@ def Linear(
                 norm_values
             )
 
-            with tf.name_scope('weightnorm') as scope:
-                norms = tf.sqrt(tf.reduce_sum(tf.square(weight), reduction_indices=[0]))
-                weight = weight * (target_norms / norms)
+            weight = lib.ops.weightnorm.normalize(name+'.W', weight, target_norms, [0])
 
         # if 'Discriminator' in name:
         #     print "WARNING weight constraint on {}".format(name)
         #     weight = tf.nn.softsign(10.*weight)*.1
 
+        inputs = lib.mixed_precision.to_compute_dtype(inputs)
+        weight = lib.mixed_precision.to_compute_dtype(weight)
+
         if inputs.get_shape().ndims == 2:
             result = tf.matmul(inputs, weight)
         else:
@@ -139,10 +125,10 @@ def Linear(
         if biases:
             result = tf.nn.bias_add(
                 result,
-                lib.param(
+                lib.mixed_precision.to_compute_dtype(lib.param(
                     name + '.b',
                     np.zeros((output_dim,), dtype='float32')
-                )
+                ))
             )
 
         return result
\ No newline at end of file
@@ -0,0 +1,92 @@
+import tensorflow as tf
+
+_inference_cache = False
+def enable_inference_cache():
+    """
+    Weightnormed layers built from now on read their normalized weights from
+    a cache variable, renormalizing only when the weights have changed since
+    the cache was last filled (i.e. once per weight version). Nothing
+    backpropagates into the cache, so only build inference graphs (e.g. a
+    generator's sampling graph) this way, and wrap the ops updating the
+    weights in track_updates(). The caches are local variables: initialize
+    them with tf.local_variables_initializer(); savers skip them.
+    """
+    global _inference_cache
+    _inference_cache = True
+
+def disable_inference_cache():
+    global _inference_cache
+    _inference_cache = False
+
+# Per-graph state lives in the graph's collections, so it goes away with the
+# graph: the weight version counter, and each cached weight's read under
+# _CACHE_COLLECTION+name
+_VERSION_COLLECTION = 'weightnorm_version'
+_CACHE_COLLECTION = 'weightnorm_cache/'
+
+def _version():
+    graph = tf.get_default_graph()
+    versions = graph.get_collection(_VERSION_COLLECTION)
+    if versions:
+        return versions[0]
+    with tf.name_scope(None):
+        version = tf.Variable(
+            0,
+            dtype=tf.int64,
+            trainable=False,
+            collections=[tf.GraphKeys.LOCAL_VARIABLES, _VERSION_COLLECTION],
+            name='weightnorm.version'
+        )
+    return version
+
+def track_updates(train_op):
+    """
+    returns: an op running `train_op` and then bumping the weight version, so
+        cached normalized weights are recomputed at their next read
+    """
+    with tf.control_dependencies([train_op]):
+        return tf.group(tf.assign_add(_version(), 1))
+
+def normalize(name, weights, target_norms, axes):
+    """
+    returns: `weights` rescaled to have norms `target_norms` over `axes`
+        (the norms have one entry per index of the remaining axis)
+    """
+    cached = tf.get_collection(_CACHE_COLLECTION + name)
+    if _inference_cache and cached:
+        return cached[0]
+
+    def _normalized():
+        with tf.name_scope('weightnorm'):
+            norms = tf.sqrt(tf.reduce_sum(tf.square(weights), reduction_indices=axes, keep_dims=True))
+            return weights * (tf.reshape(target_norms, norms.get_shape().as_list()) / norms)
+
+    if not _inference_cache:
+        return _normalized()
+
+    version = _version()
+    with tf.name_scope(None):
+        cache = tf.Variable(
+            tf.zeros(weights.get_shape(), dtype=weights.dtype.base_dtype),
+            trainable=False,
+            collections=[tf.GraphKeys.LOCAL_VARIABLES],
+            name=name+'.normalized'
+        )
+        # Weight version the cache holds; -1 until first filled
+        cached_version = tf.Variable(
+            tf.constant(-1, dtype=tf.int64),
+            trainable=False,
+            collections=[tf.GraphKeys.LOCAL_VARIABLES],
+            name=name+'.normalized_version'
+        )
+
+    def _refresh():
+        # The normalization is built inside the branch, so it only runs on
+        # reads of a stale cache
+        refreshed = tf.assign(cache, _normalized())
+        with tf.control_dependencies([tf.assign(cached_version, version)]):
+            return tf.identity(refreshed)
+
+    result = tf.cond(tf.equal(cached_version, version), lambda: tf.identity(cache), _refresh)
+    tf.add_to_collection(_CACHE_COLLECTION + name, result)
+    return result
@@ -2,40 +2,362 @@ import numpy as np
 
 import matplotlib
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+import matplotlib.figure
+import matplotlib.image
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
+import array
+import atexit
 import collections
+import os
+import threading
 import time
-import pickle as pickle
+import traceback
 
-_since_beginning = collections.defaultdict(lambda: {})
-_since_last_flush = collections.defaultdict(lambda: {})
+# Every plotted point is appended to LOG_DIR/<name>.bin as one LOG_DTYPE
+# record; see read_log(). Each process starts the logs it writes afresh, so a
+# new run in the same directory replaces the previous run's points.
+LOG_DIR = 'log'
+LOG_DTYPE = np.dtype([('iter', '<i8'), ('value', '<f8')])
+
+# Axes limits grow by this factor when new points fall outside them
+_LIMIT_GROWTH = 1.25
+
+# See enable_downsampling()
+DOWNSAMPLE_BUCKETS = 1024
+_downsample_buckets = None
+
+def enable_downsampling(n_buckets=DOWNSAMPLE_BUCKETS):
+	"""
+	Draws charts created from now on from at most `n_buckets` min/max/mean
+	summaries of their series instead of from every point, for runs long
+	enough that a full redraw is slow and the raw line unreadable.
+	"""
+	global _downsample_buckets
+	_downsample_buckets = n_buckets
+
+def disable_downsampling():
+	global _downsample_buckets
+	_downsample_buckets = None
+
+# See set_window()
+_window = None
+
+def set_window(n_points):
+	"""
+	Keeps only about the last `n_points` of each metric in memory (None keeps
+	everything). Older points are still in the log on disk, which is where
+	charts are redrawn from once points have been dropped.
+	"""
+	global _window
+	_window = n_points
+
+class _Series(object):
+	"""Growable int64 iteration and float64 value columns of one metric."""
+
+	def __init__(self):
+		self.iters = array.array('q')
+		self.values = array.array('d')
+		self.dropped = 0
+
+	def __len__(self):
+		return len(self.iters)
+
+	def append(self, iteration, value):
+		# Plotting the same metric twice in one iteration keeps the last value
+		if len(self.iters) and self.iters[-1] == iteration:
+			self.values[-1] = value
+		else:
+			self.iters.append(iteration)
+			self.values.append(value)
+
+	def extend(self, series):
+		self.iters.extend(series.iters)
+		self.values.extend(series.values)
+
+	def truncate(self, n_points):
+		"""Drops all but the last `n_points`, once twice that many are held."""
+		if len(self.iters) >= 2 * n_points:
+			n = len(self.iters) - n_points
+			del self.iters[:n]
+			del self.values[:n]
+			self.dropped += n
+
+	def columns(self):
+		"""returns: copies of (iterations, values) as NumPy arrays"""
+		return (np.array(self.iters, dtype=np.int64),
+		        np.array(self.values, dtype=np.float64))
+
+_since_beginning = collections.defaultdict(_Series)
+_since_last_flush = collections.defaultdict(_Series)
+_charts = {}
+
+# (iteration, {name: mean}) of the last flush. Replaced, never mutated, so
+# other threads can read it without locking.
+last_flush = (0, collections.OrderedDict())
+
+# Flushed points waiting for the render thread, as name -> _Series.
+# Several flushes of the same metric that arrive while the thread is busy are
+# merged here and rendered once.
+_pending = collections.OrderedDict()
+_pending_lock = threading.Condition()
+_busy = [False]
+_render_thread = [None]
+
+# Called at the start of every flush(), e.g. to plot() per-flush summaries
+_flush_hooks = []
+
+def add_flush_hook(hook):
+	_flush_hooks.append(hook)
+
+# Called with the new iteration number after every tick()
+_tick_hooks = []
+
+def add_tick_hook(hook):
+	_tick_hooks.append(hook)
 
 _iter = [0]
 def tick():
 	_iter[0] += 1
+	for hook in _tick_hooks:
+		hook(_iter[0])
 
 def plot(name, value):
-	_since_last_flush[name][_iter[0]] = value
+	_since_last_flush[name].append(_iter[0], value)
 
-def flush():
-	prints = []
+def _filename(name):
+	return name.replace(' ', '_')
 
-	for name, vals in list(_since_last_flush.items()):
-		prints.append("{}\t{}".format(name, np.mean(list(vals.values()))))
-		_since_beginning[name].update(vals)
+# Metrics whose log this process has already written to
+_logged = set()
 
-		x_vals = np.sort(list(_since_beginning[name].keys()))
-		y_vals = [_since_beginning[name][x] for x in x_vals]
+def _append_log(name, x_vals, y_vals):
+	records = np.empty(len(x_vals), dtype=LOG_DTYPE)
+	records['iter'] = x_vals
+	records['value'] = y_vals
+	if not os.path.isdir(LOG_DIR):
+		os.makedirs(LOG_DIR)
+	# Truncate whatever an earlier run left on the first write
+	mode = 'ab' if name in _logged else 'wb'
+	_logged.add(name)
+	with open(os.path.join(LOG_DIR, _filename(name)+'.bin'), mode) as f:
+		records.tofile(f)
 
-		plt.clf()
-		plt.plot(x_vals, y_vals)
-		plt.xlabel('iteration')
-		plt.ylabel(name)
-		plt.savefig(name.replace(' ', '_')+'.png')
+def read_log(name, log_dir=LOG_DIR):
+	"""returns: (iterations, values) of everything plotted under `name`"""
+	records = np.fromfile(os.path.join(log_dir, _filename(name)+'.bin'), dtype=LOG_DTYPE)
+	return records['iter'], records['value']
+
+def _grow(limits, lo, hi):
+	"""Widens `limits` to cover [lo, hi], with headroom for later points."""
+	if limits is None:
+		margin = 0.05 * max(hi - lo, abs(hi), 1e-8)
+		return (lo - margin, hi + margin)
+	if limits[0] <= lo and hi <= limits[1]:
+		return limits
+	margin = (_LIMIT_GROWTH - 1.) * (max(hi, limits[1]) - min(lo, limits[0]))
+	return (lo - margin if lo < limits[0] else limits[0],
+	        hi + margin if hi > limits[1] else limits[1])
+
+class _Summary(object):
+	"""
+	Multi-resolution summary of a series: consecutive runs of `width` points
+	reduced to their first and last iteration, sum, min and max. Whenever
+	there are more than `n_buckets` buckets, neighbouring pairs are merged and
+	`width` doubles, so memory and drawing cost stay O(n_buckets).
+	"""
+
+	def __init__(self, n_buckets):
+		self.n_buckets = n_buckets
+		self.width = 1
+		self.first = np.empty(0, dtype=np.int64)
+		self.last = np.empty(0, dtype=np.int64)
+		self.count = np.empty(0, dtype=np.int64)
+		self.sum = np.empty(0, dtype=np.float64)
+		self.min = np.empty(0, dtype=np.float64)
+		self.max = np.empty(0, dtype=np.float64)
+
+	def _append(self, first, last, count, sum_, min_, max_):
+		self.first = np.concatenate([self.first, first])
+		self.last = np.concatenate([self.last, last])
+		self.count = np.concatenate([self.count, count])
+		self.sum = np.concatenate([self.sum, sum_])
+		self.min = np.concatenate([self.min, min_])
+		self.max = np.concatenate([self.max, max_])
+
+	def _reduce(self, starts):
+		self.first = self.first[starts]
+		self.last = self.last[np.append(starts[1:], len(self.last)) - 1]
+		self.count = np.add.reduceat(self.count, starts)
+		self.sum = np.add.reduceat(self.sum, starts)
+		self.min = np.minimum.reduceat(self.min, starts)
+		self.max = np.maximum.reduceat(self.max, starts)
+
+	def add(self, x_vals, y_vals):
+		if len(self.count) and self.count[-1] < self.width:
+			# Top up the last, partially filled bucket
+			n = min(self.width - self.count[-1], len(x_vals))
+			self.last[-1] = x_vals[n-1]
+			self.count[-1] += n
+			self.sum[-1] += np.sum(y_vals[:n])
+			self.min[-1] = min(self.min[-1], np.min(y_vals[:n]))
+			self.max[-1] = max(self.max[-1], np.max(y_vals[:n]))
+			x_vals, y_vals = x_vals[n:], y_vals[n:]
+		if len(x_vals):
+			starts = np.arange(0, len(x_vals), self.width)
+			ends = np.append(starts[1:], len(x_vals))
+			self._append(
+				x_vals[starts],
+				x_vals[ends - 1],
+				ends - starts,
+				np.add.reduceat(y_vals, starts),
+				np.minimum.reduceat(y_vals, starts),
+				np.maximum.reduceat(y_vals, starts)
+			)
+		while len(self.count) > self.n_buckets:
+			self._reduce(np.arange(0, len(self.count), 2))
+			self.width *= 2
+
+	def get(self):
+		"""returns: (bucket centers, means, mins, maxes)"""
+		return (self.first + self.last) / 2., self.sum / self.count, self.min, self.max
+
+class _Chart(object):
+	"""
+	The PNG of one metric. New points are drawn on top of the existing raster;
+	the whole series is only redrawn when they fall outside the axes limits,
+	which grow geometrically, so rendering is amortized O(new points).
+	"""
+
+	def __init__(self, name, n_buckets=None):
+		self.name = name
+		self.summary = None if n_buckets is None else _Summary(n_buckets)
+		self.envelope = None
+		self.figure = matplotlib.figure.Figure()
+		self.canvas = FigureCanvasAgg(self.figure)
+		self.axes = self.figure.add_subplot(111)
+		self.axes.set_xlabel('iteration')
+		self.axes.set_ylabel(name)
+		self.history, = self.axes.plot([], [], color='#1f77b4')
+		self.tail, = self.axes.plot([], [], color='#1f77b4')
+		self.xlim = None
+		self.ylim = None
+		self.last = None
+
+	def update(self, x_vals, y_vals, get_history):
+		if self.summary is not None:
+			self.summary.add(x_vals, y_vals)
+		finite = np.isfinite(y_vals)
+		xlim = self.xlim
+		if xlim is None or x_vals[-1] > xlim[1]:
+			start = x_vals[0] if xlim is None else xlim[0]
+			xlim = (start, start + _LIMIT_GROWTH * max(x_vals[-1] - start, 1))
+		ylim = self.ylim
+		if finite.any():
+			ylim = _grow(self.ylim, np.min(y_vals[finite]), np.max(y_vals[finite]))
+
+		# A summarized chart is cheap to redraw in full, and raw new points
+		# drawn on top of it would not match the rest of the line.
+		if (xlim, ylim) != (self.xlim, self.ylim) or self.last is None or self.summary is not None:
+			self.xlim, self.ylim = xlim, ylim
+			self.axes.set_xlim(*xlim)
+			if ylim is not None:
+				self.axes.set_ylim(*ylim)
+			if self.summary is None:
+				self.history.set_data(*get_history())
+			else:
+				x, mean, lo, hi = self.summary.get()
+				self.history.set_data(x, mean)
+				if self.envelope is not None:
+					self.envelope.remove()
+				self.envelope = self.axes.fill_between(x, lo, hi, color='#1f77b4', alpha=0.3, linewidth=0)
+			self.tail.set_data([], [])
+			self.canvas.draw()
+		else:
+			# Connect to the previous flush's last point
+			self.tail.set_data(np.concatenate([[self.last[0]], x_vals]),
+			                   np.concatenate([[self.last[1]], y_vals]))
+			self.axes.draw_artist(self.tail)
+		self.last = (x_vals[-1], y_vals[-1])
+
+		width, height = self.canvas.get_width_height()
+		image = np.frombuffer(self.canvas.buffer_rgba(), dtype=np.uint8).reshape(height, width, 4)
+		matplotlib.image.imsave(_filename(self.name)+'.png', image)
+
+def _render(name, series):
+	x_vals, y_vals = series.columns()
+	history = _since_beginning[name]
+	history.extend(series)
+	if _window is not None:
+		history.truncate(_window)
+	_append_log(name, x_vals, y_vals)
+
+	def get_history():
+		if history.dropped:
+			return read_log(name)
+		return history.columns()
+	if name not in _charts:
+		_charts[name] = _Chart(name, _downsample_buckets)
+	_charts[name].update(x_vals, y_vals, get_history)
+
+def _render_loop():
+	while True:
+		with _pending_lock:
+			while not _pending:
+				_busy[0] = False
+				_pending_lock.notify_all()
+				_pending_lock.wait()
+			_busy[0] = True
+			work = list(_pending.items())
+			_pending.clear()
+		for name, series in work:
+			try:
+				# plot() is only ever called at the current iteration, so
+				# points arrive in order and never need sorting.
+				_render(name, series)
+			except Exception:
+				traceback.print_exc()
+
+def wait():
+	"""Blocks until every flushed point has been logged and drawn."""
+	with _pending_lock:
+		while _pending or _busy[0]:
+			_pending_lock.wait()
+
+def flush():
+	"""
+	Prints the means since the last flush and hands the points to a
+	background thread, which appends them to the log and redraws the charts.
+	"""
+	global last_flush
+	for hook in _flush_hooks:
+		hook()
+
+	prints = []
+	means = collections.OrderedDict()
+
+	with _pending_lock:
+		for name, series in list(_since_last_flush.items()):
+			means[name] = np.mean(series.values)
+			prints.append("{}\t{}".format(name, means[name]))
+			if name in _pending:
+				_pending[name].extend(series)
+			else:
+				_pending[name] = series
+		if _render_thread[0] is None:
+			_render_thread[0] = threading.Thread(target=_render_loop, name='tflib.plot')
+			_render_thread[0].daemon = True
+			_render_thread[0].start()
+		_busy[0] = True
+		_pending_lock.notify_all()
 
 	print("iter {}\t{}".format(_iter[0], "\t".join(prints)))
 	_since_last_flush.clear()
+	last_flush = (_iter[0], means)
+
+atexit.register(wait)
 
-	with open('log.pkl', 'wb') as f:
-		pickle.dump(dict(_since_beginning), f, pickle.HIGHEST_PROTOCOL)
\ No newline at end of file
+# TFLIB_PROFILE=start:stop profiles those iterations of any training loop
+if os.environ.get('TFLIB_PROFILE'):
+	import tflib.pyprofile
+	tflib.pyprofile.install(add_tick_hook)
@@ -0,0 +1,33 @@
+"""
+Improved precision and recall (Kynkaanniemi et al., 2019) over Inception pool_3
+features. Each feature set is approximated by the union of hyperspheres that
+reach each point's k-th nearest neighbour; precision is the fraction of
+generated samples inside the real manifold, and recall the fraction of real
+samples inside the generated one.
+"""
+
+import numpy as np
+
+import tflib as lib
+import tflib.feature_index
+
+K = 3 # Neighbourhood size
+
+def calculate_precision_recall(fake_features, real_features, real_radii=None, k=K):
+    if real_radii is None:
+        real_radii = lib.feature_index.knn_radii(real_features, k)
+    fake_radii = lib.feature_index.knn_radii(fake_features, k)
+    precision = lib.feature_index.within_radii(fake_features, real_features, real_radii).mean()
+    recall = lib.feature_index.within_radii(real_features, fake_features, fake_radii).mean()
+    return precision, recall
+
+def get_precision_recall(batches, dataset, data_dir, k=K):
+    """
+    batches: iterable of generated image batches, [batch, height, width, 3]
+        with values ranging from 0 to 255
+    dataset: 'cifar10' or 'celebA'
+    """
+    real_features = lib.feature_index.get_real_features(dataset, data_dir)
+    real_radii = lib.feature_index.get_real_radii(dataset, data_dir, k)
+    fake_features = lib.feature_index.collect_features(batches)
+    return calculate_precision_recall(fake_features, real_features, real_radii, k)
@@ -0,0 +1,132 @@
+"""
+Op-level traces of individual training steps.
+
+run() is a drop-in replacement for session.run(). Every --trace_every training
+iterations (as passed in `iteration`; steps run without one count their calls
+instead), and on the next call with each name after the process receives
+SIGUSR1, it runs the step with full tracing and writes to --trace_dir. A step
+run several times per iteration, like the critic's, is traced on its first
+call of a due iteration.
+
+    <name>_<iteration>.json  Chrome trace of the step (open in chrome://tracing)
+    <name>_<iteration>.txt   the ops that took the most time, per device
+
+    python gan_SR.py --trace_every=1000
+    kill -USR1 <pid of a running script>
+
+Other modules can also ask for the step stats of particular steps with
+add_step_stats_hook(); those steps run with the cheaper SOFTWARE_TRACE unless
+a full trace is due anyway.
+"""
+
+import collections
+import os
+import signal
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_integer('trace_every', 0, "training iterations between full traces of each traced step (0: only on SIGUSR1)")
+tf.app.flags.DEFINE_string('trace_dir', 'traces', "directory for step traces")
+
+TOP_OPS = 20
+
+_counts = collections.defaultdict(int)
+# name -> the last iteration in which its step was traced on schedule
+_last_traced = {}
+# SIGUSR1s received, and how many of them each name has been traced for
+_signals = [0]
+_signals_handled = collections.defaultdict(int)
+
+# (wants_stats(name), on_stats(name, run_metadata)) pairs
+_step_stats_hooks = []
+
+def add_step_stats_hook(wants_stats, on_stats):
+    _step_stats_hooks.append((wants_stats, on_stats))
+
+def _on_signal(signum, frame):
+    _signals[0] += 1
+
+if hasattr(signal, 'SIGUSR1'):
+    signal.signal(signal.SIGUSR1, _on_signal)
+
+def _due(name, count, iteration):
+    if _signals_handled[name] < _signals[0]:
+        _signals_handled[name] = _signals[0]
+        return True
+    if FLAGS.trace_every <= 0:
+        return False
+    if iteration is None:
+        return count % FLAGS.trace_every == FLAGS.trace_every-1
+    if iteration % FLAGS.trace_every != FLAGS.trace_every-1 or _last_traced.get(name) == iteration:
+        return False
+    _last_traced[name] = iteration
+    return True
+
+def run(session, fetches, feed_dict=None, name='step', iteration=None):
+    """
+    session.run(fetches, feed_dict), traced when due. `iteration` is the
+    training iteration, which schedules the traces and names their files;
+    without it, the number of calls with this name is used.
+    """
+    count = _counts[name]
+    _counts[name] += 1
+    full_trace = _due(name, count, iteration)
+    hooks = [on_stats for wants_stats, on_stats in _step_stats_hooks if wants_stats(name)]
+    if not (full_trace or hooks):
+        return session.run(fetches, feed_dict=feed_dict)
+
+    if full_trace:
+        options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+    else:
+        options = tf.RunOptions(trace_level=tf.RunOptions.SOFTWARE_TRACE)
+    run_metadata = tf.RunMetadata()
+    result = session.run(fetches, feed_dict=feed_dict, options=options, run_metadata=run_metadata)
+    if full_trace:
+        write_trace(run_metadata, name, count if iteration is None else iteration)
+    for on_stats in hooks:
+        on_stats(name, run_metadata)
+    return result
+
+def _op_type(node_stats):
+    # timeline_label looks like 'node_name = OpType(input, ...)'
+    label = node_stats.timeline_label
+    if ' = ' in label:
+        return label.split(' = ', 1)[1].split('(', 1)[0]
+    return node_stats.node_name
+
+def top_ops(step_stats, n=TOP_OPS):
+    """returns: lines of text listing the slowest op types and nodes per device"""
+    lines = []
+    for dev_stats in step_stats.dev_stats:
+        by_type = collections.defaultdict(lambda: [0, 0])
+        by_node = collections.defaultdict(int)
+        for node_stats in dev_stats.node_stats:
+            micros = node_stats.op_end_rel_micros - node_stats.op_start_rel_micros
+            by_type[_op_type(node_stats)][0] += micros
+            by_type[_op_type(node_stats)][1] += 1
+            by_node[node_stats.node_name] += micros
+        total = sum(by_node.values())
+        lines.append('{}: {:.3f} ms in {} ops'.format(dev_stats.device, total / 1000., len(dev_stats.node_stats)))
+        lines.append('  by op type:')
+        for op_type, (micros, calls) in sorted(by_type.items(), key=lambda kv: -kv[1][0])[:n]:
+            lines.append('    {:10.3f} ms {:6.1%} {:6d}x  {}'.format(
+                micros / 1000., micros / float(max(total, 1)), calls, op_type))
+        lines.append('  by node:')
+        for node_name, micros in sorted(by_node.items(), key=lambda kv: -kv[1])[:n]:
+            lines.append('    {:10.3f} ms {:6.1%}  {}'.format(
+                micros / 1000., micros / float(max(total, 1)), node_name))
+    return lines
+
+def write_trace(run_metadata, name, iteration):
+    if not os.path.isdir(FLAGS.trace_dir):
+        os.makedirs(FLAGS.trace_dir)
+    path = os.path.join(FLAGS.trace_dir, '{}_{}'.format(name.replace(' ', '_'), iteration))
+    trace = timeline.Timeline(run_metadata.step_stats)
+    with open(path + '.json', 'w') as f:
+        f.write(trace.generate_chrome_trace_format(show_memory=True))
+    with open(path + '.txt', 'w') as f:
+        f.write('\n'.join(top_ops(run_metadata.step_stats)) + '\n')
+    print('Wrote step trace {}.json'.format(path))
@@ -0,0 +1,148 @@
+"""
+cProfile window over training iterations, switched on from the environment so
+any script that calls lib.plot.tick() can be profiled without edits:
+
+    TFLIB_PROFILE=1000:1100 python gan_64x64.py
+
+profiles the main thread during iterations [1000, 1100), as counted by
+lib.plot.tick(), and writes to $TFLIB_PROFILE_DIR (default 'pyprofile'). The
+window only opens at a tick, so imports and graph construction are never
+profiled and the start must be at least 1 (the first tick ends iteration 0):
+
+    profile.prof       raw stats, for pstats or snakeviz
+    profile.txt        stats sorted by cumulative and by internal time
+    profile.collapsed  'caller;...;callee microseconds' lines, for
+                       flamegraph.pl or speedscope
+
+cProfile only records caller -> callee edges, not full stacks, so the
+collapsed stacks are reconstructed by splitting each function's own time over
+its callers in proportion to the time spent under each of them.
+"""
+
+import atexit
+import cProfile
+import os
+import pstats
+
+ENV_VAR = 'TFLIB_PROFILE'
+DIR_ENV_VAR = 'TFLIB_PROFILE_DIR'
+STATS_LINES = 60
+
+# Limits on the reconstructed stacks: their depth, and the smallest fraction of
+# a function's time kept on a single stack
+_MAX_DEPTH = 64
+_MIN_FRACTION = 1e-3
+
+def parse_window(spec):
+    """'a:b' -> (a, b)"""
+    start, stop = spec.split(':')
+    start, stop = int(start), int(stop)
+    # Windows open at a lib.plot.tick(), and the first one ends iteration 0
+    if not 1 <= start < stop:
+        raise Exception('{} must look like start:stop with 1 <= start < stop, got {}'.format(ENV_VAR, spec))
+    return start, stop
+
+class Window(object):
+    def __init__(self, start, stop, output_dir):
+        self.start = start
+        self.stop = stop
+        self.output_dir = output_dir
+        self.profile = None
+        self.done = False
+
+    def on_tick(self, iteration):
+        """Called with the number of the iteration about to begin."""
+        if iteration == self.start and self.profile is None and not self.done:
+            print("Profiling iterations [{}, {})".format(self.start, self.stop))
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif iteration >= self.stop and self.profile is not None:
+            self.finish()
+
+    def finish(self):
+        if self.profile is None:
+            return
+        self.profile.disable()
+        dump(self.profile, self.output_dir)
+        self.profile = None
+        self.done = True
+
+def _label(func):
+    filename, lineno, name = func
+    if filename == '~':
+        label = name
+    else:
+        label = '{} ({}:{})'.format(name, os.path.basename(filename), lineno)
+    return label.replace(';', ',')
+
+def collapsed_stacks(stats):
+    """returns: {'f;g;h': microseconds of h's own time under f -> g}"""
+    stats = stats.stats
+    memo = {}
+
+    def paths(func, visiting):
+        """[(stack of funcs ending in `func`, fraction of func's time on it)]"""
+        if func in memo:
+            return memo[func]
+        callers = stats[func][4]
+        total = sum(edge[3] for caller, edge in callers.items() if caller in stats)
+        result = []
+        complete = True
+        if total > 0 and len(visiting) < _MAX_DEPTH:
+            visiting = visiting | {func}
+            for caller, edge in callers.items():
+                if caller not in stats:
+                    continue
+                if caller in visiting:
+                    complete = False
+                    continue
+                share = edge[3] / total
+                for stack, fraction in paths(caller, visiting):
+                    if share * fraction >= _MIN_FRACTION:
+                        result.append((stack + (func,), share * fraction))
+        if not result:
+            result = [((func,), 1.)]
+        if complete:
+            memo[func] = result
+        return result
+
+    stacks = {}
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        if tt <= 0:
+            continue
+        for stack, fraction in paths(func, frozenset()):
+            key = ';'.join(_label(f) for f in stack)
+            stacks[key] = stacks.get(key, 0.) + tt * fraction * 1e6
+    return stacks
+
+def dump(profile, output_dir):
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    profile.dump_stats(os.path.join(output_dir, 'profile.prof'))
+
+    with open(os.path.join(output_dir, 'profile.txt'), 'w') as f:
+        stats = pstats.Stats(profile, stream=f)
+        stats.sort_stats('cumulative').print_stats(STATS_LINES)
+        stats.sort_stats('tottime').print_stats(STATS_LINES)
+
+    stacks = collapsed_stacks(pstats.Stats(profile))
+    with open(os.path.join(output_dir, 'profile.collapsed'), 'w') as f:
+        for key, micros in sorted(stacks.items()):
+            if int(micros) > 0:
+                f.write('{} {}\n'.format(key, int(micros)))
+    print("Wrote Python profile to {}".format(output_dir))
+
+def install(add_tick_hook):
+    """
+    Sets up a window from $TFLIB_PROFILE, if it is set, opened and closed by
+    tick hooks only. lib.plot calls this on import with its tick-hook
+    registration.
+    """
+    spec = os.environ.get(ENV_VAR)
+    if not spec:
+        return None
+    start, stop = parse_window(spec)
+    window = Window(start, stop, os.environ.get(DIR_ENV_VAR, 'pyprofile'))
+    add_tick_hook(window.on_tick)
+    atexit.register(window.finish)
+    return window
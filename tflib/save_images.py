@@ -2,10 +2,60 @@
 Image grid saver, based on color_grid_vis from github.com/Newmu
 """
 
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import scipy.misc
 from scipy.misc import imsave
 
+# See enable_background_writes()
+_writer = None
+_pending_writes = []
+_pending_writes_lock = threading.Lock()
+
+def enable_background_writes(max_workers=1):
+    """
+    Makes save_images() return as soon as the grid is built, encoding and
+    writing the file on a pool of `max_workers` threads. wait() blocks until
+    every queued file is written.
+    """
+    global _writer
+    if _writer is None:
+        _writer = ThreadPoolExecutor(max_workers=max_workers)
+
+def disable_background_writes():
+    global _writer
+    wait()
+    if _writer is not None:
+        _writer.shutdown()
+        _writer = None
+
+def wait():
+    """Blocks until queued writes are done; re-raises the first one that failed."""
+    with _pending_writes_lock:
+        futures = list(_pending_writes)
+        del _pending_writes[:]
+    for future in futures:
+        future.result()
+
+atexit.register(wait)
+
+def _bytescale(X):
+    """
+    Linearly maps the min of X to 0 and its max to 255, exactly as imsave
+    does for non-uint8 arrays (the grid used to be a float64 canvas, which is
+    always rescaled this way). Integer pixels go through a 256-entry lookup
+    table instead of float arithmetic on every pixel.
+    """
+    lo, hi = X.min(), X.max()
+    scale = 255. / ((hi - lo) or 1)
+    if X.dtype.kind in 'iu' and lo >= 0 and hi <= 255:
+        lut = (((np.arange(256, dtype='float64') - lo) * scale).clip(0, 255) + 0.5).astype('uint8')
+        return lut[X]
+    return (((X - lo) * scale).clip(0, 255) + 0.5).astype('uint8')
+
 def save_images(X, save_path):
     # [0, 1] -> [0,255]
     if isinstance(X.flatten()[0], np.floating):
@@ -21,19 +71,21 @@ def save_images(X, save_path):
     if X.ndim == 2:
         X = np.reshape(X, (X.shape[0], int(np.sqrt(X.shape[1])), int(np.sqrt(X.shape[1]))))
 
+    X = _bytescale(X)
     if X.ndim == 4:
-        # BCHW -> BHWC
-        X = X.transpose(0,2,3,1)
-        h, w = X[0].shape[:2]
-        img = np.zeros((h*nh, w*nw, 3))
+        # BCHW -> grid of HWC, in one copy
+        c, h, w = X.shape[1:]
+        img = X.reshape(nh, nw, c, h, w).transpose(0,3,1,4,2).reshape(h*nh, w*nw, c)
+        if c == 1:
+            img = img.repeat(3, axis=2)
     elif X.ndim == 3:
-        h, w = X[0].shape[:2]
-        img = np.zeros((h*nh, w*nw))
-
-    for n, x in enumerate(X):
-        #j = n/nw
-        #i = n%nw
-        j, i = divmod(n, nw)
-        img[j*h:j*h+h, i*w:i*w+w] = x
+        h, w = X.shape[1:]
+        img = X.reshape(nh, nw, h, w).transpose(0,2,1,3).reshape(h*nh, w*nw)
 
-    imsave(save_path, img)
+    if _writer is None:
+        imsave(save_path, img)
+    else:
+        with _pending_writes_lock:
+            # Forget finished writes, but keep failed ones for wait() to raise
+            _pending_writes[:] = [f for f in _pending_writes if not f.done() or f.exception() is not None]
+            _pending_writes.append(_writer.submit(imsave, save_path, img))
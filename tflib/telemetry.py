@@ -0,0 +1,105 @@
+"""
+Live training metrics over HTTP, in the Prometheus text format.
+
+    lib.telemetry.serve(9100, samples_per_iter=BATCH_SIZE*CRITIC_ITERS)
+    curl localhost:9100/metrics
+
+serves, from a daemon thread:
+
+    tflib_iteration                   current lib.plot iteration
+    tflib_seconds_since_tick          time since the last lib.plot.tick()
+    tflib_samples_per_second          over the last RATE_WINDOW iterations
+    tflib_plot{name=...}              means at the last lib.plot.flush()
+    tflib_phase_seconds{phase,stat}   lib.timing summaries at the last flush
+    tflib_resident_bytes              process RSS
+    tflib_peak_resident_bytes         peak process RSS
+
+Requests only read snapshots that the training thread replaces whole, so a
+scrape never blocks or slows down the train loop.
+"""
+
+import collections
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import tflib as lib
+import tflib.plot
+import tflib.timing
+import tflib.memory
+
+RATE_WINDOW = 100
+
+_samples_per_iter = [1]
+# (time, iteration) of the last RATE_WINDOW ticks
+_ticks = collections.deque(maxlen=RATE_WINDOW)
+
+def _on_tick(iteration):
+    _ticks.append((time.time(), iteration))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_metrics():
+    lines = []
+    def add(metric, value, help_text=None, **labels):
+        if help_text is not None:
+            lines.append('# HELP {} {}'.format(metric, help_text))
+            lines.append('# TYPE {} gauge'.format(metric))
+        if labels:
+            metric += '{' + ','.join('{}="{}"'.format(k, _escape(v)) for k, v in sorted(labels.items())) + '}'
+        lines.append('{} {!r}'.format(metric, float(value)))
+
+    # Indexing, unlike iterating, is safe while the train loop appends
+    (first_time, first_iter), (last_time, last_iter) = _ticks[0], _ticks[-1]
+    add('tflib_iteration', last_iter, 'Current training iteration')
+    add('tflib_seconds_since_tick', time.time() - last_time, 'Seconds since the last iteration ended')
+    rate = 0.
+    if last_time > first_time:
+        rate = _samples_per_iter[0] * (last_iter - first_iter) / (last_time - first_time)
+    add('tflib_samples_per_second', rate, 'Training samples per second')
+    add('tflib_resident_bytes', lib.memory.resident_bytes(), 'Resident set size of the process')
+    add('tflib_peak_resident_bytes', lib.memory.peak_resident_bytes(), 'Peak resident set size of the process')
+
+    flush_iter, means = lib.plot.last_flush
+    add('tflib_flush_iteration', flush_iter, 'Iteration of the last lib.plot.flush()')
+    lines.append('# HELP tflib_plot Means of lib.plot values at the last flush')
+    lines.append('# TYPE tflib_plot gauge')
+    for name, mean in means.items():
+        add('tflib_plot', mean, name=name)
+    lines.append('# HELP tflib_phase_seconds lib.timing phase durations at the last flush')
+    lines.append('# TYPE tflib_phase_seconds gauge')
+    for phase, stats in lib.timing.summaries.items():
+        for stat, value in zip(('mean', 'p50', 'p99'), stats):
+            add('tflib_phase_seconds', value, phase=phase, stat=stat)
+    return '\n'.join(lines) + '\n'
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = _format_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port, samples_per_iter=1, host='127.0.0.1'):
+    """
+    Starts the metrics server on a daemon thread and returns it.
+    samples_per_iter: training examples consumed per lib.plot.tick()
+    """
+    _samples_per_iter[0] = samples_per_iter
+    _ticks.append((time.time(), lib.plot._iter[0]))
+    lib.plot.add_tick_hook(_on_tick)
+    server = HTTPServer((host, port), _Handler)
+    thread = threading.Thread(target=server.serve_forever, name='tflib.telemetry')
+    thread.daemon = True
+    thread.start()
+    print("Serving metrics on http://{}:{}/metrics".format(host, port))
+    return server
@@ -0,0 +1,84 @@
+"""
+Wall-clock timing of named phases of a training loop.
+
+    with lib.timing.phase('critic'):
+        with lib.timing.phase('data'):
+            _data = next(gen)
+        _disc_cost, _ = session.run(...)
+
+times 'critic' and 'critic.data'; nested phases are named after the phases
+enclosing them, so the same block timed in different places is reported
+separately. At every lib.plot.flush(), the mean, median and 99th percentile
+(in seconds) of each phase over the calls since the previous flush are plotted
+as 'time <phase> mean', 'time <phase> p50' and 'time <phase> p99'.
+"""
+
+import array
+import collections
+import contextlib
+import functools
+import threading
+import time
+
+import numpy as np
+
+import tflib as lib
+import tflib.plot
+
+_durations = collections.OrderedDict()
+_durations_lock = threading.Lock()
+_local = threading.local()
+
+# {phase: (mean, p50, p99)} as of the last flush
+summaries = {}
+
+def record(name, seconds):
+    with _durations_lock:
+        if name not in _durations:
+            _durations[name] = array.array('d')
+        _durations[name].append(seconds)
+
+@contextlib.contextmanager
+def phase(name):
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    _local.stack.append(name)
+    full_name = '.'.join(_local.stack)
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        record(full_name, time.time() - start_time)
+        _local.stack.pop()
+
+def timed(name=None):
+    """Decorator: times every call of the function as phase `name`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with phase(name or fn.__name__):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def summarize():
+    """returns: {phase: (mean, p50, p99)} of the calls since the last call"""
+    with _durations_lock:
+        durations = list(_durations.items())
+        _durations.clear()
+    result = collections.OrderedDict()
+    for name, seconds in durations:
+        seconds = np.asarray(seconds)
+        p50, p99 = np.percentile(seconds, [50, 99])
+        result[name] = (np.mean(seconds), p50, p99)
+    return result
+
+def _plot_summaries():
+    global summaries
+    summaries = summarize()
+    for name, (mean, p50, p99) in summaries.items():
+        lib.plot.plot('time {} mean'.format(name), mean)
+        lib.plot.plot('time {} p50'.format(name), p50)
+        lib.plot.plot('time {} p99'.format(name), p99)
+
+lib.plot.add_flush_hook(_plot_summaries)
@@ -0,0 +1,64 @@
+"""
+XLA compilation of the model graphs.
+
+    lib.xla.set_mode(XLA)
+    Generator, Discriminator = lib.xla.jit(Generator), lib.xla.jit(Discriminator)
+    with tf.Session(config=lib.xla.session_config()) as session:
+
+Modes:
+
+    None      no XLA
+    'auto'    auto-clustering: XLA compiles whatever clusters of the session's
+              graph it supports
+    'scopes'  only the ops built by jit()-wrapped builders (and their
+              gradients, including the gradient penalty's double backprop)
+              are compiled, as one cluster per call
+
+Either way the critic step's many small ops are fused into a few kernels,
+which mostly saves per-op dispatch overhead. The first steps are slower
+while the clusters compile.
+"""
+
+import contextlib
+import functools
+
+import tensorflow as tf
+
+MODES = [None, 'auto', 'scopes']
+
+_mode = None
+def set_mode(mode):
+    global _mode
+    mode = mode or None # '' from a flag means off
+    if mode not in MODES:
+        raise Exception('Unknown XLA mode {}'.format(mode))
+    _mode = mode
+
+def get_mode():
+    return _mode
+
+def session_config(config=None):
+    """returns: `config` (default: a new ConfigProto), with auto-clustering on in 'auto' mode"""
+    if config is None:
+        config = tf.ConfigProto()
+    if _mode == 'auto':
+        config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+    return config
+
+@contextlib.contextmanager
+def scope():
+    """Ops built inside are compiled together, in 'scopes' mode."""
+    if _mode != 'scopes':
+        yield
+        return
+    from tensorflow.contrib.compiler import jit
+    with jit.experimental_jit_scope(compile_ops=True, separate_compiled_gradients=False):
+        yield
+
+def jit(builder):
+    """Wraps a model builder so every call of it builds its ops in scope()."""
+    @functools.wraps(builder)
+    def wrapper(*args, **kwargs):
+        with scope():
+            return builder(*args, **kwargs)
+    return wrapper